@@ -2,6 +2,7 @@ import os
 
 from .temp import *
 from .task import *
+from .control import *
 from .view import *
 
 if __import__("ipymeteovis"):
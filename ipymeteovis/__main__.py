@@ -0,0 +1,56 @@
+"""Command-line entry point for making temp sets in batch
+
+The job file contains a list of jobs as a python literal, e.g.
+
+    [
+        {"source": "/data/NL/HRW", "task": "Radar polar volume (2D)",
+         "options": {"scan": "dataset1", "qty": "data1"}},
+        {"source": "/data/BE/JAB", "task": "Radar polar volume (2D)",
+         "options": {"scan": "dataset1", "qty": "data2"}, "name": "JAB"},
+    ]
+
+Usage: python -m ipymeteovis jobs.txt [--processes N] [--memory MB]
+       [--pipeline] [--backend process|thread|dask|tcp://host:port]
+"""
+
+import argparse
+import ast
+import sys
+
+from .temp import batch
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        prog="python -m ipymeteovis",
+        description="Make temp sets for a list of jobs with one shared "
+                    "worker pool."
+    )
+    p.add_argument("jobs", help="file with a list of jobs, '-' for stdin")
+    p.add_argument("-p", "--processes", type=int, default=None,
+                   help="number of worker processes (default: all cores)")
+    p.add_argument("-m", "--memory", type=float, default=None,
+                   help="memory budget of all the workers in MB")
+    p.add_argument("--pipeline", action="store_true",
+                   help="overlap reading and writing files with the "
+                        "processing")
+    p.add_argument("-b", "--backend", default=None,
+                   help="workers: process (default), thread, dask (local "
+                        "cluster) or the address of a dask scheduler")
+    args = p.parse_args(argv)
+
+    if args.jobs == "-":
+        jobs = ast.literal_eval(sys.stdin.read())
+    else:
+        with open(args.jobs, "r") as f:
+            jobs = ast.literal_eval(f.read())
+
+    t_dirs = batch(jobs, processes=args.processes, memory_budget=args.memory,
+                   pipeline=args.pipeline, backend=args.backend)
+    for t in t_dirs:
+        print(t)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
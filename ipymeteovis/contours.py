@@ -0,0 +1,170 @@
+"""Isolines of the stored frames of a temp set
+"""
+
+import os
+import json
+from functools import lru_cache
+
+try:
+    import contourpy
+except ImportError:  # matplotlib before 3.6, isolines are traced by its axes
+    contourpy = None
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.colors as colors
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from .util import write_atomic, frames_path, read_file
+from .series import Series
+
+
+class Contours(object):
+    """Isolines of the stored frames of a temp set as GeoJSON
+
+    Lines are traced on the cell centers of the frames, simplified by
+    Douglas-Peucker to about one pixel at the zoom level of the map and
+    rounded accordingly, and cached as compact GeoJSON files in
+    "frames/contours", one per frame, levels and zoom level.
+    """
+
+    def __init__(self, t_dir, levels=(30, 40, 50)):
+        self.path = frames_path(t_dir + "/temp")
+        self.levels = sorted(float(l) for l in levels)
+        p = read_file(t_dir + "/profile.txt")
+        self.colors = [colors.to_hex(c) for c in self.get_colors(
+            p["task"]["options"].get("Colormap"), self.levels)]
+
+    @staticmethod
+    def get_colors(cmap, levels):
+        """Colors of the levels in the colormap of the temp set
+        :param cmap: tuple of colormap name, value range and norm type
+        :param levels:
+        :return:
+        """
+        if cmap is None:
+            return ["black"] * len(levels)
+        (v_min, v_max) = cmap[1]
+        if cmap[2] == "log":
+            norm = colors.LogNorm(vmin=v_min, vmax=v_max)
+        else:
+            norm = colors.Normalize(vmin=v_min, vmax=v_max)
+        return plt.get_cmap(cmap[0])(norm(levels))
+
+    def get(self, dt, zoom):
+        """GeoJSON of the isolines of a frame, traced once per zoom level
+        :param dt: time of the frame as in its file name
+        :param zoom: zoom level of the map
+        :return: dict of a feature collection, one feature per level
+        """
+        zoom = int(round(zoom))
+        fp = "%s/contours/%s_%s_z%d.json" % (
+            self.path, dt, "-".join("%g" % l for l in self.levels), zoom)
+        if os.path.exists(fp):
+            with open(fp, "r") as f:
+                return json.load(f)
+
+        frame = self.path + "/" + dt + ".npz"
+        data, geometry = Series.read_frame(frame)
+        wraps = self.wraps(frame)
+        x, y = self.get_centers(self.path, geometry, wraps)
+        if wraps:
+            # close the seam between the last and the first ray
+            data = np.vstack([data, data[:1]])
+        tolerance = 360.0 / 256 / 2 ** zoom  # degrees of a pixel
+        decimals = max(int(np.ceil(-np.log10(tolerance))) + 1, 0)
+        features = []
+        for level, color in zip(self.levels, self.colors):
+            lines = [np.round(self.simplify(l, tolerance), decimals)
+                     for l in self.trace(x, y, data, level)]
+            lines = [l.tolist() for l in lines if len(l) > 1]
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "MultiLineString",
+                             "coordinates": lines},
+                "properties": {"level": level,
+                               "style": {"color": color, "weight": 2,
+                                         "opacity": 1}}
+            })
+        result = {"type": "FeatureCollection", "features": features}
+        os.makedirs(self.path + "/contours", exist_ok=True)
+        write_atomic(fp, json.dumps(result, separators=(",", ":")).encode())
+        return result
+
+    @staticmethod
+    def wraps(fp):
+        """Whether a stored frame covers all the azimuths of a polar grid,
+        so its last ray is followed by its first one
+        :param fp: path of the frame file
+        :return:
+        """
+        with np.load(fp) as z:
+            return "wraps" in z.files and bool(z["wraps"])
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def get_centers(path, geometry, wraps=False):
+        """Longitudes and latitudes of the cell centers of a geometry
+        :param path: frames directory of the frames
+        :param geometry: grid key, shape and bounds of the frames
+        :param wraps: repeat the first row after the last one
+        :return: x and y, 1D for regular grids and 2D otherwise
+        """
+        key, shape, bounds = geometry
+        grid = None
+        if key:
+            grid = np.load(path + "/grid_" + key + ".npy")
+        x, y = Series.get_centers(grid, bounds, shape)
+        if wraps:
+            x, y = np.vstack([x, x[:1]]), np.vstack([y, y[:1]])
+        return x, y
+
+    @staticmethod
+    def trace(x, y, data, level):
+        """Trace the isolines of a level
+        :param x: longitudes of the cells, 1D or 2D
+        :param y: latitudes of the cells, 1D or 2D
+        :param data: values with NaN for missing cells
+        :param level:
+        :return: list of (n, 2) arrays of longitude and latitude
+        """
+        z = np.ma.masked_invalid(data)
+        if contourpy is not None:
+            return contourpy.contour_generator(x, y, z).lines(level)
+        # a figure of its own instead of pyplot, which is not thread safe
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        return ax.contour(x, y, z, levels=[level]).allsegs[0]
+
+    @staticmethod
+    def simplify(line, tolerance):
+        """Simplify a line by the Douglas-Peucker algorithm
+        :param line: (n, 2) array of points
+        :param tolerance: largest distance of a dropped point to the line
+        :return: (m, 2) array of the kept points
+        """
+        if len(line) < 3:
+            return line
+        keep = np.zeros(len(line), dtype=bool)
+        keep[[0, -1]] = True
+        stack = [(0, len(line) - 1)]
+        while stack:
+            i, j = stack.pop()
+            if j - i < 2:
+                continue
+            a, b = line[i], line[j]
+            d = b - a
+            p = line[i + 1:j] - a
+            n = np.hypot(d[0], d[1])
+            if n > 0:
+                dist = np.abs(d[0] * p[:, 1] - d[1] * p[:, 0]) / n
+            else:  # closed line, distance to the start
+                dist = np.hypot(p[:, 0], p[:, 1])
+            k = int(np.argmax(dist))
+            if dist[k] > tolerance:
+                k += i + 1
+                keep[k] = True
+                stack += [(i, k), (k, j)]
+        return line[keep]
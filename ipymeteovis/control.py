@@ -0,0 +1,1357 @@
+"""Central control of processing data files into temp sets
+
+The control class is for communicating with the front-end GUI, and to
+organize the tasks into parallel, see task for the tasks themselves.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import multiprocessing as mp
+import copy
+import bisect
+import traceback
+import queue
+import threading
+
+import h5py
+import numpy as np
+from dateutil import parser
+
+from .util import TEMP_SET_PATH, write_atomic, frames_path, read_file, \
+    write_file
+from .executor import Executor, BackgroundJob, parallel
+from .stats import Stats
+from .storage import Storage, Cache
+from .series import Series
+from .rolling import Rolling
+from .reader import Reader
+from .task import Task, Task2D
+
+PIPELINE_READERS = 2  # threads reading source files ahead
+PIPELINE_WRITERS = 2  # threads encoding and writing frames and images
+
+
+class Control(object):
+    """Central control of data processing before visualization.
+
+    With a memory budget (MB), the number of files processed at the same
+    time is limited so that their estimated memory fits into the budget.
+    With pipeline, reading and writing files overlap with the processing,
+    see Control.pipeline. The backend runs the workers, on this machine or
+    on a cluster, see Executor.
+    """
+
+    def __init__(self, data_path, memory_budget=None, pipeline=False,
+                 backend=None):
+        self.data_path = data_path
+        self.memory_budget = memory_budget
+        self.pipeline = pipeline
+        self.backend = backend
+        self.file_list = []
+
+        # get file list
+        for r, d, fs in os.walk(data_path):
+            fs = [r + "/" + f for f in fs if not f.startswith('.')]
+            self.file_list += fs
+
+    def choose_task(self, task):
+        """First hand-shake between the GUI and the task controller.
+
+        By specifying the task and dataset, a list of option will be returned
+        to the GUI for users to choose and generate the config.
+        :param data_path:
+        :param task:
+        :return:
+        """
+        sample_file = self.file_list[0]
+        t = Task(file_path=sample_file, task=task)
+        o_list = t.get_options()
+        return o_list
+
+    def open_data(self, task, options, precision=None):
+        """Open the files as a lazy time-indexed xarray DataArray, see Reader
+        :param task: task of the files
+        :param options: options of the task, as in the config of submit
+        :param precision: "float32" to decode the data as float32
+        :return:
+        """
+        config = {"task": task, "options": options}
+        if precision is not None:
+            config["precision"] = precision
+        return Reader(self.file_list, config).get()
+
+    def submit(self, config, cancel=None, progress=None):
+        """Second hand-shake between GUI and the task controller.
+
+        Submit task and make selection as the result. Task will be separated
+        by files and processed in parallel. A selection is generated as a
+        result. Physically, a selection is a directory including a profile
+        file and a sub-directory of temporal files.
+        :param config:
+        :param cancel: threading.Event to stop the processing, optional
+        :param progress: function called with the number of finished and
+        total files, optional
+        :return:
+        """
+        if config["task"] is None:
+            print("[ERROR] Please choose your task")
+            return
+
+        # one temp set per selection of options, files are read only once
+        selections = config.get("selections") or [config["options"]]
+        subs = []
+        for o in selections:
+            c = copy.deepcopy(config)
+            c.pop("selections", None)
+            c["options"] = o
+            subs.append(Submission(self.create_set(c), self.file_list))
+        stats = self.schedule(subs, memory_budget=self.memory_budget,
+                              cancel=cancel, progress=progress,
+                              pipeline=self.pipeline, backend=self.backend)
+        return stats[0] if len(stats) == 1 else stats
+
+    def submit_async(self, config):
+        """Submit task in the background, see submit.
+        :param config:
+        :return: BackgroundJob, awaitable for the statistics
+        """
+        return BackgroundJob(self.submit, copy.deepcopy(config))
+
+    def estimate(self, config, samples=3, processes=None, cancel=None,
+                 progress=None):
+        """Estimate the cost of a submit without making a temp set.
+
+        A few files spread over the list are read, processed and rendered by
+        the workers as in submit, into a scratch directory that is removed
+        afterwards. Wall time, peak memory and output size are extrapolated
+        from them to the files that are not in the Cache yet, with as many
+        workers as fit into the memory budget. The memory is that of the
+        files processed at the same time, above the baseline of the worker
+        processes, as the memory budget.
+        :param config: config as in submit, of the first selection only
+        :param samples: number of files to sample
+        :param processes: number of worker processes, all cores by default
+        :param cancel: threading.Event to stop the sampling, optional
+        :param progress: function called with the number of finished and
+        total jobs of the sampling, optional
+        :return: dict of the estimate, None if no sample succeeded
+        """
+        if config["task"] is None:
+            print("[ERROR] Please choose your task")
+            return
+        config = copy.deepcopy(config)
+        config["options"] = (config.pop("selections", None) or
+                             [config["options"]])[0]
+        processes = processes or mp.cpu_count()
+        todo = [f for f in self.file_list
+                if not Cache.contains(f, config)]
+        n = len(todo)
+        k = min(samples, n)
+        picks = [todo[j * (n - 1) // max(k - 1, 1)] for j in range(k)]
+        estimate = {
+            "files": len(self.file_list),
+            "cached": len(self.file_list) - n,
+            "samples": k,
+            "workers": 0,
+            "wall": 0,
+            "memory": 0,
+            "bytes": 0,
+            "stages": {}
+        }
+        if not picks:
+            return estimate
+
+        # sample files, on the same disk as the temp sets
+        t_dir = tempfile.mkdtemp(prefix=".estimate_", dir=TEMP_SET_PATH)
+        temp_path = os.path.abspath(t_dir + "/temp")
+        os.mkdir(temp_path)
+        os.mkdir(frames_path(temp_path))
+        records = []
+        count = [0, k]
+
+        def on_result(rs):
+            records.extend(rs)
+            count[0] += 1
+            if progress is not None:
+                progress(count[0], count[1])
+
+        print("[STEP] Sample " + str(k) + " of " + str(n) + " files......",
+              end="")
+        try:
+            Control.parallel(Control.work_item,
+                             [(f, [(0, config, temp_path)]) for f in picks],
+                             callback=on_result, processes=min(k, processes),
+                             cancel=cancel, backend=self.backend)
+            frames = [r["frame"] for r in records if r["error"] is None]
+            if config["options"].get("range") == "dataset" and frames:
+                # rendered once the range is known, see Submission
+                task = Task(file_path=None, task=config["task"])
+                task.set_style(config.get("style"))
+                v_range = task.get_range(
+                    task.merge([task.read_summary(f) for f in frames]))
+                if v_range is not None:
+                    count[1] += len(frames)
+                    Control.parallel(
+                        Control.render_item,
+                        [(0, f, config, temp_path, v_range) for f in frames],
+                        callback=on_result, processes=min(k, processes),
+                        cancel=cancel, backend=self.backend)
+            sizes = {"grid": 0, "files": 0}
+            for p in [temp_path, frames_path(temp_path)]:
+                for f in os.listdir(p):
+                    key = "grid" if f.startswith("grid_") else "files"
+                    sizes[key] += os.path.getsize(p + "/" + f)
+        finally:
+            shutil.rmtree(t_dir, ignore_errors=True)
+        print("Done!")
+        for r in records:
+            if r["error"] is not None:
+                print("[ERROR] " + r["file"] + ": " + r["error"])
+        if not frames:
+            print("[ERROR] No file could be processed")
+            return
+
+        # seconds per file by stage, of the processing and the rendering,
+        # and the peak memory of a file above the baseline of its worker
+        stages = {}
+        peak = 0
+        for r in records:
+            if r["error"] is not None:
+                continue
+            for stage, s in r["stats"]["stages"].items():
+                stages[stage] = stages.get(stage, 0) + s["wall"] / \
+                    len(frames)
+            peak = max(peak, r["stats"]["peak"])
+        workers = processes
+        if self.memory_budget is not None and peak > 0:
+            workers = max(min(int(self.memory_budget // peak), processes), 1)
+        estimate.update({
+            "workers": workers,
+            "wall": n * sum(stages.values()) / workers,
+            "memory": workers * peak,
+            "bytes": n * sizes["files"] / len(frames) + sizes["grid"],
+            "stages": stages
+        })
+        print("[STEP] Estimate for " + str(n) + " files on " + str(workers) +
+              " workers: " + Stats.format_time(estimate["wall"]) + ", " +
+              "%.0f MB of memory, " % estimate["memory"] +
+              "%.1f MB of output" % (estimate["bytes"] / 1024 ** 2))
+        return estimate
+
+    def estimate_async(self, config, samples=3):
+        """Estimate the cost of a submit in the background, see estimate.
+        :param config:
+        :param samples: number of files to sample
+        :return: BackgroundJob, awaitable for the estimate
+        """
+        return BackgroundJob(self.estimate, copy.deepcopy(config),
+                             samples=samples)
+
+    def create_set(self, config):
+        """Create the directory of a new temp set for the config.
+
+        The profile is a stub with the config, it is completed once the first
+        file is done.
+        :param config:
+        :return: path of the temp set directory
+        """
+        id = str(time.time_ns())
+        t_dir = TEMP_SET_PATH + "/" + id
+        temp_path = t_dir + "/temp"
+        os.mkdir(t_dir)  # temp directory
+        os.mkdir(temp_path)  # temp file directory
+        os.mkdir(frames_path(temp_path))  # frame data directory
+
+        t_profile = {
+            "source": self.data_path,
+            "temp_path": temp_path,
+            "config": config,
+            "status": "incomplete",
+            "task": copy.deepcopy(config)
+        }
+        write_file(t_dir + "/profile.txt", t_profile)
+        Storage.touch(t_dir, quota=Storage.get_quota() is not None)
+        return t_dir
+
+    def resume(self, t_dir):
+        """Continue an interrupted or partly failed submit.
+
+        Only files that are not listed in the checkpoint of the temp set are
+        processed, with the config stored in its profile. Errors of the
+        earlier runs stay in "errors.txt", marked as resolved once their
+        file is completed. See also resume of the temp module, which takes
+        the id of the temp set as listed by list().
+        :param t_dir: path of the temp set directory, e.g. Temp(id).temp_path
+        :return:
+        """
+        t_profile = read_file(t_dir + "/profile.txt")
+        if t_profile is None or "config" not in t_profile:
+            print("[ERROR] Temp set cannot be resumed: " + t_dir)
+            return
+        if "derive" in t_profile["config"]:
+            print("[ERROR] Derived temp set cannot be resumed, derive it "
+                  "again: " + t_dir)
+            return
+
+        done = set(self.read_checkpoint(t_dir))
+        file_list = [f for f in self.file_list if f not in done]
+        print("[STEP] Resume task, " + str(len(done)) + " done, " +
+              str(len(file_list)) + " to go")
+        return self.run(t_dir, file_list)
+
+    def run(self, t_dir, file_list):
+        """Process files of a temp set, checkpointing each completed file.
+
+        Every file is read, processed and rendered by one job. Exceptions are
+        caught per file and collected in "errors.txt" instead of aborting the
+        pool, completed files are appended to "checkpoint.txt" as soon as
+        they are done so an interrupted run loses no finished work.
+        :param t_dir: path of the temp set directory
+        :param file_list: source files to process
+        :return: statistics of all the completed files of the temp set
+        """
+        return self.schedule([Submission(t_dir, file_list)],
+                             memory_budget=self.memory_budget,
+                             pipeline=self.pipeline, backend=self.backend)[0]
+
+    @staticmethod
+    def batch(jobs, processes=None, memory_budget=None, pipeline=False,
+              backend=None):
+        """Make temp sets for a list of jobs with one shared worker pool.
+
+        A job is a dict with "source" (data directory), "task" and "options"
+        as in the config of submit, "name", "desc", "precision", "encoding"
+        and "compression" are optional.
+        :param jobs: list of job dicts
+        :param processes: number of worker processes, all cores by default
+        :param memory_budget: memory budget of all the workers in MB
+        :param pipeline: overlap reading and writing with the processing
+        :param backend: backend running the workers, see Executor
+        :return: list of paths of the created temp sets
+        """
+        subs = []
+        for j in jobs:
+            if j.get("task") not in Task.tasks:
+                print("[ERROR] Unknown task " + str(j.get("task")) +
+                      ", job skipped: " + str(j.get("source")))
+                continue
+            c = Control(j["source"])
+            config = {
+                "name": j.get("name", "DEFAULT_NAME"),
+                "desc": j.get("desc", "DEFAULT_DESC"),
+                "task": j["task"],
+                "options": j.get("options", {}),
+            }
+            for k in ["precision", "encoding", "compression"]:
+                if k in j:
+                    config[k] = j[k]
+            t_dir = c.create_set(config)
+            subs.append(Submission(t_dir, c.file_list))
+            print("[STEP] Job " + str(len(subs) - 1) + ": " + j["source"] +
+                  " -> " + t_dir)
+        Control.schedule(subs, processes=processes,
+                         memory_budget=memory_budget, pipeline=pipeline,
+                         backend=backend)
+        return [s.t_dir for s in subs]
+
+    @staticmethod
+    def derive(t_dir, op, window=12, name=None, processes=None):
+        """Make a temp set from the frames of another one by an operator
+        over a window sliding in time, see Rolling.
+
+        The output frames are split into chunks processed in parallel, each
+        chunk starts window - 1 frames early to fill its window. The frames
+        are rendered with a dataset-wide colormap range, the difference of
+        frames with a diverging colormap centered at zero.
+        :param t_dir: path of the source temp set directory
+        :param op: "sum", "mean", "max", "min" or "diff"
+        :param window: number of frames in the window
+        :param name: name of the new temp set
+        :param processes: number of worker processes, all cores by default
+        :return: path of the new temp set directory
+        """
+        profile = read_file(t_dir + "/profile.txt")
+        if profile is None or "config" not in profile:
+            print("[ERROR] Temp set cannot be derived from: " + t_dir)
+            return
+        window = Rolling(op, window).window
+        Storage.touch(t_dir)
+        fp = frames_path(profile["temp_path"])
+        frames = sorted([fp + "/" + f for f in os.listdir(fp)
+                         if f.endswith(".npz")]) if os.path.isdir(fp) else []
+        if len(frames) < window:
+            print("[ERROR] " + str(len(frames)) + " frame(s) stored, at " +
+                  "least " + str(window) + " needed: " + t_dir)
+            return
+
+        config = copy.deepcopy(profile["config"])
+        config["name"] = name or "%s (%s of %d)" % (config["name"], op,
+                                                    window)
+        config["options"]["range"] = "dataset"
+        config["derive"] = {"source": t_dir, "op": op, "window": window}
+        if op == "diff":
+            config["style"] = {"cmap": "RdBu_r", "norm": "linear",
+                               "symmetric": True}
+        c = Control(profile["source"])
+        new_dir = c.create_set(config)
+
+        # the new set shows like the source, with its own colormap
+        p = read_file(new_dir + "/profile.txt")
+        p["task"] = copy.deepcopy(profile["task"])
+        p["task"]["name"] = config["name"]
+        options = p["task"]["options"]
+        style = config.get("style") or {}
+        if "Colormap" in options:
+            cmap, v_range, norm = options["Colormap"]
+            options["Colormap"] = (style.get("cmap", cmap), v_range,
+                                   style.get("norm", norm))
+        options["Derived"] = "%s of %d frames" % (op, window)
+        write_file(new_dir + "/profile.txt", p)
+
+        # chunks of the output frames with the frames filling the window
+        processes = processes or mp.cpu_count()
+        n = len(frames) - window + 1
+        size = max(-(-n // (processes * 2)), window)
+        args = [(0, frames[k - window + 1:k + size], window - 1, op, window,
+                 config, p["temp_path"])
+                for k in range(window - 1, len(frames), size)]
+        print("[STEP] Derive " + str(n) + " frames by " + op + " of " +
+              str(window) + " in " + str(len(args)) + " chunks......",
+              end="")
+        Control.run_derived(new_dir, frames[window - 1:], Control.derive_item,
+                            args, processes)
+        return new_dir
+
+    @staticmethod
+    def compare(t_dir_a, t_dir_b, op="diff", resolution=1.0, tolerance=150,
+                name=None, processes=None):
+        """Make a temp set of the difference or ratio of two temp sets.
+
+        Frames are matched on time, a frame of the first set with the
+        nearest frame of the second one within the tolerance. Both are
+        resampled onto a regular grid over the overlap of their bounds by
+        index maps from the cells of the grid to the cells of the frames,
+        computed once per geometry, see Series.get_index. The result is
+        shown with a diverging colormap, centered at zero for differences
+        and at one for ratios. A comparison is made once and reused as long
+        as the two sets are unchanged.
+        :param t_dir_a: path of the first temp set directory
+        :param t_dir_b: path of the second temp set directory
+        :param op: "diff" (a - b) or "ratio" (a / b)
+        :param resolution: cell size of the grid in km
+        :param tolerance: largest time difference of matched frames in
+        seconds
+        :param name: name of the new temp set
+        :param processes: number of worker processes, all cores by default
+        :return: path of the new temp set directory
+        """
+        if op not in ["diff", "ratio"]:
+            print("[ERROR] Unknown operation: " + str(op))
+            return
+        profiles = [read_file(t + "/profile.txt")
+                    for t in [t_dir_a, t_dir_b]]
+        if None in profiles or \
+                any("Bounds" not in p["task"]["options"] for p in profiles):
+            print("[ERROR] Temp sets cannot be compared: " + t_dir_a +
+                  ", " + t_dir_b)
+            return
+        derive = {"sources": [t_dir_a, t_dir_b], "op": op,
+                  "resolution": resolution, "tolerance": tolerance}
+        for t in [t_dir_a, t_dir_b]:
+            Storage.touch(t)
+
+        # reuse a comparison that is newer than both sets
+        changed = max(os.path.getmtime(t + "/profile.txt")
+                      for t in [t_dir_a, t_dir_b])
+        for d in sorted(os.listdir(TEMP_SET_PATH), reverse=True):
+            fp = TEMP_SET_PATH + "/" + d + "/profile.txt"
+            if not os.path.isfile(fp) or os.path.getmtime(fp) < changed:
+                continue
+            p = read_file(fp)
+            if p is not None and p.get("status") == "complete" and \
+                    p.get("config", {}).get("derive") == derive:
+                print("[STEP] Comparison exists: " + os.path.dirname(fp))
+                return os.path.dirname(fp)
+
+        # frames matched on time
+        frames = []
+        for p in profiles:
+            fp = frames_path(p["temp_path"])
+            fs = sorted([fp + "/" + f for f in os.listdir(fp)
+                         if f.endswith(".npz")]) if os.path.isdir(fp) else []
+            frames.append(fs)
+        times = [[parser.parse(os.path.splitext(os.path.basename(f))[0])
+                  for f in fs] for fs in frames]
+        pairs = []
+        for k in range(len(frames[0])):
+            t = times[0][k]
+            j = bisect.bisect_left(times[1], t)
+            near = [j for j in [j - 1, j] if 0 <= j < len(times[1])]
+            if not near:
+                continue
+            j = min(near, key=lambda j: abs(times[1][j] - t))
+            if abs((times[1][j] - t).total_seconds()) <= tolerance:
+                pairs.append((frames[0][k], frames[1][j]))
+        if not pairs:
+            print("[ERROR] No frames at matching times: " + t_dir_a + ", " +
+                  t_dir_b)
+            return
+
+        # regular grid over the overlap
+        (a0, a1), (b0, b1) = [p["task"]["options"]["Bounds"]
+                              for p in profiles]
+        lat_min, lon_min = max(a0[0], b0[0]), max(a0[1], b0[1])
+        lat_max, lon_max = min(a1[0], b1[0]), min(a1[1], b1[1])
+        if lat_min >= lat_max or lon_min >= lon_max:
+            print("[ERROR] Temp sets do not overlap: " + t_dir_a + ", " +
+                  t_dir_b)
+            return
+        d_lat = resolution / 111.2
+        d_lon = d_lat / float(np.cos(np.radians((lat_min + lat_max) / 2)))
+        nrows = max(int(np.ceil((lat_max - lat_min) / d_lat)), 1)
+        ncols = max(int(np.ceil((lon_max - lon_min) / d_lon)), 1)
+        target = (lat_max, lon_min, d_lat, d_lon, nrows, ncols)
+        bounds = [[lat_max - nrows * d_lat, lon_min],
+                  [lat_max, lon_min + ncols * d_lon]]
+
+        names = [p["task"]["name"] for p in profiles]
+        config = {
+            "name": name or names[0] + (" - " if op == "diff" else " / ") +
+            names[1],
+            "desc": "",
+            "task": Task.tasks[2],  # rendered as a regular grid
+            "options": {"range": "dataset"},
+            "derive": derive,
+            "style": {"cmap": "RdBu_r", "symmetric": True,
+                      "norm": "linear" if op == "diff" else "log"}
+        }
+        for k in ["encoding", "compression"]:
+            if k in profiles[0]["config"]:
+                config[k] = profiles[0]["config"][k]
+        c = Control(profiles[0]["source"])
+        new_dir = c.create_set(config)
+        p = read_file(new_dir + "/profile.txt")
+        p["task"]["options"] = {
+            "Compared": op + " of " + t_dir_a + " and " + t_dir_b,
+            "Bounds": bounds,
+            "Colormap": ("RdBu_r", (0, 1), config["style"]["norm"])
+        }
+        write_file(new_dir + "/profile.txt", p)
+
+        processes = processes or mp.cpu_count()
+        size = max(-(-len(pairs) // (processes * 2)), 1)
+        args = [(0, pairs[k:k + size], op, target, config, p["temp_path"])
+                for k in range(0, len(pairs), size)]
+        print("[STEP] Compare " + str(len(pairs)) + " frames on a grid of " +
+              str(nrows) + " x " + str(ncols) + "......", end="")
+        Control.run_derived(new_dir, [a for a, b in pairs],
+                            Control.compare_item, args, processes)
+        return new_dir
+
+    @staticmethod
+    def run_derived(t_dir, file_list, job, args, processes):
+        """Compute the frames of a derived temp set and render them with a
+        dataset-wide colormap range
+        :param t_dir: path of the derived temp set directory
+        :param file_list: source frames of the output frames
+        :param job: function computing the frames of an arg
+        :param args:
+        :param processes: number of worker processes
+        :return: statistics of the derived temp set
+        """
+        sub = Submission(t_dir, file_list)
+
+        def on_result(rs):
+            for r in rs:
+                sub.add(r)
+
+        try:
+            Control.parallel(job, args, callback=on_result,
+                             processes=processes)
+            args = sub.get_render_args(0)
+            if args:
+                print("Done!")
+                print("[STEP] Render " + str(len(args)) + " frames with "
+                      "dataset-wide colormap range......", end="")
+                Control.parallel(Control.render_item, args,
+                                 callback=on_result, processes=processes)
+        finally:
+            sub.close()
+        print("Done!")
+        stats = sub.finish(processes)
+        Storage.evict(keep=[t_dir])
+        return stats
+
+    @staticmethod
+    def schedule(subs, processes=None, memory_budget=None, cancel=None,
+                 progress=None, pipeline=False, backend=None):
+        """Process the files of several submissions with one worker pool.
+
+        Files of all the submissions are interleaved round-robin, so the pool
+        stays busy across temp sets and every temp set progresses at the same
+        pace. A file needed by several submissions is scheduled once and
+        serves all of them from a single open.
+        :param subs: list of Submission
+        :param processes: number of worker processes, all cores by default
+        :param memory_budget: memory budget of all the workers in MB
+        :param cancel: threading.Event to stop the processing, files that are
+        not finished are left for resume
+        :param progress: function called with the number of finished and
+        total files of the current step
+        :param pipeline: read and write files in threads of the main process,
+        overlapping with the processing in the pool
+        :param backend: backend running the workers, see Executor
+        :return: list of statistics, one per submission
+        """
+        processes = processes or mp.cpu_count()
+        metrics = None
+        targets = {}
+        args = []
+        cached = []
+        n = max([len(s.file_list) for s in subs] + [0])
+        for k in range(n):
+            for i in range(len(subs)):
+                s = subs[i]
+                if k >= len(s.file_list):
+                    continue
+                fp = s.file_list[k]
+                r = Cache.get(fp, s.config, i, s.temp_path)
+                if r is not None:
+                    cached.append(r)  # made before, linked from the cache
+                    continue
+                if fp not in targets:
+                    targets[fp] = []
+                    args.append((fp, targets[fp]))
+                targets[fp].append((i, s.config, s.temp_path))
+
+        # estimated memory of each file, targets of a file run one by one
+        weights = None
+        budget = None
+        if memory_budget is not None:
+            budget = memory_budget * 1024 ** 2
+            w = [s.estimate_memory() for s in subs]
+            weights = [max(w[i] for i, c, t in a[1]) for a in args]
+            n = int(budget // max(weights + [1]))
+            print("[STEP] Estimated memory per file: " +
+                  str(round(max(weights + [0]) / 1024 ** 2)) + " MB, " +
+                  str(max(min(n, processes), 1)) + " file(s) at a time")
+
+        count = [0, len(args)]  # finished and total files of the step
+
+        def on_result(rs):
+            for r in rs:
+                s = subs[r["job"]]
+                s.add(r)
+                if r["error"] is None and not r.get("render"):
+                    try:
+                        Cache.put(r, s.config, s.temp_path)
+                    except OSError as e:
+                        print("[ERROR] Frame not cached: " + repr(e))
+            count[0] += 1
+            if progress is not None:
+                progress(count[0], count[1])
+
+        for r in cached:
+            subs[r["job"]].add(r)
+        if cached:
+            print("[STEP] " + str(len(cached)) + " file(s) taken from the "
+                  "cache")
+        print("[STEP] Process " + str(len(args)) + " files for " +
+              str(len(subs)) + " temp set(s)......", end="")
+        try:
+            if pipeline:
+                metrics = Control.pipeline(
+                    args, callback=on_result, processes=processes,
+                    weights=weights, budget=budget, cancel=cancel,
+                    backend=backend)
+                for s in subs:
+                    s.pipeline = metrics
+            else:
+                Control.parallel(Control.work_item, args, callback=on_result,
+                                 processes=processes, weights=weights,
+                                 budget=budget, cancel=cancel,
+                                 backend=backend)
+
+            # render stored frames with a dataset-wide colormap range
+            args = []
+            if cancel is None or not cancel.is_set():
+                for i in range(len(subs)):
+                    args += subs[i].get_render_args(i)
+            if args:
+                print("Done!")
+                print("[STEP] Render " + str(len(args)) + " frames with "
+                      "dataset-wide colormap range......", end="")
+                count[:] = [0, len(args)]
+                Control.parallel(Control.render_item, args,
+                                 callback=on_result, processes=processes,
+                                 cancel=cancel, backend=backend)
+        finally:
+            for s in subs:
+                s.close()
+        if cancel is not None and cancel.is_set():
+            print("Cancelled!")
+            for s in subs:
+                s.cancelled = True
+        else:
+            print("Done!")
+        if metrics is not None:
+            bottleneck = max(metrics, key=lambda k: metrics[k]["occupancy"])
+            print("[STEP] Pipeline occupancy: " + ", ".join(
+                [k + " " + str(round(m["occupancy"] * 100)) + "%"
+                 for k, m in metrics.items()]) + ", bottleneck: " +
+                bottleneck)
+
+        result = []
+        for s in subs:
+            if len(subs) > 1:
+                print("[STEP] " + s.t_dir + ":")
+            result.append(s.finish(processes))
+        Storage.evict(keep=[s.t_dir for s in subs])
+        return result
+
+    @staticmethod
+    def work_item(item):
+        file_path, targets = item
+        return Control.work(file_path, targets)
+
+    @staticmethod
+    def pipe_item(item):
+        """Process a file, see Control.pipeline
+        :param item: file path and targets, see Control.work
+        :return: records of the file with the deferred outputs
+        """
+        file_path, targets = item
+        return Control.work(file_path, targets, defer=True)
+
+    @staticmethod
+    def render_item(item):
+        """Render a stored frame with the given colormap range
+        :param item: tuple of job index, frame file, config, temp path and
+        colormap range
+        :return: list with the record of the frame
+        """
+        i, fp, config, temp_path, v_range = item
+        try:
+            task = Task(file_path=fp, task=config["task"])
+            task.set_style(config.get("style"))
+            with task.stats.measure("load"):
+                task.load_frame(fp)
+            if v_range is not None:  # else the range of the frame
+                task.v_min, task.v_max = v_range
+            task.create_temp(temp_path=temp_path,
+                             encoding=config.get("encoding"),
+                             level=config.get("compression"))
+            return [{
+                "job": i,
+                "file": fp,
+                "error": None,
+                "render": True,
+                "stats": task.stats.to_dict()
+            }]
+        except Exception as e:
+            return [{
+                "job": i,
+                "file": fp,
+                "error": repr(e),
+                "render": True,
+                "traceback": traceback.format_exc()
+            }]
+
+    @staticmethod
+    def derive_item(item):
+        """Apply a sliding window operator to a chunk of stored frames
+        :param item: tuple of job index, frame files in time order, number
+        of leading frames only filling the window, operator, window, config
+        and temp path of the derived set
+        :return: list of records, one per output frame
+        """
+        i, frames, skip, op, window, config, temp_path = item
+        result = []
+        try:
+            rolling = Rolling(op, window)
+            for k in range(len(frames)):
+                task = Task(file_path=frames[k], task=config["task"])
+                task.set_style(config.get("style"))
+                with task.stats.measure("load"):
+                    task.load_frame(frames[k])
+                with task.stats.measure("process"):
+                    data = rolling.push(np.ma.filled(task.data, np.nan))
+                if k < skip or data is None:
+                    continue
+                task.data = np.ma.masked_invalid(data, copy=False)
+                with task.stats.measure("store"):
+                    summary = task.summarize()
+                    fp = task.save_frame(frames_path(temp_path), summary)
+                task.stats.add_io("store", written=os.path.getsize(fp))
+                result.append({
+                    "job": i,
+                    "file": frames[k],
+                    "error": None,
+                    "dt": task.dt,
+                    "frame": fp,
+                    "summary": summary,
+                    "stats": task.stats.to_dict()
+                })
+        except Exception as e:
+            # the rest of the chunk fails with the frame
+            done = set(r["file"] for r in result)
+            result += [{
+                "job": i,
+                "file": f,
+                "error": repr(e),
+                "traceback": traceback.format_exc()
+            } for f in frames[skip:] if f not in done]
+        return result
+
+    @staticmethod
+    def compare_item(item):
+        """Compare pairs of stored frames on a regular grid
+        :param item: tuple of job index, pairs of frame files, operation,
+        regular grid, config and temp path of the comparison
+        :return: list of records, one per pair
+        """
+        i, pairs, op, target, config, temp_path = item
+        lat_max, lon_min, d_lat, d_lon, nrows, ncols = target
+        result = []
+        for fa, fb in pairs:
+            try:
+                task = Task(file_path=fa, task=config["task"])
+                task.set_style(config.get("style"))
+                with task.stats.measure("load"):
+                    a, ga = Series.read_frame(fa)
+                    b, gb = Series.read_frame(fb)
+                with task.stats.measure("process"):
+                    values = []
+                    for data, g, f in [(a, ga, fa), (b, gb, fb)]:
+                        idx = Series.get_index(os.path.dirname(f), g, target)
+                        v = data.ravel()[idx]
+                        v[idx < 0] = np.nan
+                        values.append(v)
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        if op == "diff":
+                            data = values[0] - values[1]
+                        else:
+                            data = values[0] / values[1]
+                    data[~np.isfinite(data)] = np.nan
+                task.data = np.ma.masked_invalid(data, copy=False)
+                task.bounds = [[lat_max - nrows * d_lat, lon_min],
+                               [lat_max, lon_min + ncols * d_lon]]
+                task.dt = os.path.splitext(os.path.basename(fa))[0]
+                with task.stats.measure("store"):
+                    summary = task.summarize()
+                    fp = task.save_frame(frames_path(temp_path), summary)
+                task.stats.add_io("store", written=os.path.getsize(fp))
+                result.append({
+                    "job": i,
+                    "file": fa,
+                    "error": None,
+                    "dt": task.dt,
+                    "frame": fp,
+                    "summary": summary,
+                    "stats": task.stats.to_dict()
+                })
+            except Exception as e:
+                result.append({
+                    "job": i,
+                    "file": fa,
+                    "error": repr(e),
+                    "traceback": traceback.format_exc()
+                })
+        return result
+
+    @staticmethod
+    def work(file_path, targets, defer=False):
+        """Read, process and render a single file for one or more targets.
+
+        The file is opened once and shared by all the targets, a target is a
+        tuple of job index, config and temp path. Only small records are sent
+        back to the main process, any exception is returned as part of the
+        record of its target. Processed data are stored as frames, with a
+        dataset-wide colormap range they are rendered afterwards.
+        :param file_path:
+        :param targets:
+        :param defer: return the frames and the pixels of the images as
+        "outputs" of the records instead of writing them, see
+        Control.write_outputs
+        :return: list of records, one per target
+        """
+        def failed(i, e):
+            return {
+                "job": i,
+                "file": file_path,
+                "error": repr(e),
+                "traceback": traceback.format_exc()
+            }
+
+        try:
+            f = h5py.File(file_path, "r")
+        except Exception as e:
+            return [failed(i, e) for i, config, temp_path in targets]
+
+        result = []
+        with f:
+            for i, config, temp_path in targets:
+                try:
+                    task = Task(file_path=file_path, task=config["task"])
+                    task.process(config=config, f=f)
+                    outputs = []
+                    with task.stats.measure("store"):
+                        summary = task.summarize()
+                        fp = task.save_frame(frames_path(temp_path), summary,
+                                             defer=defer)
+                    if defer:
+                        fp, frame = fp
+                        outputs.append(("frame", fp, frame))
+                    else:
+                        task.stats.add_io("store",
+                                          written=os.path.getsize(fp))
+                    if config["options"].get("range") != "dataset":
+                        img = task.create_temp(
+                            temp_path=temp_path, defer=defer,
+                            encoding=config.get("encoding"),
+                            level=config.get("compression"))
+                        if defer:
+                            outputs.append(("image",) + img)
+                    result.append({
+                        "job": i,
+                        "file": file_path,
+                        "error": None,
+                        "dt": task.dt,
+                        "frame": fp,
+                        "grid": task.get_geometry()[0],
+                        "summary": summary,
+                        "profile": task.get_profile(config, f=f),
+                        "stats": task.stats.to_dict(),
+                        "outputs": outputs
+                    })
+                except Exception as e:
+                    result.append(failed(i, e))
+        return result
+
+    @staticmethod
+    def write_outputs(rs):
+        """Encode and write the deferred outputs of the records from
+        Control.work
+        :param rs: list of records
+        :return: bytes written
+        """
+        written = 0
+        for r in rs:
+            t = time.perf_counter()
+            try:
+                for kind, fp, content in r.pop("outputs", []):
+                    if kind == "frame":
+                        content = Task2D.encode_frame(content)
+                    else:
+                        ext, content = Task2D.encode_pixels(*content)
+                        fp += ext
+                    write_atomic(fp, content)
+                    written += len(content)
+                    stage = r["stats"]["stages"].setdefault(
+                        "write", dict.fromkeys(Stats.fields, 0))
+                    stage["wall"] = time.perf_counter() - t
+                    stage["written"] += len(content)
+            except Exception as e:
+                r.update({
+                    "error": repr(e),
+                    "traceback": traceback.format_exc()
+                })
+        return written
+
+    @staticmethod
+    def pipeline(args, callback, processes=None, weights=None, budget=None,
+                 cancel=None, backend=None):
+        """Process files in a pipeline of reading, processing and writing
+
+        Reader threads read the source files ahead of the pool into the page
+        cache of the system, the pool decodes and processes the files, and
+        writer threads compress and write the frames and encode and write
+        the images. Bounded queues between the stages hold back a stage that
+        runs ahead of the next one. Dispatching to the pool follows
+        Control.parallel.
+
+        The decompression of the source files stays in the workers: h5py
+        holds a global lock, so decoding in threads of the main process
+        would run one file at a time, and decoded arrays are larger than
+        the files to pass to worker processes. Files are not read ahead for
+        a remote executor, whose workers read them from the shared storage,
+        see Executor.
+
+        The occupancy of a stage is its busy time over its capacity in the
+        wall time, the stage with the highest occupancy is the bottleneck.
+        :param args: list of file path and targets, see Control.work
+        :param callback: called with the records of each file once written
+        :param processes: number of worker processes, all cores by default
+        :param weights: estimated memory of each arg
+        :param budget: memory budget of all the running args
+        :param cancel: threading.Event
+        :param backend: backend processing the files, see Executor
+        :return: dict of metrics per stage
+        """
+        ex = Executor.create(backend, processes)
+        processes = ex.workers
+        prefetch = not ex.remote
+        if budget is None:
+            weights = [0] * len(args)
+            budget = 0
+        depth = 2 * processes
+        todo = queue.Queue()
+        for i in range(len(args)):
+            todo.put(i)
+        read_q = queue.Queue(maxsize=depth)
+        write_q = queue.Queue(maxsize=depth)
+        events = queue.Queue()
+        stop = threading.Event()
+        busy = {"read": 0, "process": 0, "write": 0}
+        lock = threading.Lock()
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    i = todo.get_nowait()
+                except queue.Empty:
+                    return
+                t = time.perf_counter()
+                try:
+                    if prefetch:
+                        with open(args[i][0], "rb") as f:
+                            while f.read(1024 ** 2):
+                                pass  # kept in the page cache only
+                except OSError:
+                    pass  # reported by the worker
+                with lock:
+                    busy["read"] += time.perf_counter() - t
+                while not stop.is_set():
+                    try:
+                        read_q.put(i, timeout=0.2)
+                        events.put(("read",))
+                        break
+                    except queue.Full:
+                        continue
+
+        def writer():
+            while True:
+                item = write_q.get()
+                if item is None:
+                    return
+                i, rs = item
+                t = time.perf_counter()
+                Control.write_outputs(rs)
+                with lock:
+                    busy["write"] += time.perf_counter() - t
+                events.put(("written", i, rs))
+
+        threads = [threading.Thread(target=reader, daemon=True)
+                   for k in range(PIPELINE_READERS)]
+        threads += [threading.Thread(target=writer, daemon=True)
+                    for k in range(PIPELINE_WRITERS)]
+        for t in threads:
+            t.start()
+
+        start = time.perf_counter()
+        fill = {"read": 0, "write": 0}
+        samples = 0
+        head = None  # next file read, waiting for a free worker
+        running = {}
+        used = 0
+        finished = 0
+        try:
+            with ex:
+                while finished < len(args):
+                    if cancel is not None and cancel.is_set():
+                        ex.close(cancel=True)
+                        break
+
+                    # dispatch files that are read while they fit
+                    while len(running) < processes:
+                        if head is None:
+                            try:
+                                head = read_q.get_nowait()
+                            except queue.Empty:
+                                break
+                        i = head
+                        if running and used + weights[i] > budget:
+                            break
+                        running[i] = (weights[i], time.perf_counter())
+                        used += weights[i]
+                        ex.submit(Control.pipe_item, args[i],
+                                  lambda r, e, i=i: events.put(
+                                      ("done", i, r, e)))
+                        head = None
+
+                    samples += 1
+                    fill["read"] += read_q.qsize() / depth
+                    fill["write"] += write_q.qsize() / depth
+                    try:
+                        event = events.get(timeout=0.2)
+                    except queue.Empty:
+                        continue
+                    if event[0] == "done":
+                        i, rs, e = event[1:]
+                        w, t = running.pop(i)
+                        used -= w
+                        busy["process"] += time.perf_counter() - t
+                        if e is not None:
+                            raise e
+                        write_q.put((i, rs))
+                    elif event[0] == "written":
+                        finished += 1
+                        callback(event[2])
+        finally:
+            stop.set()
+            for t in threads[PIPELINE_READERS:]:
+                write_q.put(None)
+            for t in threads:
+                t.join()
+
+        # records of files written after a cancel are checkpointed as well
+        while not events.empty():
+            event = events.get()
+            if event[0] == "written":
+                callback(event[2])
+
+        wall = max(time.perf_counter() - start, 1e-9)
+        workers = {"read": PIPELINE_READERS, "process": processes,
+                   "write": PIPELINE_WRITERS}
+        metrics = {}
+        for stage, n in workers.items():
+            metrics[stage] = {
+                "workers": n,
+                "busy": busy[stage],
+                "occupancy": min(busy[stage] / (wall * n), 1),
+                "queue": fill.get(stage, 0) / max(samples, 1)
+            }
+        return metrics
+
+    @staticmethod
+    def restore(t_dir, processes=None):
+        """Render the images of an evicted temp set again from its frames.
+
+        Frames of a dataset-wide range are rendered with the range of the
+        profile, other frames with their own.
+        :param t_dir:
+        :param processes: number of worker processes, all cores by default
+        :return:
+        """
+        if not Storage.read_access(t_dir)["evicted"]:
+            return
+        profile = read_file(t_dir + "/profile.txt")
+        config = profile["config"]
+        fp = frames_path(t_dir + "/temp")
+        frames = sorted([fp + "/" + f for f in os.listdir(fp)
+                         if f.endswith(".npz")])
+        v_range = None
+        colormap = profile["task"]["options"].get("Colormap")
+        if config["options"].get("range") == "dataset" and colormap:
+            v_range = tuple(colormap[1])
+        args = [(0, f, config, os.path.abspath(t_dir + "/temp"), v_range)
+                for f in frames]
+        print("[STEP] Render " + str(len(args)) + " evicted frames......",
+              end="")
+        errors = []
+        Control.parallel(Control.render_item, args,
+                         callback=lambda r: errors.extend(
+                             [i for i in r if i["error"] is not None]),
+                         processes=processes)
+        print("Done!")
+        for e in errors:
+            print("[ERROR] " + e["file"] + ": " + e["error"])
+        if not errors:
+            Storage.touch(t_dir, evicted=False)
+
+    parallel = staticmethod(parallel)  # see executor.parallel
+
+    @staticmethod
+    def read_checkpoint(t_dir):
+        """Return the source files that are completed in a temp set
+        :param t_dir:
+        :return:
+        """
+        fp = t_dir + "/checkpoint.txt"
+        if not os.path.exists(fp):
+            return []
+        with open(fp, "r") as f:
+            return [l.rstrip("\n") for l in f if l.strip()]
+
+
+class Submission(object):
+    """Bookkeeping of processing a list of files into a temp set
+
+    Results of the workers are added one by one: completed files are
+    appended to the checkpoint immediately, failures are collected. Errors,
+    profile and statistics are written once the files are finished.
+    """
+
+    def __init__(self, t_dir, file_list):
+        self.t_dir = t_dir
+        self.file_list = file_list
+        self.profile = read_file(t_dir + "/profile.txt")
+        self.config = self.profile["config"]
+        # absolute, workers of a cluster write to the same shared storage
+        self.temp_path = os.path.abspath(self.profile["temp_path"])
+        self.errors = []
+        self.records = []
+        self.done = 0
+        self.cancelled = False
+        self.pipeline = None  # metrics of Control.pipeline
+        self.v_range = None
+        self.start = time.perf_counter()
+        self.wall = 0
+        self.checkpoint = open(t_dir + "/checkpoint.txt", "a")
+        os.makedirs(frames_path(self.temp_path), exist_ok=True)
+
+    def add(self, r):
+        """Add the result of one file, as returned by Control.work
+        :param r:
+        :return:
+        """
+        self.wall = time.perf_counter() - self.start
+        if r["error"] is not None:
+            self.errors.append(r)
+            return
+        self.records.append(r["stats"])
+        if r.get("render"):
+            return
+        print(r["file"], file=self.checkpoint, flush=True)
+        self.done += 1
+        if "Bounds" not in self.profile["task"]["options"]:
+            self.profile["task"] = r["profile"]
+            write_file(self.t_dir + "/profile.txt", self.profile)
+
+    def close(self):
+        self.checkpoint.close()
+
+    def get_render_args(self, i):
+        """Return the frames to render with a dataset-wide colormap range.
+
+        The value summaries of all the stored frames, including those of
+        earlier runs, are merged into the colormap range. All the frames are
+        rendered again since the range may have changed.
+        :param i: job index of the submission
+        :return: list of args of Control.render_item
+        """
+        if self.config["options"].get("range") != "dataset":
+            return []
+        fp = frames_path(self.temp_path)
+        frames = sorted([fp + "/" + f for f in os.listdir(fp)
+                         if f.endswith(".npz")])
+        if not frames:
+            return []
+        task = Task(file_path=None, task=self.config["task"])
+        task.set_style(self.config.get("style"))
+        summary = task.merge([task.read_summary(f) for f in frames])
+        self.v_range = task.get_range(summary)
+        if self.v_range is None:
+            return []
+        return [(i, f, self.config, self.temp_path, self.v_range)
+                for f in frames]
+
+    def get_size(self):
+        """On-disk size of the images and frames of the temp set
+        :return:
+        """
+        images = [os.path.getsize(self.temp_path + "/" + f)
+                  for f in os.listdir(self.temp_path)]
+        fp = frames_path(self.temp_path)
+        frames = [os.path.getsize(fp + "/" + f) for f in os.listdir(fp)]
+        return {
+            "images": len(images),
+            "image_bytes": sum(images),
+            "frame_bytes": sum(frames)
+        }
+
+    def estimate_memory(self):
+        """Estimate the memory of processing one file in bytes.
+
+        Files of a temp set follow the same schema, so the first file stands
+        for all of them.
+        :return:
+        """
+        if not self.file_list:
+            return 0
+        try:
+            task = Task(file_path=self.file_list[0], task=self.config["task"])
+            return task.estimate_memory(self.config)
+        except Exception:
+            return 0
+
+    def finish(self, processes):
+        """Write errors, profile and statistics of the temp set
+        :param processes: number of worker processes
+        :return: statistics of all the completed files of the temp set
+        """
+        t_dir = self.t_dir
+
+        # report failed files, they are retried on resume. errors of earlier
+        # runs are kept, marked as resolved once their file is completed
+        completed = set(Control.read_checkpoint(t_dir))
+        errors = read_file(t_dir + "/errors.txt") or []
+        for e in errors:
+            if e["file"] in completed:
+                e["resolved"] = True
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        for e in self.errors:
+            e["time"] = now
+        write_file(t_dir + "/errors.txt", errors + self.errors)
+        for e in self.errors:
+            print("[ERROR] " + e["file"] + ": " + e["error"])
+
+        # update profile
+        done = self.done == len(self.file_list) and not self.errors and \
+            not self.cancelled
+        self.profile["status"] = "complete" if done else "incomplete"
+        self.profile["size"] = self.get_size()
+        options = self.profile["task"]["options"]
+        if self.v_range is not None and "Colormap" in options:
+            c = options["Colormap"]
+            options["Colormap"] = (c[0], self.v_range, c[2])
+        write_file(t_dir + "/profile.txt", self.profile)
+
+        # save statistics next to the profile, merged with earlier runs
+        records = self.records
+        phases = {"run": self.wall}
+        prev = read_file(t_dir + "/stats.txt")
+        if prev is not None:
+            records = prev["files"] + records
+            for p, wall in prev["phases"].items():
+                phases[p] = phases.get(p, 0) + wall
+        stats = Stats.aggregate(records, phases, processes)
+        stats["size"] = self.profile["size"]
+        if self.pipeline is not None:
+            stats["pipeline"] = self.pipeline
+        write_file(t_dir + "/stats.txt", stats)
+
+        size = self.profile["size"]
+        print("[STEP] Size: " + str(size["images"]) + " images of " +
+              "%.2f MB" % (size["image_bytes"] / 1024 ** 2) + ", frames of " +
+              "%.2f MB" % (size["frame_bytes"] / 1024 ** 2))
+        if self.errors:
+            print("[STEP] Task incomplete, " + str(len(self.errors)) +
+                  " file(s) failed, see errors.txt")
+        elif self.profile["status"] != "complete":
+            print("[STEP] Task cancelled, " +
+                  str(len(self.file_list) - self.done) +
+                  " file(s) left, resume to finish")
+        else:
+            print("[STEP] Task completed!")
+        return stats
+
+
+# Local Test
+
+
+if __name__ == '__main__':
+    # Class test: Control
+    c = Control("/Users/ep/Workspace/meteo_vis/sample_data/ppi/NL/HRW")
+    config = {
+        'name': 'DEFAULT_NAME',
+        'desc': 'DEFAULT_DESC',
+        'task': 'Radar polar volume (2D)',
+        'options': {
+            'scan': 'dataset15',
+            'qty': 'data1',
+        }
+    }
+    c.submit(config)
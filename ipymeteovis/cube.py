@@ -0,0 +1,243 @@
+"""Export of the stored frames of a temp set as a data cube
+"""
+
+import os
+import bisect
+
+try:
+    import zarr
+except ImportError:  # only needed to export temp sets as Zarr stores
+    zarr = None
+
+import h5py
+import numpy as np
+from dateutil import parser
+
+from .util import read_file
+from .executor import parallel
+from .series import Series
+
+
+class Cube(object):
+    """Stored frames of a temp set as a data cube of time x y x x
+
+    The cube is written to a Zarr store, or to a NetCDF file for a path
+    ending with ".nc", with CF coordinates: time in seconds since 1970,
+    latitude and longitude of the cell centers, 1D on regular grids and 2D
+    otherwise. Data are chunked by groups of frames. Writing to an existing
+    cube appends the frames later than its last time, so a growing temp set
+    can be exported again and again.
+
+    Groups of frames of a Zarr store are written by the worker pool, each
+    into its own chunk. A NetCDF file is written by one process.
+    """
+    time_units = "seconds since 1970-01-01 00:00:00"
+
+    def __init__(self, t_dir):
+        self.t_dir = t_dir
+        self.profile = read_file(t_dir + "/profile.txt")
+        series = Series(t_dir)
+        self.path = series.path
+        self.frames = [self.path + "/" + f for f in series.frames]
+        epoch = parser.parse("1970-01-01")
+        self.times = [int((t - epoch).total_seconds())
+                      for t in series.times]
+        self.geometry = None
+        if self.frames:
+            self.geometry = Series.read_frame(self.frames[0])[1]
+
+    def write(self, path, group=24, processes=None):
+        """Write the frames that are not in the cube yet
+        :param path: Zarr store, or NetCDF file ending with ".nc"
+        :param group: number of frames per chunk
+        :param processes: number of worker processes, all cores by default
+        :return: number of frames written
+        """
+        if not self.frames:
+            print("[ERROR] No frames stored: " + self.t_dir)
+            return 0
+        if path.endswith(".nc"):
+            return self.write_netcdf(path, group)
+        if zarr is None:
+            raise ImportError("Zarr is not installed, export to a NetCDF "
+                              "file (.nc) instead")
+        return self.write_zarr(path, group, processes)
+
+    def get_coords(self):
+        """Latitudes and longitudes of the cell centers
+        :return: lat, lon and their dimensions
+        """
+        key, shape, bounds = self.geometry
+        grid = None
+        if key:
+            grid = np.load(self.path + "/grid_" + key + ".npy", mmap_mode="r")
+        x, y = Series.get_centers(grid, bounds, shape)
+        if x.ndim == 1:
+            return y, x, ["y"], ["x"]
+        return y, x, ["y", "x"], ["y", "x"]
+
+    def get_attrs(self):
+        """CF attributes of the variables and of the cube
+        :return: dict of attributes by variable, "" for the cube
+        """
+        task = self.profile["task"]
+        return {
+            "": {"Conventions": "CF-1.8", "title": task["name"],
+                 "source": self.profile["source"], "task": task["task"],
+                 "options": repr(task["options"])},
+            "data": {"long_name": task["name"], "coordinates": "lat lon"},
+            "time": {"standard_name": "time", "units": self.time_units,
+                     "calendar": "standard"},
+            "lat": {"standard_name": "latitude", "units": "degrees_north"},
+            "lon": {"standard_name": "longitude", "units": "degrees_east"}
+        }
+
+    def get_new(self, times):
+        """Frames later than the last time of the cube
+        :param times: times already in the cube
+        :return: index of the first new frame
+        """
+        if len(times) == 0:
+            return 0
+        return bisect.bisect_right(self.times, int(times[-1]))
+
+    def check(self, shape):
+        """Check that the frames fit into the cube
+        :param shape: shape of a frame in the cube
+        :return:
+        """
+        if tuple(shape) != tuple(self.geometry[1]):
+            raise ValueError("Frames of shape " + str(self.geometry[1]) +
+                             " do not fit into a cube of " + str(shape))
+
+    @staticmethod
+    def open_array(path, name, **kwargs):
+        """Open an array of a Zarr store in the format read by xarray
+        :param path: Zarr store
+        :param name: name of the array
+        :return:
+        """
+        try:
+            return zarr.open_array(store=path, path=name, zarr_format=2,
+                                   **kwargs)
+        except TypeError:  # zarr 2 writes only its own format
+            return zarr.open_array(store=path, path=name, **kwargs)
+
+    def write_zarr(self, path, group, processes):
+        ny, nx = self.geometry[1]
+        attrs = self.get_attrs()
+        if not os.path.exists(path + "/data"):
+            lat, lon, lat_dims, lon_dims = self.get_coords()
+            for name, v, dims in [("lat", lat, lat_dims),
+                                  ("lon", lon, lon_dims)]:
+                a = self.open_array(path, name, mode="w", shape=v.shape,
+                                    chunks=v.shape, dtype="f8")
+                a[...] = v
+                a.attrs.update(dict(attrs[name], _ARRAY_DIMENSIONS=dims))
+            a = self.open_array(path, "time", mode="w", shape=(0,),
+                                chunks=(1024,), dtype="i8")
+            a.attrs.update(dict(attrs["time"], _ARRAY_DIMENSIONS=["time"]))
+            a = self.open_array(path, "data", mode="w", shape=(0, ny, nx),
+                                chunks=(group, ny, nx), dtype="f4",
+                                fill_value=np.nan)
+            a.attrs.update(dict(attrs["data"],
+                                _ARRAY_DIMENSIONS=["time", "y", "x"]))
+            try:
+                root = zarr.open_group(path, mode="a", zarr_format=2)
+            except TypeError:
+                root = zarr.open_group(path, mode="a")
+            root.attrs.update(attrs[""])
+
+        data = self.open_array(path, "data", mode="r+")
+        time = self.open_array(path, "time", mode="r+")
+        self.check(data.shape[1:])
+        # the times are written last, frames of an interrupted append past
+        # the times are written again
+        n = time.shape[0]
+        k = self.get_new(time[:])
+        frames = self.frames[k:]
+        if not frames:
+            if data.shape[0] != n:
+                data.resize((n, ny, nx))
+            return 0
+        data.resize((n + len(frames), ny, nx))
+
+        # one arg per chunk, the first one may fill a partial chunk
+        size = data.chunks[0]
+        args = []
+        i = 0
+        while i < len(frames):
+            j = min(i + size - (n + i) % size, len(frames))
+            args.append((path, n + i, frames[i:j]))
+            i = j
+        print("[STEP] Write " + str(len(frames)) + " frames in " +
+              str(len(args)) + " chunks......", end="")
+        parallel(Cube.write_chunk, args, processes=processes)
+        time.resize((n + len(frames),))
+        time[n:] = np.array(self.times[k:], dtype="i8")
+        print("Done!")
+        return len(frames)
+
+    @staticmethod
+    def write_chunk(item):
+        """Write a group of frames into a chunk of a Zarr store
+        :param item: tuple of the store, index of the first frame in the
+        cube and frame files
+        :return:
+        """
+        path, start, frames = item
+        data = Cube.open_array(path, "data", mode="r+")
+        data[start:start + len(frames)] = np.stack(
+            [Series.read_frame(f)[0] for f in frames])
+
+    def write_netcdf(self, path, group):
+        ny, nx = self.geometry[1]
+        attrs = self.get_attrs()
+        with h5py.File(path, "a") as f:
+            if "data" not in f:
+                lat, lon, lat_dims, lon_dims = self.get_coords()
+                f.create_dataset("time", shape=(0,), maxshape=(None,),
+                                 chunks=(1024,), dtype="i8")
+                f.create_dataset("y", data=np.arange(ny, dtype="i4"))
+                f.create_dataset("x", data=np.arange(nx, dtype="i4"))
+                f.create_dataset("lat", data=lat)
+                f.create_dataset("lon", data=lon)
+                f.create_dataset("data", shape=(0, ny, nx),
+                                 maxshape=(None, ny, nx),
+                                 chunks=(min(group, 1024), ny, nx),
+                                 dtype="f4", fillvalue=np.nan,
+                                 compression="gzip", compression_opts=4,
+                                 shuffle=True)
+                # fill value of the variable for NetCDF readers
+                for name in ["_FillValue", "missing_value"]:
+                    f["data"].attrs[name] = np.float32(np.nan)
+                for d in ["time", "y", "x"]:
+                    f[d].make_scale(d)
+                for name, dims in [("lat", lat_dims), ("lon", lon_dims),
+                                   ("data", ["time", "y", "x"])]:
+                    for i in range(len(dims)):
+                        f[name].dims[i].attach_scale(f[dims[i]])
+                for name, a in attrs.items():
+                    (f[name] if name else f).attrs.update(a)
+
+            data = f["data"]
+            self.check(data.shape[1:])
+            # the times are written last, see write_zarr
+            n = f["time"].shape[0]
+            k = self.get_new(f["time"][:])
+            frames = self.frames[k:]
+            if not frames:
+                if data.shape[0] != n:
+                    data.resize(n, axis=0)
+                return 0
+            print("[STEP] Write " + str(len(frames)) + " frames......",
+                  end="")
+            data.resize(n + len(frames), axis=0)
+            f["time"].resize(n + len(frames), axis=0)
+            for i in range(0, len(frames), group):
+                fs = frames[i:i + group]
+                data[n + i:n + i + len(fs)] = np.stack(
+                    [Series.read_frame(fp)[0] for fp in fs])
+            f["time"][n:] = np.array(self.times[k:], dtype="i8")
+            print("Done!")
+            return len(frames)
@@ -0,0 +1,368 @@
+"""Backends running the jobs of the temp sets, and jobs in the background
+"""
+
+import sys
+import contextvars
+import multiprocessing as mp
+import queue
+import threading
+import asyncio
+import concurrent.futures
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import dask.distributed as distributed
+except ImportError:  # only needed by the dask backend, see Executor
+    distributed = None
+
+
+def parallel(job, args, callback=None, processes=None, weights=None,
+             budget=None, cancel=None, backend=None):
+    """Map job on args in parallel
+
+    Args are dispatched in their order as workers become free, and with
+    a callback the results are passed to it in the order of completion
+    while the workers are still running. With weights and a budget, an
+    arg is only dispatched when the sum of the weights of the running
+    args stays within the budget, at least one arg runs at any time.
+
+    With a cancel event, no more args are dispatched once the event is
+    set and the workers are stopped, results of the finished args are
+    returned.
+    :param job:
+    :param args:
+    :param callback:
+    :param processes: number of workers, all cores by default
+    :param weights: estimated memory of each arg
+    :param budget: memory budget of all the running args
+    :param cancel: threading.Event
+    :param backend: backend running the jobs, see Executor
+    :return: results of the finished args in the order of the args
+    """
+    if budget is None:
+        weights = [0] * len(args)
+        budget = 0
+    callback = callback or (lambda r: None)
+    result = {}
+    with Executor.create(backend, processes) as ex:
+        # admit args while they fit into the budget
+        pending = deque(range(len(args)))
+        running = {}
+        done = queue.Queue()
+        used = 0
+        while pending or running:
+            while pending and len(running) < ex.workers and (
+                    not running or
+                    used + weights[pending[0]] <= budget):
+                i = pending.popleft()
+                running[i] = weights[i]
+                used += weights[i]
+                ex.submit(job, args[i],
+                          lambda r, e, i=i: done.put((i, r, e)))
+            if cancel is not None and cancel.is_set():
+                ex.close(cancel=True)
+                break
+            try:
+                i, r, e = done.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if e is not None:
+                raise e
+            used -= running.pop(i)
+            callback(r)
+            result[i] = r
+    return [result[i] for i in sorted(result)]
+
+
+class Executor(object):
+    """Backend running the jobs of parallel and Control.pipeline
+
+    A job is a function of one arg, both picklable. Its result or exception
+    is passed to a callback, which may be called from another thread.
+    Backends are given by name:
+    "process" (default): worker processes of this machine.
+    "thread": threads of the main process, for jobs that mostly wait for
+    I/O or release the GIL.
+    "dask": a local dask distributed cluster, e.g. to test a cluster setup.
+    "dask://host:port" or "tcp://host:port": the scheduler of a dask
+    distributed cluster.
+    Jobs of parallel get file paths and configs and return small
+    records, frames and images are written by the workers. Jobs of
+    Control.pipeline also get file paths, read ahead into the page cache
+    unless the executor is remote, and return the frames and the pixels of
+    the images to be encoded and written in the main process. With a
+    cluster, the sources and TEMP_SET_PATH must be on storage shared by all
+    the nodes.
+    """
+    backends = ["process", "thread", "dask"]
+    remote = False  # workers on other machines
+
+    def __init__(self, workers=None):
+        self.workers = workers or mp.cpu_count()
+        self.closed = False
+
+    @staticmethod
+    def create(backend=None, workers=None):
+        """Start the executor of a backend
+        :param backend: name of the backend, or address of a dask scheduler
+        :param workers: number of workers of local backends, all cores by
+        default
+        :return:
+        """
+        if backend in [None, "process"]:
+            return ProcessExecutor(workers)
+        elif backend == "thread":
+            return ThreadExecutor(workers)
+        elif backend == "dask":
+            return DaskExecutor(workers)
+        elif backend.startswith("dask://") or backend.startswith("tcp://"):
+            return DaskExecutor(address="tcp://" + backend.split("://")[1])
+        raise ValueError("Unknown backend: " + str(backend))
+
+    def submit(self, job, arg, callback):
+        """Run a job on an arg
+        :param job:
+        :param arg:
+        :param callback: function of the result and the exception, one of
+        them is None
+        :return:
+        """
+        raise NotImplementedError
+
+    def close(self, cancel=False):
+        """Stop the workers
+        :param cancel: drop the jobs that are not finished
+        :return:
+        """
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if not self.closed:
+            self.close(cancel=True)  # results are collected already
+
+
+class ProcessExecutor(Executor):
+    def __init__(self, workers=None):
+        Executor.__init__(self, workers)
+        self.pool = mp.Pool(processes=self.workers)
+
+    def submit(self, job, arg, callback):
+        self.pool.apply_async(job, (arg,),
+                              callback=lambda r: callback(r, None),
+                              error_callback=lambda e: callback(None, e))
+
+    def close(self, cancel=False):
+        Executor.close(self)
+        if cancel:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+            self.pool.join()
+
+
+class ThreadExecutor(Executor):
+    def __init__(self, workers=None):
+        Executor.__init__(self, workers)
+        self.pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        self.futures = set()
+
+    def submit(self, job, arg, callback):
+        def done(f):
+            self.futures.discard(f)
+            if f.cancelled():
+                return
+            e = f.exception()
+            callback(None if e is not None else f.result(), e)
+
+        f = self.pool.submit(job, arg)
+        self.futures.add(f)
+        f.add_done_callback(done)
+
+    def close(self, cancel=False):
+        Executor.close(self)
+        if cancel:
+            # running jobs cannot be stopped, they finish in the background
+            for f in list(self.futures):
+                f.cancel()
+        self.pool.shutdown(wait=not cancel)
+
+
+class DaskExecutor(Executor):
+    def __init__(self, workers=None, address=None):
+        if distributed is None:
+            raise ImportError("The dask backend needs dask.distributed")
+        if address is None:
+            self.client = distributed.Client(
+                n_workers=workers or mp.cpu_count(), threads_per_worker=1)
+        else:
+            self.client = distributed.Client(address)
+            self.remote = True
+        Executor.__init__(self, sum(self.client.nthreads().values()))
+        self.futures = set()
+
+    def submit(self, job, arg, callback):
+        def done(f):
+            self.futures.discard(f)
+            if f.status == "error":
+                callback(None, f.exception())
+            elif f.status == "finished":
+                callback(f.result(), None)
+
+        f = self.client.submit(job, arg, pure=False)
+        self.futures.add(f)
+        f.add_done_callback(done)
+
+    def close(self, cancel=False):
+        Executor.close(self)
+        if cancel and self.futures:
+            self.client.cancel(list(self.futures))
+        self.client.close()
+
+
+class JobOutput(object):
+    """Standard output that passes what a background job prints to the job,
+    other threads print as before.
+
+    In a notebook, output printed by another thread than the one of the
+    kernel lands in whichever cell runs at that time. The proxy is only
+    installed while background jobs run, the former sys.stdout is restored
+    once the last of them finishes. The receiver of the text is a context
+    variable set in the thread of the job.
+    """
+
+    lock = threading.Lock()
+    writer = contextvars.ContextVar("writer", default=None)
+    jobs = 0  # running jobs capturing their output
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        f = JobOutput.writer.get()
+        if f is None:
+            return self.stream.write(text)
+        f(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @staticmethod
+    @contextmanager
+    def capture(f):
+        """Pass what the current thread prints to f within the context
+        :param f: function receiving the printed text
+        :return:
+        """
+        with JobOutput.lock:
+            if not isinstance(sys.stdout, JobOutput):
+                sys.stdout = JobOutput(sys.stdout)
+            JobOutput.jobs += 1
+        token = JobOutput.writer.set(f)
+        try:
+            yield
+        finally:
+            JobOutput.writer.reset(token)
+            with JobOutput.lock:
+                JobOutput.jobs -= 1
+                # left alone if replaced by someone else in the meantime
+                if JobOutput.jobs == 0 and isinstance(sys.stdout, JobOutput):
+                    sys.stdout = sys.stdout.stream
+
+
+class BackgroundJob(object):
+    """Handle of a function running in a background thread
+
+    The function is called with the keyword arguments "cancel" and
+    "progress", see Control.submit. The handle can be awaited in a notebook
+    for the return value of the function. What the function prints is kept
+    in the log of the job instead of the output of the notebook, see
+    observe_log.
+    """
+
+    def __init__(self, target, *args, **kwargs):
+        self.cancelled = threading.Event()
+        self.future = concurrent.futures.Future()
+        self.progress = (0, 0)  # finished and total files
+        self.listeners = []
+        self.log = []  # printed text
+        self.log_listeners = []
+        self.log_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run,
+                                       args=(target, args, kwargs),
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, target, args, kwargs):
+        try:
+            with JobOutput.capture(self.write):
+                r = target(*args, cancel=self.cancelled,
+                           progress=self.update, **kwargs)
+            self.future.set_result(r)
+        except BaseException as e:
+            self.future.set_exception(e)
+
+    def write(self, text):
+        with self.log_lock:
+            self.log.append(text)
+            listeners = list(self.log_listeners)
+        for f in listeners:
+            f(text)
+
+    def observe_log(self, f):
+        """Call f with the text printed by the job, starting with what it
+        printed so far
+        :param f:
+        :return:
+        """
+        with self.log_lock:
+            text = "".join(self.log)
+            self.log_listeners.append(f)
+        if text:
+            f(text)
+
+    def update(self, done, total):
+        self.progress = (done, total)
+        for f in self.listeners:
+            f(done, total)
+
+    def observe(self, f):
+        """Call f with the number of finished and total files on progress
+        :param f:
+        :return:
+        """
+        self.listeners.append(f)
+
+    def add_done_callback(self, f):
+        """Call f with the job once it is finished
+        :param f:
+        :return:
+        """
+        self.future.add_done_callback(lambda future: f(self))
+
+    def cancel(self):
+        """Stop dispatching files and terminate the workers, the temp set is
+        left incomplete and can be resumed.
+        :return:
+        """
+        self.cancelled.set()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """Wait for the job and return its result
+        :param timeout: seconds
+        :return:
+        """
+        return self.future.result(timeout)
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
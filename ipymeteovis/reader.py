@@ -0,0 +1,95 @@
+"""Lazy reading of source directories as xarray DataArrays"""
+
+try:
+    import dask
+    import dask.array as da
+    import xarray as xr
+except ImportError:  # only needed to read sources lazily
+    da = None
+
+import h5py
+import numpy as np
+from dateutil import parser
+
+from .task import Task
+from .series import Series
+
+
+class Reader(object):
+    """Files of a source directory as a lazy xarray DataArray
+
+    The time stamps are read from the metadata of every file and the first
+    file is processed for the shape and the coordinates of the data, files
+    of a source follow the same schema. Every other file is one chunk of a
+    dask array: it is only read, cropped to the region of interest and
+    decoded (gain, offset, nodata and undetect) by Task.process when the
+    chunk is computed, so a selection by time opens only the files it
+    needs. Grids of the same geometry are computed once per process.
+    """
+
+    def __init__(self, file_list, config):
+        if da is None:
+            raise ImportError("Reading lazily needs xarray and dask")
+        self.config = config
+        times = []
+        for fp in file_list:
+            try:
+                task = Task(file_path=fp, task=config["task"])
+                with h5py.File(fp, "r") as f:
+                    times.append((task.read_time(f, config), fp))
+            except Exception as e:
+                print("[ERROR] " + fp + ": " + repr(e))
+        times.sort()
+        self.times = [parser.parse(t) for t, fp in times]
+        self.file_list = [fp for t, fp in times]
+
+    def get(self):
+        """Build the lazy array of the files
+        :return: DataArray of time x y x x with latitude and longitude of
+        the cell centers as coordinates
+        """
+        if not self.file_list:
+            raise ValueError("No file to read")
+        task = Task(file_path=self.file_list[0], task=self.config["task"])
+        task.process(self.config)
+        first = np.ma.filled(np.ma.asarray(task.data, np.float32), np.nan)
+        lat, lon, lat_dims, lon_dims = self.get_coords(task, first.shape)
+
+        read = dask.delayed(Reader.read, pure=True)
+        chunks = [da.from_array(first, chunks=first.shape)]
+        chunks += [da.from_delayed(read(fp, self.config), first.shape,
+                                   dtype=np.float32)
+                   for fp in self.file_list[1:]]
+        profile = task.get_profile(self.config)
+        return xr.DataArray(
+            da.stack(chunks),
+            dims=("time", "y", "x"),
+            coords={"time": np.array(self.times, dtype="datetime64[ns]"),
+                    "lat": (lat_dims, lat), "lon": (lon_dims, lon)},
+            name=profile["options"].get("Quantity"),
+            attrs={"task": self.config["task"],
+                   "options": repr(profile["options"])}
+        )
+
+    @staticmethod
+    def read(file_path, config):
+        """Process a file, see Task.process
+        :param file_path:
+        :param config:
+        :return: float32 data with NaN for masked cells
+        """
+        task = Task(file_path=file_path, task=config["task"])
+        task.process(config)
+        return np.ma.filled(np.ma.asarray(task.data, np.float32), np.nan)
+
+    @staticmethod
+    def get_coords(task, shape):
+        """Latitudes and longitudes of the cell centers of a processed task
+        :param task:
+        :param shape: shape of the data
+        :return: lat, lon and their dimensions
+        """
+        x, y = Series.get_centers(task.grid, task.bounds, shape)
+        if x.ndim == 1:
+            return y, x, ("y",), ("x",)
+        return y, x, ("y", "x"), ("y", "x")
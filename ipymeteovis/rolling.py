@@ -0,0 +1,88 @@
+"""Operators over a window of frames sliding in time
+"""
+
+from collections import deque
+
+import numpy as np
+
+
+class Rolling(object):
+    """Operator over a window of frames sliding in time order
+
+    "sum" and "mean" keep a running sum and count of the valid cells: the
+    new frame is added and the frame leaving the window subtracted. "max"
+    and "min" split the frames into blocks of the window length (van Herk /
+    Gil-Werman): the extreme of a window is that of the running extreme of
+    the current block and the extreme from a frame to the end of the
+    previous block, computed once per block. "diff" is the change from the
+    previous frame. Every step costs O(1) per cell and at most two windows
+    of frames are held. Missing cells are NaN and skipped.
+    """
+    ops = ["sum", "mean", "max", "min", "diff"]
+
+    def __init__(self, op, window=1):
+        if op not in self.ops:
+            raise ValueError("Unknown operator: " + str(op))
+        self.op = op
+        self.window = 2 if op == "diff" else max(int(window), 1)
+        self.n = 0  # number of frames pushed
+        self.frames = deque()  # frames in the window, for sum and mean
+        self.total = None
+        self.count = None
+        self.block = []  # frames of the current block, for max and min
+        self.prefix = None  # extreme of the current block so far
+        self.suffix = None  # extremes from a frame to the end of last block
+
+    def push(self, data):
+        """Add the next frame
+        :param data: float array, NaN for missing cells
+        :return: value over the window ending at this frame, None as long as
+        the window is not full
+        """
+        self.n += 1
+        if self.op == "diff":
+            prev = self.frames.popleft() if self.frames else None
+            self.frames.append(data)
+            return None if prev is None else data - prev
+        elif self.op in ["sum", "mean"]:
+            return self.push_sum(data)
+        return self.push_extreme(data)
+
+    def push_sum(self, data):
+        valid = np.isfinite(data)
+        if self.total is None:
+            self.total = np.zeros(data.shape, np.float64)
+            self.count = np.zeros(data.shape, np.int32)
+        self.total += np.where(valid, data, 0)
+        self.count += valid
+        self.frames.append(data)
+        if len(self.frames) > self.window:
+            old = self.frames.popleft()
+            valid = np.isfinite(old)
+            self.total -= np.where(valid, old, 0)
+            self.count -= valid
+        if self.n < self.window:
+            return None
+        result = self.total
+        if self.op == "mean":
+            result = self.total / np.maximum(self.count, 1)
+        return np.where(self.count > 0, result, np.nan).astype(np.float32)
+
+    def push_extreme(self, data):
+        f = np.fmax if self.op == "max" else np.fmin  # NaN is skipped
+        self.block.append(data)
+        self.prefix = data if self.prefix is None else f(self.prefix, data)
+        j = len(self.block) - 1  # position in the current block
+        result = None
+        if j == self.window - 1:
+            result = self.prefix
+            # extremes towards the end of the block, for the next block
+            suffix = [data]
+            for d in reversed(self.block[:-1]):
+                suffix.append(f(d, suffix[-1]))
+            self.suffix = suffix[::-1]
+            self.block = []
+            self.prefix = None
+        elif self.suffix is not None:
+            result = f(self.suffix[j + 1], self.prefix)
+        return result
@@ -0,0 +1,225 @@
+"""Values of the stored frames of a temp set at points
+"""
+
+import os
+from functools import lru_cache
+
+import numpy as np
+from dateutil import parser
+from scipy.spatial import cKDTree
+from scipy.ndimage import maximum_filter
+
+from .util import frames_path, read_file, write_file
+
+
+class Series(object):
+    """Values of the stored frames of a temp set at points over time
+
+    Points are looked up in the geometry of the frames: by the bounds and
+    the shape for regular grids, and by the nearest cell center for other
+    grids. Frames of the same geometry are stacked once into an uncompressed
+    array "frames/stack.npy" that is memory mapped, so reading a point
+    touches only one value per frame. The stack is rebuilt when the frames
+    change, frames of different geometries are read one by one.
+    """
+
+    def __init__(self, t_dir):
+        self.t_dir = t_dir
+        self.path = frames_path(t_dir + "/temp")
+        self.frames = []  # sets made before frames were stored have none
+        if os.path.isdir(self.path):
+            self.frames = sorted([f for f in os.listdir(self.path)
+                                  if f.endswith(".npz")])
+        self.times = [parser.parse(os.path.splitext(f)[0])
+                      for f in self.frames]
+        self.stack = None
+        self.geometry = None  # grid key, shape and bounds of the stack
+
+    def point(self, lat, lon):
+        """Values at a point over time
+        :param lat:
+        :param lon:
+        :return: list of times, array of values with NaN outside the data
+        """
+        return self.times, self.values([lat], [lon])[:, 0]
+
+    def transect(self, start, end, n=100):
+        """Values along a line over time
+        :param start: (lat, lon) of the start of the line
+        :param end: (lat, lon) of the end of the line
+        :param n: number of points along the line
+        :return: list of times, distances in km from the start, array of
+        values of shape (times, points)
+        """
+        lats = np.linspace(start[0], end[0], n)
+        lons = np.linspace(start[1], end[1], n)
+        phi0 = np.radians(start[0])
+        phi = np.radians(lats)
+        a = np.sin((phi - phi0) / 2) ** 2 + np.cos(phi0) * np.cos(phi) * \
+            np.sin(np.radians(lons - start[1]) / 2) ** 2
+        distances = 2 * 6371.0 * np.arcsin(np.sqrt(a))
+        return self.times, distances, self.values(lats, lons)
+
+    def values(self, lats, lons):
+        """Values at points over time
+        :param lats:
+        :param lons:
+        :return: array of values of shape (times, points)
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        self.load()
+        if self.stack is not None:
+            idx = self.locate(self.path, lats, lons, self.geometry)
+            result = self.stack.reshape(len(self.frames), -1)[:, idx]
+            result[:, idx < 0] = np.nan
+            return result
+
+        result = np.full((len(self.frames), len(lats)), np.nan, np.float32)
+        for i in range(len(self.frames)):
+            fp = self.path + "/" + self.frames[i]
+            data, geometry = self.read_frame(fp)
+            idx = self.locate(self.path, lats, lons, geometry)
+            result[i] = data.ravel()[idx]
+            result[i, idx < 0] = np.nan
+        return result
+
+    def load(self):
+        """Memory map the stack of frames, built if missing or outdated
+        :return:
+        """
+        if self.stack is not None or not self.frames:
+            return
+        fp = self.path + "/stack.npy"
+        index = read_file(self.path + "/stack.txt")
+        if index is not None and index["frames"] == self.frames and \
+                os.path.exists(fp):
+            self.stack = np.load(fp, mmap_mode="r")
+            self.geometry = index["geometry"]
+            return
+
+        tmp = fp + "." + str(os.getpid())
+        stack = None
+        geometry = None
+        for i in range(len(self.frames)):
+            data, g = self.read_frame(self.path + "/" + self.frames[i])
+            if stack is None:
+                geometry = g
+                stack = np.lib.format.open_memmap(
+                    tmp, mode="w+", dtype=np.float32,
+                    shape=(len(self.frames),) + data.shape)
+            elif g != geometry:
+                del stack
+                os.remove(tmp)
+                return  # frames are read one by one
+            stack[i] = data
+        stack.flush()
+        del stack
+        os.replace(tmp, fp)
+        write_file(self.path + "/stack.txt",
+                   {"frames": self.frames, "geometry": geometry})
+        self.stack = np.load(fp, mmap_mode="r")
+        self.geometry = geometry
+
+    @staticmethod
+    def read_frame(fp):
+        """Read the data and the geometry of a stored frame
+        :param fp: path of the frame file
+        :return: data with NaN for missing cells, tuple of grid key, shape
+        and bounds
+        """
+        with np.load(fp) as z:
+            data = z["data"]
+            bounds = tuple(tuple(b) for b in z["bounds"].tolist())
+            return data, (str(z["grid"]), data.shape, bounds)
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def get_index(path, geometry, target):
+        """Index map from the cells of a regular grid to the cells of frames
+        of a geometry, computed once per pair
+        :param path: frames directory of the frames
+        :param geometry: grid key, shape and bounds of the frames
+        :param target: (lat_max, lon_min, d_lat, d_lon, nrows, ncols) of the
+        regular grid, rows from the north
+        :return: read-only array of flat indices of shape (nrows, ncols), -1
+        outside the data
+        """
+        lat_max, lon_min, d_lat, d_lon, nrows, ncols = target
+        lats = lat_max - (np.arange(nrows) + 0.5) * d_lat
+        lons = lon_min + (np.arange(ncols) + 0.5) * d_lon
+        lats, lons = np.meshgrid(lats, lons, indexing="ij")
+        idx = Series.locate(path, lats.ravel(), lons.ravel(), geometry)
+        idx = idx.reshape(nrows, ncols)
+        idx.flags.writeable = False
+        return idx
+
+    @staticmethod
+    def locate(path, lats, lons, geometry):
+        """Flat indices of the cells of points in frames of a geometry
+        :param path: frames directory of the frames
+        :param lats:
+        :param lons:
+        :param geometry: grid key, shape and bounds of the frames
+        :return: array of indices, -1 outside the data
+        """
+        key, shape, bounds = geometry
+        (lat_min, lon_min), (lat_max, lon_max) = bounds
+        inside = (lats >= lat_min) & (lats <= lat_max) & \
+                 (lons >= lon_min) & (lons <= lon_max)
+        if not key:
+            # regular grid, the first row at the north
+            r = np.floor((lat_max - lats) / (lat_max - lat_min) * shape[0])
+            c = np.floor((lons - lon_min) / (lon_max - lon_min) * shape[1])
+            r = np.clip(r, 0, shape[0] - 1).astype(np.intp)
+            c = np.clip(c, 0, shape[1] - 1).astype(np.intp)
+            idx = r * shape[1] + c
+        else:
+            tree, scale, radius = Series.get_tree(
+                path + "/grid_" + key + ".npy")
+            d, idx = tree.query(np.stack([lons * scale, lats], axis=-1))
+            inside &= d <= radius[idx]
+        return np.where(inside, idx, -1)
+
+    @staticmethod
+    def get_centers(grid, bounds, shape):
+        """Longitudes and latitudes of the cell centers of frames
+        :param grid: cell corners of shape (rows + 1, cols + 1, 2 or more),
+        None for regular grids
+        :param bounds: bounds of a regular grid, the first row at the north
+        :param shape: shape of the data of a regular grid
+        :return: x and y, 1D for regular grids and 2D otherwise
+        """
+        if grid is None:
+            (lat_min, lon_min), (lat_max, lon_max) = bounds
+            x = lon_min + (np.arange(shape[1]) + 0.5) * \
+                (lon_max - lon_min) / shape[1]
+            y = lat_max - (np.arange(shape[0]) + 0.5) * \
+                (lat_max - lat_min) / shape[0]
+            return x, y
+        g = np.asarray(grid)[..., :2]
+        centers = (g[:-1, :-1] + g[1:, :-1] + g[:-1, 1:] + g[1:, 1:]) / 4
+        return centers[..., 0], centers[..., 1]
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def get_tree(grid_fp):
+        """Index the cell centers of a grid of cell corners
+        A point belongs to its nearest center when it is within the
+        distance of that center to its farthest corner. The point may lie in
+        a neighbouring cell that is larger, e.g. the next bin of a polar
+        scan, so the distance of a cell is the largest of its neighbours.
+        :param grid_fp: path of the grid file of the frames
+        :return: KD-tree of the centers with longitudes scaled by the
+        cosine of the latitude, the scale, and the distance of every cell
+        """
+        g = np.load(grid_fp)[..., :2]
+        centers = np.stack(Series.get_centers(g, None, None), axis=-1)
+        scale = np.cos(np.radians(np.nanmean(centers[..., 1])))
+        radius = np.zeros(centers.shape[:2])
+        for c in [g[:-1, :-1], g[1:, :-1], g[:-1, 1:], g[1:, 1:]]:
+            d = (c - centers) * [scale, 1]
+            radius = np.fmax(radius, np.hypot(d[..., 0], d[..., 1]))
+        radius = maximum_filter(radius, size=3, mode="nearest")
+        centers = centers.reshape(-1, 2) * [scale, 1]
+        return cKDTree(centers), scale, radius.ravel()
@@ -0,0 +1,231 @@
+"""Statistics of the processing stages of a temp set
+"""
+
+import os
+import sys
+import copy
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+class Stats(object):
+    """Timing and memory records of a task, organized by stage
+
+    Each stage records wall time and CPU time (seconds), its peak memory
+    (MB) and bytes read and written. The peak memory of a stage is the
+    highest RSS of the worker process during the stage above the RSS at its
+    start, and the peak of the task is the highest RSS above the RSS at the
+    start of its first stage. The peak RSS is reset at the start of every
+    stage where the system allows it (linux), elsewhere only a new peak of
+    the process is seen. Stages are not nested, and workers of the thread
+    backend share one process, so they see each other's memory. The records
+    are sent back from the workers and aggregated by the control.
+    """
+
+    fields = ["wall", "cpu", "rss", "read", "written"]
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.stages = {}
+        self.base = None  # RSS at the start of the first stage
+        self.peak = 0
+
+    def get_stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = dict.fromkeys(self.fields, 0)
+        return self.stages[stage]
+
+    @contextmanager
+    def measure(self, stage):
+        """Measure wall time, CPU time and peak memory of the enclosed code
+
+        CPU time is of the calling thread, so workers sharing a process
+        (thread backend) do not count each other.
+        :param stage:
+        :return:
+        """
+        start = self.reset_peak()
+        if self.base is None:
+            self.base = start
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            s = self.get_stage(stage)
+            s["wall"] += time.perf_counter() - wall
+            s["cpu"] += time.thread_time() - cpu
+            peak = self.peak_rss()
+            s["rss"] = max(s["rss"], round(max(peak - start, 0), 1))
+            self.peak = max(self.peak, round(max(peak - self.base, 0), 1))
+
+    def add_io(self, stage, read=0, written=0):
+        s = self.get_stage(stage)
+        s["read"] += int(read)
+        s["written"] += int(written)
+
+    def to_dict(self):
+        return {
+            "file": self.file_path,
+            "pid": os.getpid(),
+            "peak": self.peak,
+            "stages": copy.deepcopy(self.stages)
+        }
+
+    @staticmethod
+    def peak_rss():
+        """Peak resident set size of the current process in MB, since the
+        last reset_peak on linux
+        :return:
+        """
+        try:
+            with open("/proc/self/status", "r") as f:
+                for l in f:
+                    if l.startswith("VmHWM:"):
+                        return int(l.split()[1]) / 1024  # kilobytes
+        except OSError:
+            pass
+        if resource is None:
+            return 0
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            rss = rss / 1024  # bytes on mac os, kilobytes elsewhere
+        return rss / 1024
+
+    @staticmethod
+    def reset_peak():
+        """Reset the peak resident set size of the current process to its
+        current one where the system allows it (linux)
+        :return: peak resident set size in MB after the reset
+        """
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass  # the peak so far is kept
+        return Stats.peak_rss()
+
+    @staticmethod
+    def aggregate(records, phases, processes):
+        """Aggregate per-file records into a summary by stage
+
+        The overhead of a phase is its wall time in the main process minus
+        the worker time spent in it, spread over the pool. It covers
+        scheduling and pickling of results between processes.
+        :param records: list of dicts from Stats.to_dict
+        :param phases: wall time of each phase in the main process
+        :param processes: number of worker processes
+        :return:
+        """
+        summary = {}
+        for r in records:
+            for stage, s in r["stages"].items():
+                t = summary.setdefault(stage, {
+                    "files": 0, "wall": 0, "wall_max": 0, "cpu": 0,
+                    "rss": 0, "read": 0, "written": 0
+                })
+                t["files"] += 1
+                t["wall"] += s["wall"]
+                t["wall_max"] = max(t["wall_max"], s["wall"])
+                t["cpu"] += s["cpu"]
+                t["rss"] = max(t["rss"], s["rss"])
+                t["read"] += s["read"]
+                t["written"] += s["written"]
+
+        # all the stages run in the "run" phase
+        busy = sum(t["wall"] for t in summary.values())
+        overhead = {}
+        for p, wall in phases.items():
+            overhead[p] = max(wall - busy / max(processes, 1), 0)
+
+        return {
+            "processes": processes,
+            "phases": phases,
+            "overhead": overhead,
+            "summary": summary,
+            "files": records
+        }
+
+    @staticmethod
+    def format_time(seconds):
+        """Format a duration as hours, minutes and seconds
+        :param seconds:
+        :return:
+        """
+        m, sec = divmod(int(round(seconds)), 60)
+        h, m = divmod(m, 60)
+        if h:
+            return "%dh %02dm" % (h, m)
+        return "%dm %02ds" % (m, sec) if m else "%ds" % sec
+
+    @staticmethod
+    def estimate_to_html(estimate):
+        """Format an estimate of Control.estimate as a HTML table
+        :param estimate:
+        :return:
+        """
+        rows = [
+            ["Files", "%d (%d cached)" % (estimate["files"],
+                                          estimate["cached"])],
+            ["Sampled files", estimate["samples"]],
+            ["Workers", estimate["workers"]],
+            ["Wall time", Stats.format_time(estimate["wall"])],
+            ["Peak memory (MB)", "%.0f" % estimate["memory"]],
+            ["Output (MB)", "%.1f" % (estimate["bytes"] / 1024 ** 2)]
+        ]
+        for stage, wall in estimate["stages"].items():
+            rows.append(["[stage] " + stage + " (s per file)",
+                         "%.3f" % wall])
+        html = "<table><tr><th>Estimate</th><th></th></tr>"
+        for r in rows:
+            html += "<tr>" + "".join(
+                ["<td>" + str(c) + "</td>" for c in r]) + "</tr>"
+        return html + "</table>"
+
+    @staticmethod
+    def to_html(stats):
+        """Render the summary of aggregated statistics as a html table
+        :param stats: dict from Stats.aggregate
+        :return:
+        """
+        head = ["Stage", "Files", "Wall (s)", "Max wall (s)", "CPU (s)",
+                "Stage peak (MB)", "Read (MB)", "Written (MB)"]
+        rows = []
+        for stage, t in stats["summary"].items():
+            rows.append([
+                stage, t["files"], "%.2f" % t["wall"],
+                "%.3f" % t["wall_max"], "%.2f" % t["cpu"],
+                "%.1f" % t["rss"], "%.2f" % (t["read"] / 1024 ** 2),
+                "%.2f" % (t["written"] / 1024 ** 2)
+            ])
+        for p, wall in stats["phases"].items():
+            rows.append([
+                "[phase] " + p, "", "%.2f" % wall, "", "", "", "", ""
+            ])
+            rows.append([
+                "[overhead] " + p, "", "%.2f" % stats["overhead"][p], "",
+                "", "", "", ""
+            ])
+        html = "<table><tr>"
+        html += "".join(["<th>" + h + "</th>" for h in head]) + "</tr>"
+        for r in rows:
+            html += "<tr>" + "".join(
+                ["<td>" + str(c) + "</td>" for c in r]) + "</tr>"
+        html += "</table>"
+        if "pipeline" in stats:
+            html += "<table><tr><th>Pipeline stage</th><th>Workers</th>" \
+                    "<th>Busy (s)</th><th>Occupancy</th>" \
+                    "<th>Queue fill</th></tr>"
+            for stage, m in stats["pipeline"].items():
+                html += "<tr><td>" + stage + "</td><td>" + \
+                        str(m["workers"]) + "</td><td>" + \
+                        "%.2f" % m["busy"] + "</td><td>" + \
+                        "%.0f%%" % (m["occupancy"] * 100) + "</td><td>" + \
+                        "%.0f%%" % (m["queue"] * 100) + "</td></tr>"
+            html += "</table>"
+        return html
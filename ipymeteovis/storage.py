@@ -0,0 +1,407 @@
+"""Disk usage of the temp sets, and the cache of frames and images shared
+by them
+"""
+
+import os
+import shutil
+import time
+import copy
+import hashlib
+import json
+import threading
+
+from .util import TEMP_SET_PATH, frames_path, read_file, write_file
+from .stats import Stats
+
+TEMP_SET_QUOTA = None  # quota of all the temp sets in MB, see Storage
+RENDER_VERSION = 2  # raise when processing or rendering changes, see Cache
+
+
+class Storage(object):
+    """Disk usage of the temp sets, limited by a quota
+
+    The last access and the pin of a temp set are kept in "access.txt" next
+    to its profile, so accessing a set does not change the profile. The
+    quota in MB is kept in "quota.txt" of TEMP_SET_PATH, shared by all the
+    users of the directory, TEMP_SET_QUOTA if not set. Once the temp sets
+    exceed the quota, the least recently accessed ones are evicted: first
+    the images and caches of sets whose frames are stored, which are
+    rendered again from the frames on the next access, then whole sets that
+    were made while a quota was set. Sets made without a quota only lose
+    their images, and sets without frames are never removed, their images
+    cannot be made again. Pinned and incomplete sets are never evicted.
+    Files linked from the Cache count by their share, entries of the cache
+    no temp set links to are removed first.
+    """
+
+    @staticmethod
+    def read_access(t_dir):
+        """Read the last access and the pin of a temp set
+        :param t_dir:
+        :return:
+        """
+        access = read_file(t_dir + "/access.txt") or {}
+        if "time" not in access:
+            fp = t_dir + "/profile.txt"
+            access["time"] = os.path.getmtime(fp) if os.path.exists(fp) \
+                else 0
+        access.setdefault("pinned", False)
+        access.setdefault("evicted", False)
+        access.setdefault("quota", False)  # made while a quota was set
+        return access
+
+    @staticmethod
+    def touch(t_dir, **kwargs):
+        """Record an access to a temp set
+        :param t_dir:
+        :param kwargs: "pinned", "evicted" or "quota" to change
+        :return:
+        """
+        access = Storage.read_access(t_dir)
+        access.update(kwargs)
+        access["time"] = time.time()
+        write_file(t_dir + "/access.txt", access)
+
+    @staticmethod
+    def pin(t_dir, pinned=True):
+        """Exempt a temp set from eviction
+        :param t_dir:
+        :param pinned:
+        :return:
+        """
+        access = Storage.read_access(t_dir)
+        access["pinned"] = pinned
+        write_file(t_dir + "/access.txt", access)
+
+    @staticmethod
+    def get_quota():
+        """Quota of all the temp sets in MB, None for no quota
+        :return:
+        """
+        quota = read_file(TEMP_SET_PATH + "/quota.txt")
+        return TEMP_SET_QUOTA if quota is None else quota
+
+    @staticmethod
+    def set_quota(quota):
+        """Set the quota of all the temp sets in MB, None for no quota
+        :param quota:
+        :return:
+        """
+        write_file(TEMP_SET_PATH + "/quota.txt", quota)
+
+    @staticmethod
+    def get_usage(t_dir):
+        """Disk usage, last access and pin of a temp set
+        :param t_dir:
+        :return:
+        """
+        sizes = {"images": 0, "frames": 0, "caches": 0, "other": 0}
+        for r, ds, fs in os.walk(t_dir):
+            kind = os.path.relpath(r, t_dir).split(os.sep)[0]
+            for f in fs:
+                try:
+                    st = os.stat(os.path.join(r, f))
+                except OSError:
+                    continue  # removed meanwhile
+                size = st.st_size / st.st_nlink  # shared, see Cache
+                if kind == "temp":
+                    sizes["images"] += size
+                elif kind == "frames" and r == os.path.join(t_dir, kind) and \
+                        (f.endswith(".npz") or f.startswith("grid_")):
+                    sizes["frames"] += size
+                elif kind == "frames":
+                    sizes["caches"] += size
+                else:
+                    sizes["other"] += size
+        profile = read_file(t_dir + "/profile.txt") or {}
+        usage = Storage.read_access(t_dir)
+        usage.update(sizes)
+        usage["path"] = t_dir
+        usage["bytes"] = sum(sizes.values())
+        usage["status"] = profile.get("status", "complete")
+        return usage
+
+    @staticmethod
+    def get_usages():
+        """Disk usage of all the temp sets, least recently accessed first
+        :return:
+        """
+        if not os.path.isdir(TEMP_SET_PATH):
+            return []
+        t_dirs = [TEMP_SET_PATH + "/" + d
+                  for d in os.listdir(TEMP_SET_PATH)
+                  if not d.startswith(".")]
+        usages = [Storage.get_usage(t) for t in t_dirs if os.path.isdir(t)]
+        return sorted(usages, key=lambda u: u["time"])
+
+    @staticmethod
+    def get_total():
+        """Disk usage of all the temp sets and the cache in bytes
+        :return:
+        """
+        return sum(u["bytes"] for u in Storage.get_usages()) + \
+            Cache.get_bytes()
+
+    @staticmethod
+    def evict(quota=None, keep=()):
+        """Evict the least recently accessed temp sets until the quota is
+        met, see the class
+        :param quota: quota in MB, the configured one by default
+        :param keep: paths of temp sets not to evict
+        :return: paths of the evicted temp sets
+        """
+        quota = Storage.get_quota() if quota is None else quota
+        if quota is None:
+            return []
+        limit = quota * 1024 ** 2
+        if Storage.get_total() <= limit:
+            return []
+        keep = [os.path.abspath(t) for t in keep]
+
+        def candidates():
+            return [u for u in Storage.get_usages() if not u["pinned"] and
+                    u["status"] == "complete" and
+                    os.path.abspath(u["path"]) not in keep]
+
+        # cache entries of removed temp sets, then images that can be
+        # rendered again from the frames
+        Cache.prune()
+        total = Storage.get_total()
+        evicted = []
+        for u in candidates():
+            if total <= limit:
+                break
+            if u["frames"] == 0 or u["images"] + u["caches"] == 0:
+                continue
+            Storage.clear(u["path"])
+            total -= u["images"] + u["caches"]
+            evicted.append(u["path"])
+            print("[STEP] Evicted images of " + u["path"] + ", " +
+                  "%.1f MB" % ((u["images"] + u["caches"]) / 1024 ** 2))
+
+        # whole sets made under the quota, the least recently accessed
+        # first
+        Cache.prune()
+        total = Storage.get_total()
+        for u in candidates():
+            if total <= limit:
+                break
+            if not u["quota"] or u["frames"] == 0:
+                continue
+            shutil.rmtree(u["path"], ignore_errors=True)
+            total -= u["bytes"]
+            if u["path"] not in evicted:
+                evicted.append(u["path"])
+            print("[STEP] Evicted temp set " + u["path"])
+        Cache.prune()
+        total = Storage.get_total()
+        if total > limit:
+            print("[ERROR] Temp sets exceed the quota of %.1f MB by %.1f MB, "
+                  "the rest is pinned or in use" %
+                  (quota, (total - limit) / 1024 ** 2))
+        return evicted
+
+    @staticmethod
+    def clear(t_dir):
+        """Remove the images and caches of a temp set, keeping the frames
+        :param t_dir:
+        :return:
+        """
+        temp_path = t_dir + "/temp"
+        for f in os.listdir(temp_path):
+            os.remove(temp_path + "/" + f)
+        fp = frames_path(temp_path)
+        for f in os.listdir(fp):
+            if f.endswith(".npz") or f.startswith("grid_"):
+                continue
+            if os.path.isdir(fp + "/" + f):
+                shutil.rmtree(fp + "/" + f, ignore_errors=True)
+            else:
+                os.remove(fp + "/" + f)
+        access = Storage.read_access(t_dir)
+        access["evicted"] = True
+        write_file(t_dir + "/access.txt", access)
+
+
+class Cache(object):
+    """Frames and images of source files shared by the temp sets
+
+    An entry holds the frame, the image and the profile made from one
+    source file with one config. Its key is made of the identity of the
+    file (path, size and modification time), the task, the options, the
+    rendering settings and RENDER_VERSION. Entries are kept in ".cache" of
+    TEMP_SET_PATH, and the files of a new temp set are hard links to an
+    entry when it exists, so making a temp set again takes no processing
+    and no disk. Frames and images are always replaced and never written in
+    place, a shared file does not change under another temp set. Entries
+    that are no longer linked from a temp set are removed when the quota is
+    exceeded, see Storage.
+    """
+
+    keys = ["task", "options", "precision", "encoding", "compression",
+            "style"]
+
+    @staticmethod
+    def get_key(file_path, config):
+        """Key of the entry of a source file and a config
+        :param file_path:
+        :param config:
+        :return: None if the file does not exist
+        """
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        ident = [os.path.abspath(file_path), st.st_size, st.st_mtime_ns,
+                 RENDER_VERSION] + [config.get(k) for k in Cache.keys]
+        return hashlib.md5(json.dumps(ident, sort_keys=True,
+                                      default=str).encode()).hexdigest()
+
+    @staticmethod
+    def contains(file_path, config):
+        """Whether the cache has the entry of a source file and a config
+        :param file_path:
+        :param config:
+        :return:
+        """
+        key = Cache.get_key(file_path, config)
+        return key is not None and \
+            os.path.exists(TEMP_SET_PATH + "/.cache/" + key + "/entry.txt")
+
+    @staticmethod
+    def get(file_path, config, i, temp_path):
+        """Link the entry of a source file into a temp set
+        :param file_path:
+        :param config:
+        :param i: job index of the temp set
+        :param temp_path: absolute temp path of the temp set
+        :return: record as returned by Control.work, None if there is no
+        entry
+        """
+        key = Cache.get_key(file_path, config)
+        if key is None:
+            return None
+        e_dir = TEMP_SET_PATH + "/.cache/" + key
+        entry = read_file(e_dir + "/entry.txt")
+        if entry is None:
+            return None
+        stats = Stats(file_path)
+        paths = {"temp": temp_path, "frames": frames_path(temp_path)}
+        try:
+            with stats.measure("cache"):
+                for d, f in entry["files"]:
+                    Cache.link(e_dir + "/" + f, paths[d] + "/" + f)
+        except OSError:
+            return None  # removed meanwhile, processed again
+        profile = copy.deepcopy(config)  # name and description of this set
+        profile["options"] = entry["profile"]["options"]
+        return {
+            "job": i,
+            "file": file_path,
+            "error": None,
+            "dt": entry["dt"],
+            "frame": paths["frames"] + "/" + entry["dt"] + ".npz",
+            "profile": profile,
+            "stats": stats.to_dict(),
+            "cached": True
+        }
+
+    @staticmethod
+    def put(r, config, temp_path):
+        """Add the frame and the image of a processed file as an entry
+        :param r: record as returned by Control.work
+        :param config:
+        :param temp_path: absolute temp path of the temp set
+        :return:
+        """
+        key = Cache.get_key(r["file"], config)
+        if key is None:
+            return
+        e_dir = TEMP_SET_PATH + "/.cache/" + key
+        if os.path.exists(e_dir):
+            return
+        fp = frames_path(temp_path)
+        files = [("frames", r["dt"] + ".npz")]
+        if r.get("grid"):
+            files.append(("frames", "grid_" + r["grid"] + ".npy"))
+        for ext in [".png", ".webp"]:
+            if os.path.exists(temp_path + "/" + r["dt"] + ext):
+                files.append(("temp", r["dt"] + ext))
+        paths = {"temp": temp_path, "frames": fp}
+
+        # entries appear complete or not at all
+        tmp = e_dir + "." + str(os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            for d, f in files:
+                Cache.link(paths[d] + "/" + f, tmp + "/" + f)
+            write_file(tmp + "/entry.txt", {
+                "dt": r["dt"],
+                "profile": r["profile"],
+                "files": files
+            })
+            os.rename(tmp, e_dir)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # added by another user
+
+    @staticmethod
+    def link(src, dst):
+        """Hard link a file, copied where links are not supported
+        :param src:
+        :param dst:
+        :return:
+        """
+        tmp = dst + "." + str(os.getpid()) + "." + \
+            str(threading.get_ident())
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+    @staticmethod
+    def get_bytes():
+        """Disk usage of the cache, files shared with temp sets count by
+        their share
+        :return:
+        """
+        total = 0
+        for r, ds, fs in os.walk(TEMP_SET_PATH + "/.cache"):
+            for f in fs:
+                try:
+                    st = os.stat(os.path.join(r, f))
+                except OSError:
+                    continue
+                total += st.st_size / st.st_nlink
+        return total
+
+    @staticmethod
+    def prune():
+        """Remove the entries with files no temp set links to
+
+        An entry is in use while temp sets link its frame and its image, an
+        entry whose image is evicted is removed so the image is freed. Grid
+        files are left out, they are shared by all the entries and temp sets
+        of a geometry and replaced by identical copies.
+        :return: bytes freed
+        """
+        path = TEMP_SET_PATH + "/.cache"
+        if not os.path.isdir(path):
+            return 0
+        freed = 0
+        for key in os.listdir(path):
+            entry = read_file(path + "/" + key + "/entry.txt")
+            if entry is None:
+                continue  # being added
+            try:
+                st = [(f, os.stat(path + "/" + key + "/" + f))
+                      for d, f in entry["files"]]
+            except OSError:
+                st = []
+            if st and all(s.st_nlink > 1 for f, s in st
+                          if not f.startswith("grid_")):
+                continue
+            st = [s for f, s in st]
+            freed += sum(s.st_size / s.st_nlink for s in st)
+            shutil.rmtree(path + "/" + key, ignore_errors=True)
+        return freed
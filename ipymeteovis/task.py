@@ -1,7 +1,6 @@
-"""Class definitions of various tasks and the central control
+"""Class definitions of various tasks
 
-The control class is for communicating with the front-end GUI, and to
-organize the task into parallel.
+The central control organizing the tasks into parallel is in control.
 Different tasks are defined by different classes. The "task" class is a unique
 entrance that leads to different task instance based on the input task.
 Each task class defines a tests and a create temp method as the two major
@@ -9,10 +8,16 @@ steps of the background computation. Content will be different.
 """
 
 import os
-import time
-from functools import partial
-import multiprocessing as mp
+from functools import lru_cache
+from contextlib import nullcontext
 import copy
+import hashlib
+import io
+
+try:
+    import pyproj
+except ImportError:  # only needed for composites in a projection
+    pyproj = None
 
 import h5py
 import wradlib as wrl
@@ -20,119 +25,45 @@ import numpy as np
 from dateutil import parser
 import matplotlib.pyplot as plt
 import matplotlib.colors as colors
+from PIL import Image, features
 
-TEMP_SET_PATH = "./temp_sets"
+from .util import write_atomic, frames_path
+from .stats import Stats
+from .series import Series
 
+WARP_SIZE = 1200  # longest side in pixels of images of irregular grids
+WARP_CACHE = 4  # warp maps kept per process, see Task2D.get_warp
 
-class Control(object):
-    """Central control of data processing before visualization.
 
+def open_file(file_path, f=None):
+    """Open a HDF5 file for reading, or reuse the given opened file
+    :param file_path:
+    :param f: opened h5py file or None
+    :return: context manager of the file
     """
+    if f is None:
+        return h5py.File(file_path, "r")
+    return nullcontext(f)
 
-    def __init__(self, data_path):
-        self.data_path = data_path
-        self.tasks = []
-        self.file_list = []
-
-        # get file list
-        for r, d, fs in os.walk(data_path):
-            fs = [r + "/" + f for f in fs if not f.startswith('.')]
-            self.file_list += fs
-
-    def choose_task(self, task):
-        """First hand-shake between the GUI and the task controller.
-
-        By specifying the task and dataset, a list of option will be returned
-        to the GUI for users to choose and generate the config.
-        :param data_path:
-        :param task:
-        :return:
-        """
-        sample_file = self.file_list[0]
-        t = Task(file_path=sample_file, task=task)
-        o_list = t.get_options()
-        return o_list
-
-    def submit(self, config):
-        """Second hand-shake between GUI and the task controller.
-
-        Submit task and make selection as the result. Task will be separated
-        by files and processed in parallel. A selection is generated as a
-        result. Physically, a selection is a directory including a profile
-        file and a sub-directory of temporal files.
-        :param config:
-        :return:
-        """
-        if config["task"] is None:
-            print("[ERROR] Please choose your task")
-            return
-
-        # create temp set directory
-        id = str(time.time_ns())
-        t_dir = TEMP_SET_PATH + "/" + id
-        temp_path = t_dir + "/temp"
-        os.mkdir(t_dir)  # temp directory
-        os.mkdir(temp_path)  # temp file directory
-
-        # create task list
-        print("[STEP] Initialize task......", end="")
-        job = partial(
-            Task,
-            task=config["task"]
-        )
-        args = self.file_list
-        self.tasks = self.parallel(job, args)
-        print("Done!")
-
-        # tests tasks
-        print("[STEP] Process task......", end="")
-        job = partial(
-            self.process,
-            config=config
-        )
-        args = self.tasks
-        self.tasks = self.parallel(job, args)
-        print("Done!")
-
-        # create temporary files
-        print("[STEP] Create temp files......", end="")
-        job = partial(
-            self.create_temp,
-            temp_path=temp_path
-        )
-        args = self.tasks
-        self.parallel(job, args)
-        print("Done!")
-
-        # create profile
-        t_profile = {
-            "source": self.data_path,
-            "temp_path": temp_path,
-            "task": self.tasks[0].get_profile(config)
-        }
-        with open(t_dir + "/profile.txt", 'w') as f:
-            print(t_profile, file=f)
-        print("[STEP] Task completed!")
-
-    @staticmethod
-    def process(task, config):
-        task.process(config=config)
-        return task
 
-    @staticmethod
-    def create_temp(task, temp_path):
-        task.create_temp(temp_path=temp_path)
+def parse_roi(roi):
+    """Parse a region of interest given as bounds or as a string.
 
-    @staticmethod
-    def parallel(job, args):
-        """Map job on args in parallel
-        :param job:
-        :param args:
-        :return:
-        """
-        with mp.Pool(processes=mp.cpu_count()) as pool:
-            result = pool.map_async(job, args).get()
-        return result
+    The string holds "lat_min, lon_min, lat_max, lon_max", empty means no
+    region of interest.
+    :param roi: bounds [[lat_min, lon_min], [lat_max, lon_max]], str or None
+    :return: ((lat_min, lon_min), (lat_max, lon_max)) or None
+    """
+    if roi is None:
+        return None
+    if isinstance(roi, str):
+        if not roi.strip():
+            return None
+        v = [float(x) for x in roi.replace(";", ",").split(",")]
+        roi = [v[0:2], v[2:4]]
+    (lat_min, lon_min), (lat_max, lon_max) = roi
+    return ((min(lat_min, lat_max), min(lon_min, lon_max)),
+            (max(lat_min, lat_max), max(lon_min, lon_max)))
 
 
 class Task(object):
@@ -146,6 +77,8 @@ class Task(object):
     tasks = [
         "Radar polar volume (2D)",  # radar polar volume
         "Radar scan integration (2D)",  # radar scan integration
+        "Radar composite or image (2D)",  # ODIM COMP and IMAGE products
+        "Radar volume product (2D)",  # column maximum and CAPPI of volumes
     ]
 
     def __new__(cls, file_path, task):
@@ -153,29 +86,473 @@ class Task(object):
             return PolarVol2D(file_path)
         elif task == cls.tasks[1]:
             return ScanIntg2D(file_path)
+        elif task == cls.tasks[2]:
+            return CompImage2D(file_path)
+        elif task == cls.tasks[3]:
+            return VolProd2D(file_path)
 
 
-class PolarVol2D:
-    """Radar scans as polar volumes
+class Task2D(object):
+    """Shared methods of tasks resulting in 2D raster frames
 
-    Data are stored in HDF5 format based on the OPERA weather radar
-    information model. Config should include the following information:
-    scan, quantity (qty), elangle, nbins, nrarys, rscale, a1gate, gain,
-    offset, nodate, undetect
+    Processed data are stored as frames in the "frames" directory of the
+    temp set: a compressed float32 array per frame with masked cells as NaN,
+    together with bounds, colormap range and a summary of values, and the
+    grid once per geometry. Frames can be rendered again from the store
+    without the source files.
+
+    The summary is a histogram over fixed bins, so summaries of different
+    files are merged by adding them up.
     """
+    hist_bins = (-100, 400, 1000, False)  # min, max, number, log10 scale
+    log_bins = (-2, 6, 800, True)  # bins of data shown on a log scale
+    percentiles = (1, 99)  # dataset-wide colormap range
+    cmap = "jet"
+    norm = "linear"
+    symmetric = False  # colormap range centered at zero
+    v_range = (None, None)  # colormap range until the data is read
 
     def __init__(self, file_path):
-        """
-
-        :param file_path:
-        """
         self.file_path = file_path
         self.data = None
         self.grid = None
         self.bounds = None
-        self.v_min = None
-        self.v_max = None
+        self.wraps = False  # the data cover all azimuths of a polar grid
+        self.v_min, self.v_max = self.v_range
         self.dt = None
+        self.stats = Stats(file_path)
+
+    def get_options(self):
+        """Options of all the tasks, following those of the task
+        :return:
+        """
+        return [{
+            "key": "range",
+            "type": "dropdown",
+            "options": [("Fixed", "fixed"),
+                        ("Dataset (1-99 percentile)", "dataset")],
+            "description": "Range"
+        }, {
+            "key": "roi",
+            "type": "text",
+            "placeholder": "lat_min, lon_min, lat_max, lon_max",
+            "description": "ROI"
+        }]
+
+    def estimate_memory(self, config, f=None):
+        """Estimate the peak memory of processing the file in bytes.
+
+        Based on the shapes of the datasets, without the region of interest,
+        so it is an upper bound.
+        :param config:
+        :param f: opened h5py file of file_path, opened here if None
+        :return:
+        """
+        raise NotImplementedError
+
+    def get_norm(self):
+        if self.norm == "log":
+            return colors.LogNorm(vmin=self.v_min, vmax=self.v_max)
+        return colors.Normalize(vmin=self.v_min, vmax=self.v_max)
+
+    def set_style(self, style):
+        """Override the colormap of the task, e.g. of a derived temp set
+        :param style: dict with optional "cmap", "norm" ("linear" or "log")
+        and "symmetric", or None
+        :return:
+        """
+        if not style:
+            return
+        self.cmap = style.get("cmap", self.cmap)
+        self.symmetric = style.get("symmetric", self.symmetric)
+        norm = style.get("norm", self.norm)
+        if norm != self.norm:
+            self.norm = norm
+            self.hist_bins = self.log_bins if norm == "log" else \
+                Task2D.hist_bins
+
+    @staticmethod
+    def guess_range(data):
+        """Choose the boundaries of the colormap by the range of the data
+        :param data:
+        :return: v_min, v_max
+        """
+        v_min = data.min()
+        v_max = data.max()
+        if v_min >= 0 and v_max <= 1:
+            return 0.2, 0.8
+        elif v_min >= 0 and v_max <= 10:
+            return 1, 8
+        elif v_min >= -50 and v_max <= 100:
+            return -10, 80
+        else:
+            return 0, 350
+
+    @staticmethod
+    def read_attr(groups, name, default=None):
+        """Read a scalar attribute from the first group that has it
+        :param groups: h5py groups in order of precedence
+        :param name:
+        :param default:
+        :return:
+        """
+        for g in groups:
+            if name in g.attrs:
+                v = g.attrs[name]
+                if isinstance(v, np.ndarray): v = v[0]
+                if isinstance(v, bytes): v = v.decode("utf-8")
+                return v
+        return default
+
+    @staticmethod
+    def to_dt(tp):
+        """Time stamp of a frame, to the minute
+        :param tp: date and time as a string
+        :return:
+        """
+        dt = parser.parse(tp)
+        dt = dt.replace(second=0, microsecond=0)  # ignore second
+        return dt.strftime("%Y%m%d %H%M")  # transfer back to str
+
+    def read_time(self, f, config=None):
+        """Read the time stamp of a file, nominal date and time of ODIM
+        :param f: opened h5py file
+        :param config:
+        :return:
+        """
+        return self.to_dt(self.read_attr([f["what"]], "date") + " " +
+                          self.read_attr([f["what"]], "time"))
+
+    def summarize(self):
+        """Summarize the values of the data over the fixed bins
+        :return: dict of histogram, min, max and count
+        """
+        lo, hi, n, log = self.hist_bins
+        v = np.ma.compressed(self.data)
+        v = v[np.isfinite(v)]
+        if log:
+            v = v[v > 0]
+        result = {
+            "min": float(v.min()) if v.size else None,
+            "max": float(v.max()) if v.size else None,
+            "count": int(v.size)
+        }
+        if log:
+            v = np.log10(v)
+        result["hist"] = np.histogram(np.clip(v, lo, hi), bins=n,
+                                      range=(lo, hi))[0]
+        return result
+
+    @staticmethod
+    def merge(summaries):
+        """Merge summaries of several frames
+        :param summaries:
+        :return:
+        """
+        summaries = [s for s in summaries if s["count"] > 0]
+        if not summaries:
+            return None
+        return {
+            "min": min(s["min"] for s in summaries),
+            "max": max(s["max"] for s in summaries),
+            "count": sum(s["count"] for s in summaries),
+            "hist": np.sum([s["hist"] for s in summaries], axis=0)
+        }
+
+    def get_range(self, summary):
+        """Compute the colormap range from the percentiles of a summary
+        :param summary:
+        :return: (v_min, v_max) or None if there are no values
+        """
+        if summary is None:
+            return None
+        lo, hi, n, log = self.hist_bins
+        hist = summary["hist"]
+        cum = np.cumsum(hist)
+        edges = np.linspace(lo, hi, n + 1)
+
+        def percentile(p):
+            k = p / 100.0 * cum[-1]
+            i = min(int(np.searchsorted(cum, k)), n - 1)
+            prev = cum[i - 1] if i > 0 else 0
+            frac = (k - prev) / hist[i] if hist[i] > 0 else 0
+            v = edges[i] + frac * (edges[i + 1] - edges[i])
+            v = 10 ** v if log else v
+            return float(min(max(v, summary["min"]), summary["max"]))
+
+        v_min, v_max = [percentile(p) for p in self.percentiles]
+        if v_min >= v_max:
+            v_min, v_max = summary["min"], summary["max"]
+        if self.symmetric and log:
+            v_max = max(v_max, 1 / v_min, 1 + 1e-6)  # centered at one
+            return 1 / v_max, v_max
+        elif self.symmetric:
+            v_max = max(abs(v_min), abs(v_max)) or 1.0
+            return -v_max, v_max
+        if v_min >= v_max:
+            v_max = v_min * 10 if log else v_min + 1
+        return v_min, v_max
+
+    def get_geometry(self):
+        """Grid key, shape and bounds of the data, as of a stored frame
+        :return:
+        """
+        key = ""  # regular grids are given by bounds and shape of the data
+        if self.grid is not None:
+            key = hashlib.md5(
+                np.ascontiguousarray(self.grid)).hexdigest()[:16]
+        bounds = tuple(tuple(float(v) for v in b) for b in self.bounds)
+        return key, self.data.shape, bounds
+
+    def create_temp(self, temp_path, defer=False, encoding=None, level=None):
+        """
+        Create temp file that is the raster image.
+
+        The image is in Web Mercator, so the map places it on the bounds
+        without distortion. The colors of the cells are looked up in the
+        colormap, and gathered into the pixels by the warp map of the
+        geometry, see get_warp.
+        :param temp_path:
+        :param defer: return the path without the extension and the args of
+        Task2D.encode_pixels instead of writing
+        :param encoding: image format, see Task2D.encode_image
+        :param level: compression level from 0 to 9
+        :return:
+        """
+        with self.stats.measure("render"):
+            # 256 colors of the colormap and a transparent one for masks
+            lut = plt.get_cmap(self.cmap)(np.arange(256))
+            lut = np.vstack([lut, [0, 0, 0, 0]])
+            lut = np.round(lut * 255).astype(np.uint8)
+
+            v = self.get_norm()(np.ma.masked_invalid(self.data))
+            mask = np.ma.getmaskarray(v)
+            index = np.ma.filled(v, 0) * 256
+            index = np.clip(index, 0, 255).astype(np.intp)
+            index[mask] = 256
+            warp = Task2D.get_warp(frames_path(temp_path),
+                                   self.get_geometry())
+            index = np.append(index.ravel(), 256)[warp]  # -1 is masked
+            index = index.astype(np.uint16)
+
+        if defer:
+            return temp_path + "/" + self.dt, (index, lut, encoding, level)
+        with self.stats.measure("save"):
+            ext, content = self.encode_pixels(index, lut, encoding, level)
+        temp_img = temp_path + "/" + self.dt + ext
+        write_atomic(temp_img, content)  # images may be shared, see Cache
+        self.stats.add_io("save", written=len(content))
+
+    @staticmethod
+    @lru_cache(maxsize=WARP_CACHE)
+    def get_warp(path, geometry):
+        """Warp map from the pixels of a Web Mercator image over the bounds
+        to the cells of a geometry, computed once per geometry.
+
+        Pixel rows are evenly spaced in Mercator y. A regular grid gets one
+        column per cell, and rows no taller than the cells anywhere in the
+        bounds. Other grids get WARP_SIZE pixels along the longest side.
+        :param path: frames directory, with the grid file of the geometry
+        :param geometry: grid key, shape and bounds of the data
+        :return: read-only int32 array of flat indices of shape (height,
+        width), -1 outside the data
+        """
+        key, shape, bounds = geometry
+        (lat_min, lon_min), (lat_max, lon_max) = bounds
+        y_min, y_max = [np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+                        for lat in (lat_min, lat_max)]
+        x_span = np.radians(lon_max - lon_min)
+        if not key:
+            width = shape[1]
+            # a cell spans d_lat / cos(lat) in Mercator y, the least at the
+            # latitude closest to the equator, and rows of that height give
+            # every cell at least one row
+            cos = np.cos(np.radians(min(max(0.0, lat_min), lat_max)))
+            d_y = np.radians(lat_max - lat_min) / shape[0] / cos
+            height = int(np.ceil((y_max - y_min) / d_y - 1e-6))
+        elif x_span >= y_max - y_min:
+            width = WARP_SIZE
+            height = int(round(WARP_SIZE * (y_max - y_min) / x_span))
+        else:
+            height = WARP_SIZE
+            width = int(round(WARP_SIZE * x_span / (y_max - y_min)))
+        width, height = max(width, 1), max(height, 1)
+
+        ys = y_max - (np.arange(height) + 0.5) * (y_max - y_min) / height
+        lats = np.degrees(2 * np.arctan(np.exp(ys)) - np.pi / 2)
+        lons = lon_min + (np.arange(width) + 0.5) * (lon_max - lon_min) / \
+            width
+        lats, lons = np.meshgrid(lats, lons, indexing="ij")
+        idx = Series.locate(path, lats.ravel(), lons.ravel(), geometry)
+        idx = idx.reshape(height, width).astype(np.int32)
+        idx.flags.writeable = False
+        return idx
+
+    @staticmethod
+    def estimate_render(pixels):
+        """Estimate the memory of rendering an image in bytes, see
+        create_temp
+        :param pixels: number of pixels of the image
+        :return:
+        """
+        # warp maps kept by get_warp, points and lookup of building one,
+        # gathered color indices, their uint16 copy and RGBA pixels
+        return pixels * (WARP_CACHE * 4 + 48 + 8 + 2 + 4)
+
+    def save_frame(self, path, summary, defer=False):
+        """Store the processed data as a frame
+        :param path: frames directory of the temp set
+        :param summary: summary of the values from summarize
+        :param defer: return the arrays of the frame instead of writing it
+        :return: path of the frame file, and the arrays if deferred
+        """
+        key = self.get_geometry()[0]
+        grid_fp = path + "/grid_" + key + ".npy"
+        if key and not os.path.exists(grid_fp):
+            tmp = grid_fp + "." + str(os.getpid())
+            with open(tmp, "wb") as f:
+                np.save(f, np.asarray(self.grid))
+            os.replace(tmp, grid_fp)  # grids are shared by workers
+
+        fp = path + "/" + self.dt + ".npz"
+        frame = {
+            "data": np.ma.filled(np.ma.asarray(self.data, np.float32),
+                                 np.nan),
+            "grid": key,
+            "source": str(self.file_path),
+            "bounds": np.array(self.bounds, dtype=float),
+            "wraps": bool(self.wraps),
+            "v_range": np.array([self.v_min, self.v_max], dtype=float),
+            "hist": summary["hist"],
+            "values": np.array([
+                np.nan if summary["min"] is None else summary["min"],
+                np.nan if summary["max"] is None else summary["max"],
+                summary["count"]
+            ])
+        }
+        if defer:
+            return fp, frame
+        write_atomic(fp, self.encode_frame(frame))
+        return fp
+
+    @staticmethod
+    def encode_pixels(index, lut, encoding=None, level=None):
+        """Encode an image given by colormap indices of its pixels
+        :param index: array of indices into lut of shape (height, width)
+        :param lut: RGBA colors
+        :param encoding: see Task2D.encode_image
+        :param level: compression level from 0 (fast) to 9 (small)
+        :return: file extension and bytes of the image
+        """
+        im = Image.fromarray(lut[index], "RGBA")
+        return Task2D.encode_image(im, encoding, level)
+
+    @staticmethod
+    def encode_image(content, encoding=None, level=None):
+        """Encode a rendered RGBA png in a more compact format
+
+        A colormapped field has at most 256 colours plus transparency, so
+        "palette" writes an 8-bit palette png with the alpha values in a tRNS
+        chunk, and "webp" a lossless WebP. "png" (default) keeps the RGBA png.
+        :param content: bytes of the RGBA png, or a RGBA image
+        :param encoding: "png", "palette" or "webp"
+        :param level: compression level from 0 (fast) to 9 (small)
+        :return: file extension and bytes of the image
+        """
+        if encoding in [None, "png"] and isinstance(content, bytes):
+            return ".png", content
+        if isinstance(content, bytes):
+            im = Image.open(io.BytesIO(content)).convert("RGBA")
+        else:
+            im = content
+        b = io.BytesIO()
+        if encoding in [None, "png"]:
+            im.save(b, "PNG", compress_level=6 if level is None else level)
+            return ".png", b.getvalue()
+        elif encoding == "palette":
+            im, alpha = Task2D.to_palette(im)
+            im.save(b, "PNG", transparency=alpha,
+                    compress_level=6 if level is None else int(level))
+            return ".png", b.getvalue()
+        elif encoding == "webp":
+            if not features.check("webp"):
+                raise ValueError("WebP is not supported by Pillow")
+            im.save(b, "WEBP", lossless=True, quality=100,
+                    method=4 if level is None else int(level) * 6 // 9)
+            return ".webp", b.getvalue()
+        raise ValueError("Unknown image encoding: " + str(encoding))
+
+    @staticmethod
+    def to_palette(im):
+        """Convert a RGBA image into an exact palette image, quantized if it
+        has more than 256 colours
+        :param im: RGBA image
+        :return: palette image and the alpha of each palette entry
+        """
+        a = np.array(im).reshape(-1, 4)
+        a[a[:, 3] == 0] = 0  # all transparent pixels share one entry
+        keys = a.view(np.uint32).ravel()
+        entries, index = np.unique(keys, return_inverse=True)
+        if len(entries) > 256:
+            # fast octree keeps the alpha in the palette of the image
+            return im.quantize(colors=256, method=2), None
+        palette = entries.view(np.uint8).reshape(-1, 4)
+        p = Image.fromarray(index.astype(np.uint8).reshape(im.size[::-1]),
+                            "P")
+        p.putpalette(palette[:, :3].ravel().tolist())
+        return p, bytes(palette[:, 3].tolist())
+
+    @staticmethod
+    def encode_frame(frame):
+        """Compress the arrays of a frame into the bytes of a npz file
+        :param frame: dict of arrays
+        :return:
+        """
+        b = io.BytesIO()
+        np.savez_compressed(b, **frame)
+        return b.getvalue()
+
+    def load_frame(self, fp):
+        """Load a stored frame, the grid is memory mapped
+        :param fp: path of the frame file
+        :return:
+        """
+        with np.load(fp) as z:
+            self.data = np.ma.masked_invalid(z["data"], copy=False)
+            self.bounds = z["bounds"].tolist()
+            self.v_min, self.v_max = [float(v) for v in z["v_range"]]
+            key = str(z["grid"])
+            self.wraps = "wraps" in z.files and bool(z["wraps"])
+        self.dt = os.path.splitext(os.path.basename(fp))[0]
+        self.grid = None
+        if key:
+            self.grid = np.load(
+                os.path.dirname(fp) + "/grid_" + key + ".npy", mmap_mode="r")
+
+    @staticmethod
+    def read_summary(fp):
+        """Read only the summary of values of a stored frame
+        :param fp: path of the frame file
+        :return:
+        """
+        with np.load(fp) as z:
+            v_min, v_max, count = z["values"]
+            return {
+                "min": float(v_min),
+                "max": float(v_max),
+                "count": int(count),
+                "hist": z["hist"]
+            }
+
+
+class PolarVol2D(Task2D):
+    """Radar scans as polar volumes
+
+    Data are stored in HDF5 format based on the OPERA weather radar
+    information model. Config should include the following information:
+    scan, quantity (qty), elangle, nbins, nrarys, rscale, a1gate, gain,
+    offset, nodate, undetect
+    """
 
     def get_options(self):
         o_list = []
@@ -213,9 +590,16 @@ class PolarVol2D:
             "description": "Quantity"
         })
 
+        o_list += Task2D.get_options(self)
+        o_list.append({
+            "key": "max_range",
+            "type": "float",
+            "description": "Range (km)"
+        })
+
         return o_list
 
-    def get_profile(self, config):
+    def get_profile(self, config, f=None):
         """Return the profile string
         :return:
         """
@@ -223,9 +607,11 @@ class PolarVol2D:
         scan = c["options"]["scan"]
         qty = c["options"]["qty"]
         # app = c["options"]["appearance"]
-        with h5py.File(self.file_path, "r") as f:
+        with open_file(self.file_path, f) as f:
             scan = "Elev. = " + str(f[scan]["where"].attrs["elangle"])
             qty = f["dataset1"][qty]["what"].attrs["quantity"].decode("utf-8")
+        roi = parse_roi(config["options"].get("roi"))
+        max_range = config["options"].get("max_range") or None
         c["options"] = {
             "Scan": scan,
             "Quantity": qty,
@@ -233,155 +619,282 @@ class PolarVol2D:
             "Colormap": ("jet", (self.v_min, self.v_max), "linear"),
             "Bounds": self.bounds
         }
+        if roi is not None:
+            c["options"]["ROI"] = roi
+        if max_range is not None:
+            c["options"]["Range (km)"] = max_range
         return c
 
-    def process(self, config):
+    def estimate_memory(self, config, f=None):
+        """Memory of one scan with its georeferencing, see
+        Task2D.estimate_memory
+        """
+        scan = config["options"]["scan"]
+        qty = config["options"]["qty"]
+        with open_file(self.file_path, f) as f:
+            dset = f[scan][qty]["data"]
+            nrays, nbins = dset.shape
+            n = dset.size
+            itemsize = dset.dtype.itemsize
+
+        # raw data, mask with a transient one and working copies of the data
+        if config.get("precision", "float64") == "float32":
+            data = n * (itemsize + 2 + 4)
+        else:
+            data = n * (itemsize + 2 + 3 * 8)
+        # corners of the grid, with intermediate copies of georeferencing
+        grid = (nrays + 1) * (nbins + 1) * 3 * 8 * 3
+        # color of every cell, warp maps and pixels of the image
+        render = n * 16 + self.estimate_render(WARP_SIZE ** 2)
+        return data + grid + render
+
+    def process(self, config, f=None):
         """
         Get all the attributes and transform coordinate system from
         spherical to geographical. Config of PolarVol2D should include
         information of scan and qty.
+        :param config:
+        :param f: opened h5py file of file_path, opened here if None
         :return:
         """
-        # Read the data and all the necessary attributes
+        # Read all the necessary attributes
         scan = config["options"]["scan"]
         qty = config["options"]["qty"]
-        with h5py.File(self.file_path, "r") as f:
-            self.data = f[scan][qty]["data"][...]
-
-            # prepare attributes
-            elangle = f[scan]["where"].attrs["elangle"]
-            if isinstance(elangle, np.ndarray): elangle = elangle[0]
-            elangle = float(elangle)
-
-            rscale = f[scan]["where"].attrs["rscale"]
-            if isinstance(rscale, np.ndarray): rscale = rscale[0]
-            rscale = float(rscale)
-
-            nbins = f[scan]["where"].attrs["nbins"]
-            if isinstance(nbins, np.ndarray): nbins = nbins[0]
-            nbins = int(nbins)
-
-            nrays = f[scan]["where"].attrs["nrays"]
-            if isinstance(nrays, np.ndarray): nrays = nrays[0]
-            nrays = int(nrays)
-
-            gain = f[scan][qty]["what"].attrs["gain"]
-            if isinstance(gain, np.ndarray): gain = gain[0]
-            gain = float(gain)
-
-            offset = f[scan][qty]["what"].attrs["offset"]
-            if isinstance(offset, np.ndarray): offset = offset[0]
-            offset = float(offset)
-
-            nodata = f[scan][qty]["what"].attrs["nodata"]
-            if isinstance(nodata, np.ndarray): nodata = nodata[0]
-            nodata = float(nodata)
-
-            undetect = f[scan][qty]["what"].attrs["undetect"]
-            if isinstance(undetect, np.ndarray): undetect = undetect[0]
-            undetect = float(undetect)
-
-            lon = f["where"].attrs["lon"]
-            if isinstance(lon, np.ndarray): lon = lon[0]
-            lon = float(lon)
-
-            lat = f["where"].attrs["lat"]
-            if isinstance(lat, np.ndarray): lat = lat[0]
-            lat = float(lat)
-
-            height = f["where"].attrs["height"]
-            if isinstance(height, np.ndarray): height = height[0]
-            height = float(height)
-
-            date = f["what"].attrs["date"]
-            if isinstance(date, np.ndarray): date = date[0]
-            date = date.decode("utf-8")
-
-            tp = f["what"].attrs["time"]
-            if isinstance(tp, np.ndarray): tp = tp[0]
-            tp = tp.decode("utf-8")
-
-        # Datetime stamp
-        self.dt = parser.parse(date + " " + tp)
-        self.dt = self.dt.replace(second=0, microsecond=0)  # ignore second
-        self.dt = self.dt.strftime("%Y%m%d %H%M")  # transfer back to str
-
-        # Mask nodata and undetect value and compute unit values
-        self.data = np.ma.masked_values(self.data, undetect)
-        self.data = np.ma.masked_values(self.data, nodata)
-        self.data = self.data * gain + offset
-
-        # Compute v_min and v_max for choosing the boundaries of colormap
-        self.v_min = self.data.min()
-        self.v_max = self.data.max()
-        if self.v_min >= 0 and self.v_max <= 1:
-            self.v_min = 0.2
-            self.v_max = 0.8
-        elif self.v_min >= 0 and self.v_max <= 10:
-            self.v_min = 1
-            self.v_max = 8
-        elif self.v_min >= -50 and self.v_max <= 100:
-            self.v_min = -10
-            self.v_max = 80
-        else:
-            self.v_min = 0
-            self.v_max = 350
-
-        # Compute the grid
-        self.grid = np.empty((nrays, nbins, 3))  # azimuth, range, height
-        self.grid = wrl.georef.sweep_centroids(nrays=nrays, rscale=rscale,
-                                               nbins=nbins, elangle=elangle)
-        self.grid = np.insert(self.grid, 0, 0, axis=1)
-        self.grid = np.insert(self.grid, nrays, self.grid[0, :, :], axis=0)
-        self.grid = wrl.georef.polar.spherical_to_proj(
-            self.grid[..., 0], self.grid[..., 1], self.grid[..., 2],
-            (lon, lat, height)  # site coordinates
+        roi = parse_roi(config["options"].get("roi"))
+        max_range = config["options"].get("max_range") or None
+        with open_file(self.file_path, f) as f:
+            with self.stats.measure("read"):
+                elangle = f[scan]["where"].attrs["elangle"]
+                if isinstance(elangle, np.ndarray): elangle = elangle[0]
+                elangle = float(elangle)
+
+                rscale = f[scan]["where"].attrs["rscale"]
+                if isinstance(rscale, np.ndarray): rscale = rscale[0]
+                rscale = float(rscale)
+
+                nbins = f[scan]["where"].attrs["nbins"]
+                if isinstance(nbins, np.ndarray): nbins = nbins[0]
+                nbins = int(nbins)
+
+                nrays = f[scan]["where"].attrs["nrays"]
+                if isinstance(nrays, np.ndarray): nrays = nrays[0]
+                nrays = int(nrays)
+
+                gain = f[scan][qty]["what"].attrs["gain"]
+                if isinstance(gain, np.ndarray): gain = gain[0]
+                gain = float(gain)
+
+                offset = f[scan][qty]["what"].attrs["offset"]
+                if isinstance(offset, np.ndarray): offset = offset[0]
+                offset = float(offset)
+
+                nodata = f[scan][qty]["what"].attrs["nodata"]
+                if isinstance(nodata, np.ndarray): nodata = nodata[0]
+                nodata = float(nodata)
+
+                undetect = f[scan][qty]["what"].attrs["undetect"]
+                if isinstance(undetect, np.ndarray): undetect = undetect[0]
+                undetect = float(undetect)
+
+                lon = f["where"].attrs["lon"]
+                if isinstance(lon, np.ndarray): lon = lon[0]
+                lon = float(lon)
+
+                lat = f["where"].attrs["lat"]
+                if isinstance(lat, np.ndarray): lat = lat[0]
+                lat = float(lat)
+
+                height = f["where"].attrs["height"]
+                if isinstance(height, np.ndarray): height = height[0]
+                height = float(height)
+
+                self.dt = self.read_time(f)
+
+            # Compute the grid and the bounds, shared by scans of the same
+            # geometry, and crop them to the region of interest
+            with self.stats.measure("compute"):
+                rays, bins, self.grid, self.bounds = self.get_crop(
+                    nrays, nbins, rscale, elangle, (lon, lat, height), roi,
+                    max_range)
+                self.wraps = rays == [slice(0, nrays)]
+
+            # Read only the hyperslabs of the region of interest
+            with self.stats.measure("read"):
+                dset = f[scan][qty]["data"]
+                self.data = np.concatenate([dset[r, bins] for r in rays])
+                self.stats.add_io("read", read=dset.id.get_storage_size() *
+                                  self.data.size / max(dset.size, 1))
+
+        with self.stats.measure("compute"):
+            # Mask nodata and undetect value and compute unit values
+            if config.get("precision", "float64") == "float32":
+                # one float32 copy of the raw data, scaled in place
+                mask = np.isin(self.data, [undetect, nodata])
+                data = self.data.astype(np.float32)
+                data *= gain
+                data += offset
+                self.data = np.ma.MaskedArray(data, mask=mask, copy=False)
+            else:
+                self.data = np.ma.masked_values(self.data, undetect)
+                self.data = np.ma.masked_values(self.data, nodata)
+                self.data = self.data * gain + offset
+
+            # Compute v_min and v_max for choosing the boundaries of colormap
+            self.v_min, self.v_max = self.guess_range(self.data)
+
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def get_grid(nrays, nbins, rscale, elangle, site):
+        """Compute the grid of a scan and its bounds.
+
+        Results are cached per worker process, so the georeferencing is done
+        once per scan geometry instead of once per file. The returned grid is
+        shared and must not be modified.
+        :param nrays:
+        :param nbins:
+        :param rscale:
+        :param elangle:
+        :param site: (lon, lat, height) of the radar
+        :return: grid of (nrays + 1, nbins + 1, 2) corner coordinates, bounds
+        """
+        grid = wrl.georef.sweep_centroids(
+            nrays=nrays, rscale=rscale, nbins=nbins, elangle=elangle)
+        grid = np.insert(grid, 0, 0, axis=1)
+        grid = np.insert(grid, nrays, grid[0, :, :], axis=0)
+        grid = wrl.georef.polar.spherical_to_proj(
+            grid[..., 0], grid[..., 1], grid[..., 2],
+            site  # site coordinates
         )
-        np.set_printoptions(linewidth=np.inf)
+        grid.flags.writeable = False
 
         # Compute the bounds
-        lons = self.grid[..., 0].flatten()
-        lats = self.grid[..., 1].flatten()
-        self.bounds = [
-            [min(lats), min(lons)],
-            [max(lats), max(lons)]
+        lons = grid[..., 0]
+        lats = grid[..., 1]
+        bounds = [
+            [float(lats.min()), float(lons.min())],
+            [float(lats.max()), float(lons.max())]
         ]
+        return grid, bounds
 
-    def create_temp(self, temp_path):
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def get_crop(nrays, nbins, rscale, elangle, site, roi, max_range):
+        """Compute the rays and bins to read for a region of interest.
+
+        Bins are cut at the maximum range, rays and bins are limited to the
+        cells having a corner inside the bounding box. Rays wrapping around
+        north are read as two hyperslabs. Results are cached per worker
+        process like the grid.
+        :param nrays:
+        :param nbins:
+        :param rscale:
+        :param elangle:
+        :param site: (lon, lat, height) of the radar
+        :param roi: ((lat_min, lon_min), (lat_max, lon_max)) or None
+        :param max_range: maximum range in km or None
+        :return: list of slices of rays, slice of bins, cropped grid, bounds
         """
-        Create temp file that is the raster image.
-        :return:
+        grid, bounds = PolarVol2D.get_grid(nrays, nbins, rscale, elangle,
+                                           site)
+        if roi is None and max_range is None:
+            return [slice(0, nrays)], slice(0, nbins), grid, bounds
+
+        cells = np.ones((nrays, nbins), dtype=bool)
+        if max_range is not None:
+            cells[:, int(np.ceil(max_range * 1000 / rscale)):] = False
+        if roi is not None:
+            (lat_min, lon_min), (lat_max, lon_max) = roi
+            inside = (grid[..., 1] >= lat_min) & (grid[..., 1] <= lat_max) & \
+                     (grid[..., 0] >= lon_min) & (grid[..., 0] <= lon_max)
+            cells &= inside[:-1, :-1] | inside[1:, :-1] | \
+                inside[:-1, 1:] | inside[1:, 1:]
+        if not cells.any():
+            raise ValueError("Region of interest is outside of the scan")
+
+        b = np.nonzero(cells.any(axis=0))[0]
+        bins = slice(int(b[0]), int(b[-1]) + 1)
+
+        # shortest arc of rays covering the selected rays, split at north
+        r = np.nonzero(cells.any(axis=1))[0]
+        gaps = np.diff(np.append(r, r[0] + nrays))
+        k = int(np.argmax(gaps))
+        first, last = int(r[(k + 1) % len(r)]), int(r[k])
+        if gaps[k] == 1:
+            rays = [slice(0, nrays)]
+            rows = grid
+        elif first <= last:
+            rays = [slice(first, last + 1)]
+            rows = grid[first:last + 2]
+        else:
+            rays = [slice(first, nrays), slice(0, last + 1)]
+            # the last row of the grid is the first ray repeated
+            rows = np.concatenate((grid[first:], grid[1:last + 2]))
+        g = rows[:, bins.start:bins.stop + 1]
+        g.flags.writeable = False
+
+        # bounds of the cropped grid, clipped to the bounding box
+        bounds = [
+            [float(g[..., 1].min()), float(g[..., 0].min())],
+            [float(g[..., 1].max()), float(g[..., 0].max())]
+        ]
+        if roi is not None:
+            bounds = [
+                [max(bounds[0][0], roi[0][0]), max(bounds[0][1], roi[0][1])],
+                [min(bounds[1][0], roi[1][0]), min(bounds[1][1], roi[1][1])]
+            ]
+        return rays, bins, g, bounds
+
+
+class Grid2D(Task2D):
+    """Shared methods of tasks on regular longitude/latitude grids
+
+    The cells of a regular grid follow from the bounds and the shape of the
+    data, so no mesh of cell corners is built. Rows run from the north, and
+    images have one pixel column per cell, see Task2D.get_warp.
+    """
+
+    @staticmethod
+    def get_crop(bounds, nrows, ncols, roi):
+        """Compute the rows and columns to read for a region of interest.
+
+        Rows run from north to south. The crop is aligned to the cells, so
+        the cropped bounds may be slightly larger than the bounding box.
+        :param bounds: ((lat_min, lon_min), (lat_max, lon_max)) of the data
+        :param nrows:
+        :param ncols:
+        :param roi: ((lat_min, lon_min), (lat_max, lon_max)) or None
+        :return: slice of rows, slice of columns, bounds of the crop
         """
-        temp_img = temp_path + "/" + self.dt + ".png"
-        fig, ax = plt.subplots()
-        x_range = [self.bounds[0][1], self.bounds[1][1]]
-        y_range = [self.bounds[0][0], self.bounds[1][0]]
-        plt.xlim(x_range)
-        plt.ylim(y_range)
-        plt.pcolormesh(self.grid[..., 0], self.grid[..., 1], self.data,
-                       cmap="jet", vmin=self.v_min, vmax=self.v_max,
-                       snap=True)
-        ax.axis("off")
-        plt.savefig(temp_img, transparent=True, bbox_inches="tight",
-                    pad_inches=0, dpi=300)
-        plt.close()
-
-
-class ScanIntg2D:
+        (lat_min, lon_min), (lat_max, lon_max) = [[float(v) for v in b]
+                                                  for b in bounds]
+        if roi is None:
+            return slice(0, nrows), slice(0, ncols), \
+                [[lat_min, lon_min], [lat_max, lon_max]]
+
+        d_lat = (lat_max - lat_min) / nrows
+        d_lon = (lon_max - lon_min) / ncols
+        r0 = max(int(np.floor((lat_max - roi[1][0]) / d_lat)), 0)
+        r1 = min(int(np.ceil((lat_max - roi[0][0]) / d_lat)), nrows)
+        c0 = max(int(np.floor((roi[0][1] - lon_min) / d_lon)), 0)
+        c1 = min(int(np.ceil((roi[1][1] - lon_min) / d_lon)), ncols)
+        if r0 >= r1 or c0 >= c1:
+            raise ValueError("Region of interest is outside of the data")
+        bounds = [
+            [lat_max - r1 * d_lat, lon_min + c0 * d_lon],
+            [lat_max - r0 * d_lat, lon_min + c1 * d_lon]
+        ]
+        return slice(r0, r1), slice(c0, c1), bounds
+
+
+class ScanIntg2D(Grid2D):
     """Integration of information across elevation scans of radar
 
     Data are integrated and projected in a two-dimensional spatial image
     of fine-scale radar reflectivity. Data are stored in HDF5 format.
     """
-
-    def __init__(self, file_path):
-        self.file_path = file_path
-        self.data = None
-        self.grid = None
-        self.bounds = None
-        self.v_min = 1
-        self.v_max = 10000
-        self.dt = None
+    hist_bins = Task2D.log_bins
+    norm = "log"
+    v_range = (1, 10000)
 
     def get_options(self):
         o_list = []
@@ -403,100 +916,675 @@ class ScanIntg2D:
             "description": "Quantity"
         })
 
-        return o_list
+        return o_list + Task2D.get_options(self)
 
-    def get_profile(self, config):
+    def get_profile(self, config, f=None):
         """Return the profile string
                 :return:
                 """
         c = copy.deepcopy(config)
         qty = c["options"]["qty"]
         # app = c["options"]["appearance"]
-        with h5py.File(self.file_path, "r") as f:
+        with open_file(self.file_path, f) as f:
             qty = f["dataset1"][qty]["what"].attrs["quantity"]
             if isinstance(qty, np.ndarray): qty = qty[0]
             qty = qty.decode("utf-8")
+        roi = parse_roi(config["options"].get("roi"))
         c["options"] = {
             "Quantity": qty,
             # "Appearance": app,
             "Colormap": ("jet", (self.v_min, self.v_max), "log"),
             "Bounds": self.bounds
         }
+        if roi is not None:
+            c["options"]["ROI"] = roi
         return c
 
-    def process(self, config):
+    def estimate_memory(self, config, f=None):
+        """Memory of the integrated scan, see Task2D.estimate_memory
+        """
+        qty = config["options"]["qty"]
+        with open_file(self.file_path, f) as f:
+            dset = f["dataset1"][qty]["data"]
+            nrows, ncols = dset.shape
+            n = dset.size
+            itemsize = dset.dtype.itemsize
+
+        # raw data, mask and working copies of the data
+        if config.get("precision", "float64") == "float32":
+            data = n * (itemsize + 1 + 4)
+        else:
+            data = n * (2 * itemsize + 1)
+        # normalized data and color indices, the image has about twice
+        # as many pixels as cells, see Task2D.get_warp
+        render = n * (8 + 8) + self.estimate_render(2 * n)
+        return data + render
+
+    def read_time(self, f, config=None):
+        """Read the time stamp of a file, time of the first dataset
+        :param f: opened h5py file
+        :param config:
+        :return:
+        """
+        return self.to_dt(self.read_attr([f["dataset1"]["how"]], "time"))
+
+    def process(self, config, f=None):
         qty = config["options"]["qty"]
+        roi = parse_roi(config["options"].get("roi"))
+        with open_file(self.file_path, f) as f:
+            with self.stats.measure("read"):
+                lon_min = f["dataset1"]["how"].attrs["lon_min"]
+                if isinstance(lon_min, np.ndarray): lon_min = lon_min[0]
+                lon_min = float(lon_min)
+
+                lon_max = f["dataset1"]["how"].attrs["lon_max"]
+                if isinstance(lon_max, np.ndarray): lon_max = lon_max[0]
+                lon_max = float(lon_max)
+
+                lat_min = f["dataset1"]["how"].attrs["lat_min"]
+                if isinstance(lat_min, np.ndarray): lat_min = lat_min[0]
+                lat_min = float(lat_min)
+
+                lat_max = f["dataset1"]["how"].attrs["lat_max"]
+                if isinstance(lat_max, np.ndarray): lat_max = lat_max[0]
+                lat_max = float(lat_max)
+
+                nrows = f["dataset1"]["how"].attrs["nrows"]
+                if isinstance(nrows, np.ndarray): nrows = nrows[0]
+                nrows = int(nrows)
+
+                ncols = f["dataset1"]["how"].attrs["ncols"]
+                if isinstance(ncols, np.ndarray): ncols = ncols[0]
+                ncols = int(ncols)
+
+                self.dt = self.read_time(f)
+
+            # Crop rows and columns to the region of interest
+            rows, cols, bounds = self.get_crop(
+                ((lat_min, lon_min), (lat_max, lon_max)), nrows, ncols, roi)
+
+            # Read only the hyperslab of the region of interest
+            with self.stats.measure("read"):
+                dset = f["dataset1"][qty]["data"]
+                self.data = dset[rows, cols]
+                self.stats.add_io("read", read=dset.id.get_storage_size() *
+                                  self.data.size / max(dset.size, 1))
+
+        with self.stats.measure("compute"):
+            # Mask 0 values
+            if config.get("precision", "float64") == "float32":
+                data = self.data.astype(np.float32, copy=False)
+                self.data = np.ma.MaskedArray(data, mask=data == 0,
+                                              copy=False)
+            else:
+                self.data = np.ma.masked_values(self.data, 0)
+
+            # the grid is regular, given by the bounds
+            self.bounds = bounds
+
+
+class CompImage2D(Grid2D):
+    """Cartesian radar products, composites (COMP) and images (IMAGE)
+
+    Data are stored in HDF5 format based on the OPERA weather radar
+    information model (ODIM). Products on a longitude and latitude grid are
+    regular grids given by their corners. Products in another projection
+    ("projdef" of the "where" group) get the longitude and latitude of
+    every cell corner, computed once per projection and extent.
+    """
+    v_range = (0, 350)
+
+    def get_options(self):
+        o_list = []
+
         with h5py.File(self.file_path, "r") as f:
-            self.data = f["dataset1"][qty]["data"][...]
+            # Datasets, usually one per product or time
+            dset_list = []
+            keys = [s for s in f.keys() if "dataset" in s]
+            keys.sort(key=lambda k: int(k[7:]))
+            for k in keys:
+                product = self.read_attr([f[k]["what"]], "product", "")
+                dset_list.append((k + " " + product, k))
+
+            # Quantity of the first dataset
+            qty_list = []
+            dset = f[keys[0]]
+            for k in [s for s in dset.keys() if "data" in s]:
+                qty = self.read_attr([dset[k]["what"]], "quantity", k)
+                qty_list.append((qty, k))
 
-            # prepare attributes
-            lon_min = f["dataset1"]["how"].attrs["lon_min"]
-            if isinstance(lon_min, np.ndarray): lon_min = lon_min[0]
-            lon_min = float(lon_min)
+        o_list.append({
+            "key": "dset",
+            "type": "dropdown",
+            "options": dset_list,
+            "description": "Dataset"
+        })
+        o_list.append({
+            "key": "qty",
+            "type": "dropdown",
+            "options": qty_list,
+            "description": "Quantity"
+        })
 
-            lon_max = f["dataset1"]["how"].attrs["lon_max"]
-            if isinstance(lon_min, np.ndarray): lon_max = lon_max[0]
-            lon_max = float(lon_max)
+        return o_list + Task2D.get_options(self)
 
-            lat_min = f["dataset1"]["how"].attrs["lat_min"]
-            if isinstance(lat_min, np.ndarray): lat_min = lat_min[0]
-            lat_min = float(lat_min)
+    def get_profile(self, config, f=None):
+        """Return the profile string
+        :return:
+        """
+        c = copy.deepcopy(config)
+        dset = c["options"]["dset"]
+        qty = c["options"]["qty"]
+        with open_file(self.file_path, f) as f:
+            product = self.read_attr([f[dset]["what"], f["what"]], "product",
+                                     "")
+            qty = self.read_attr([f[dset][qty]["what"]], "quantity", qty)
+        roi = parse_roi(config["options"].get("roi"))
+        c["options"] = {
+            "Product": product,
+            "Quantity": qty,
+            "Colormap": ("jet", (self.v_min, self.v_max), "linear"),
+            "Bounds": self.bounds
+        }
+        if roi is not None:
+            c["options"]["ROI"] = roi
+        return c
 
-            lat_max = f["dataset1"]["how"].attrs["lat_max"]
-            if isinstance(lat_max, np.ndarray): lat_max = lat_max[0]
-            lat_max = float(lat_max)
+    def estimate_memory(self, config, f=None):
+        """Memory of one product, with the cell corners of a projected grid,
+        see Task2D.estimate_memory
+        """
+        dset = config["options"]["dset"]
+        qty = config["options"]["qty"]
+        with open_file(self.file_path, f) as f:
+            d = f[dset][qty]["data"]
+            n = d.size
+            itemsize = d.dtype.itemsize
+            projdef = self.read_attr([f["where"]], "projdef")
+
+        # raw data, masks and scaled copies of the data
+        if config.get("precision", "float64") == "float32":
+            data = n * (itemsize + 2 + 4)
+        else:
+            data = n * (2 * itemsize + 2 + 2 * 8)
+        # corners of the cells of a projected product, with the coordinates
+        # in the projection
+        grid = 0 if self.is_latlong(projdef) else n * 2 * 8 * 3
+        # normalized data and color indices, the image has about twice
+        # as many pixels as the cells of a regular grid, see Task2D.get_warp
+        pixels = 2 * n if self.is_latlong(projdef) else WARP_SIZE ** 2
+        render = n * (8 + 8) + self.estimate_render(pixels)
+        return data + grid + render
+
+    def read_time(self, f, config=None):
+        """Read the time stamp of a file, start of the product if given
+        :param f: opened h5py file
+        :param config:
+        :return:
+        """
+        groups = [f]
+        if config is not None:
+            groups = [f[config["options"]["dset"]], f]
+        what = [g["what"] for g in groups if "what" in g]
+        date = self.read_attr(what, "startdate") or \
+            self.read_attr([f["what"]], "date")
+        tp = self.read_attr(what, "starttime") or \
+            self.read_attr([f["what"]], "time")
+        return self.to_dt(date + " " + tp)
+
+    def process(self, config, f=None):
+        """
+        Read the corners and the scaled data of the product. Config of
+        CompImage2D should include dset and qty.
+        :param config:
+        :param f: opened h5py file of file_path, opened here if None
+        :return:
+        """
+        dset = config["options"]["dset"]
+        qty = config["options"]["qty"]
+        roi = parse_roi(config["options"].get("roi"))
+        with open_file(self.file_path, f) as f:
+            with self.stats.measure("read"):
+                where = f["where"]
+                lon = [float(self.read_attr([where], k + "_lon"))
+                       for k in ["LL", "UL", "UR", "LR"]]
+                lat = [float(self.read_attr([where], k + "_lat"))
+                       for k in ["LL", "UL", "UR", "LR"]]
+                ncols = int(self.read_attr([where], "xsize"))
+                nrows = int(self.read_attr([where], "ysize"))
+                projdef = self.read_attr([where], "projdef")
+
+                # data attributes may be given at any level of the file
+                what = [g["what"] for g in [f[dset][qty], f[dset], f]
+                        if "what" in g]
+                gain = float(self.read_attr(what, "gain", 1))
+                offset = float(self.read_attr(what, "offset", 0))
+                nodata = self.read_attr(what, "nodata")
+                undetect = self.read_attr(what, "undetect")
+                self.dt = self.read_time(f, config)
+
+            # Crop rows and columns to the region of interest
+            if self.is_latlong(projdef):
+                bounds = ((min(lat), min(lon)), (max(lat), max(lon)))
+                rows, cols, bounds = self.get_crop(bounds, nrows, ncols,
+                                                   roi)
+                grid = None
+            else:
+                with self.stats.measure("compute"):
+                    rows, cols, grid, bounds = self.get_proj_crop(
+                        projdef, (lon[1], lat[1]), (lon[3], lat[3]), nrows,
+                        ncols, roi)
+
+            # Read only the hyperslab of the region of interest
+            with self.stats.measure("read"):
+                d = f[dset][qty]["data"]
+                self.data = d[rows, cols]
+                self.stats.add_io("read", read=d.id.get_storage_size() *
+                                  self.data.size / max(d.size, 1))
+
+        with self.stats.measure("compute"):
+            # Mask nodata and undetect value and compute unit values
+            mask = np.isin(self.data, [float(v) for v in [nodata, undetect]
+                                       if v is not None])
+            if config.get("precision", "float64") == "float32":
+                data = self.data.astype(np.float32)
+                data *= gain
+                data += offset
+            else:
+                data = self.data * gain + offset
+            self.data = np.ma.MaskedArray(data, mask=mask, copy=False)
+
+            # the grid is regular, given by the bounds, unless projected
+            self.grid = grid
+            self.bounds = bounds
+            self.v_min, self.v_max = self.guess_range(self.data)
 
-            nrows = f["dataset1"]["how"].attrs["nrows"]
-            if isinstance(nrows, np.ndarray): nrows = nrows[0]
-            nrows = int(nrows)
+    @staticmethod
+    def is_latlong(projdef):
+        """Whether a product is on a longitude and latitude grid
+        :param projdef: PROJ definition of the product, None if not given
+        :return:
+        """
+        if not projdef:
+            return True
+        projdef = projdef.replace(" ", "").lower()
+        return any("+proj=" + p in projdef
+                   for p in ["longlat", "latlong", "lonlat", "latlon"])
 
-            ncols = f["dataset1"]["how"].attrs["ncols"]
-            if isinstance(ncols, np.ndarray): ncols = ncols[0]
-            ncols = int(ncols)
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def get_grid(projdef, ul, lr, nrows, ncols):
+        """Compute the corners of the cells of a projected product.
+
+        The cells are regular in the projection between the upper left and
+        the lower right corner. Results are cached per worker process like
+        PolarVol2D.get_grid, the returned grid is shared and must not be
+        modified.
+        :param projdef: PROJ definition of the product
+        :param ul: (lon, lat) of the upper left corner
+        :param lr: (lon, lat) of the lower right corner
+        :param nrows:
+        :param ncols:
+        :return: grid of (nrows + 1, ncols + 1, 2) corner coordinates
+        """
+        if pyproj is None:
+            raise ImportError("pyproj is not installed, it is needed for "
+                              "products in " + projdef)
+        proj = pyproj.Proj(projdef)
+        (x0, y0), (x1, y1) = proj(*ul), proj(*lr)
+        x, y = np.meshgrid(np.linspace(x0, x1, ncols + 1),
+                           np.linspace(y0, y1, nrows + 1))
+        lons, lats = proj(x, y, inverse=True)
+        grid = np.stack([lons, lats], axis=-1)
+        grid.flags.writeable = False
+        return grid
+
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def get_proj_crop(projdef, ul, lr, nrows, ncols, roi):
+        """Compute the rows and columns of a projected product to read for
+        a region of interest.
+
+        Rows and columns are limited to the cells having a corner inside
+        the bounding box, like PolarVol2D.get_crop. Results are cached per
+        worker process like the grid.
+        :param projdef: PROJ definition of the product
+        :param ul: (lon, lat) of the upper left corner
+        :param lr: (lon, lat) of the lower right corner
+        :param nrows:
+        :param ncols:
+        :param roi: ((lat_min, lon_min), (lat_max, lon_max)) or None
+        :return: slice of rows, slice of columns, cropped grid, bounds
+        """
+        grid = CompImage2D.get_grid(projdef, ul, lr, nrows, ncols)
+        rows, cols = slice(0, nrows), slice(0, ncols)
+        if roi is not None:
+            (lat_min, lon_min), (lat_max, lon_max) = roi
+            inside = (grid[..., 1] >= lat_min) & (grid[..., 1] <= lat_max) & \
+                     (grid[..., 0] >= lon_min) & (grid[..., 0] <= lon_max)
+            cells = inside[:-1, :-1] | inside[1:, :-1] | \
+                inside[:-1, 1:] | inside[1:, 1:]
+            if not cells.any():
+                raise ValueError("Region of interest is outside of the data")
+            r = np.nonzero(cells.any(axis=1))[0]
+            c = np.nonzero(cells.any(axis=0))[0]
+            rows = slice(int(r[0]), int(r[-1]) + 1)
+            cols = slice(int(c[0]), int(c[-1]) + 1)
+            grid = grid[rows.start:rows.stop + 1, cols.start:cols.stop + 1]
+
+        # bounds of the cropped grid, clipped to the bounding box
+        bounds = [
+            [float(grid[..., 1].min()), float(grid[..., 0].min())],
+            [float(grid[..., 1].max()), float(grid[..., 0].max())]
+        ]
+        if roi is not None:
+            bounds = [
+                [max(bounds[0][0], roi[0][0]), max(bounds[0][1], roi[0][1])],
+                [min(bounds[1][0], roi[1][0]), min(bounds[1][1], roi[1][1])]
+            ]
+        return rows, cols, grid, bounds
+
+
+class VolProd2D(Grid2D):
+    """Products of all the elevation scans of radar polar volumes
+
+    The column maximum or a constant altitude PPI (CAPPI) of a quantity is
+    computed on a regular longitude/latitude grid around the radar. Every
+    cell looks up its gate in each scan, the ray and bin of the gates are
+    computed once per scan geometry with the 4/3 earth radius model of beam
+    propagation. Data are stored in HDF5 format based on the OPERA weather
+    radar information model.
+    """
+    earth_radius = 6371.0  # km
+    cappi_tolerance = 1.0  # km from the altitude without scan on both sides
+
+    def get_options(self):
+        o_list = []
+
+        # Quantity, by name since the data index may differ between scans
+        qty_list = []
+        with h5py.File(self.file_path, "r") as f:
+            for k in [s for s in f.keys() if "dataset" in s]:
+                for d in [s for s in f[k].keys() if "data" in s]:
+                    qty = self.read_attr([f[k][d]["what"]], "quantity")
+                    if qty is not None and (qty, qty) not in qty_list:
+                        qty_list.append((qty, qty))
+        o_list.append({
+            "key": "qty",
+            "type": "dropdown",
+            "options": qty_list,
+            "description": "Quantity"
+        })
+
+        # Product
+        o_list.append({
+            "key": "product",
+            "type": "dropdown",
+            "options": [("Column maximum", "max"), ("CAPPI", "cappi")],
+            "description": "Product"
+        })
+        o_list.append({
+            "key": "altitude",
+            "type": "float",
+            "value": 2.0,
+            "description": "Altitude (km)"
+        })
+        o_list.append({
+            "key": "interp",
+            "type": "dropdown",
+            "options": [("Linear", "linear"), ("Nearest", "nearest")],
+            "description": "Interpolation"
+        })
+        o_list.append({
+            "key": "resolution",
+            "type": "float",
+            "value": 1.0,
+            "description": "Resolution (km)"
+        })
 
-            tp = f["dataset1"]["how"].attrs["time"]
-            if isinstance(tp, np.ndarray): tp = tp[0]
-            tp = tp.decode("utf-8")
+        o_list += Task2D.get_options(self)
+        o_list.append({
+            "key": "max_range",
+            "type": "float",
+            "description": "Range (km)"
+        })
 
-        # datatime stamp
-        self.dt = parser.parse(tp)
-        self.dt = self.dt.replace(second=0, microsecond=0)  # ignore second
-        self.dt = self.dt.strftime("%Y%m%d %H%M")  # transfer back to str
+        return o_list
 
-        # Mask 0 values
-        self.data = np.ma.masked_values(self.data, 0)
+    def get_profile(self, config, f=None):
+        """Return the profile string
+        :return:
+        """
+        c = copy.deepcopy(config)
+        o = c["options"]
+        product = "Column maximum"
+        if o.get("product") == "cappi":
+            product = "CAPPI " + str(float(o.get("altitude") or 2.0)) + \
+                      " km (" + (o.get("interp") or "linear") + ")"
+        roi = parse_roi(o.get("roi"))
+        max_range = o.get("max_range") or None
+        c["options"] = {
+            "Product": product,
+            "Quantity": o["qty"],
+            "Resolution (km)": float(o.get("resolution") or 1.0),
+            "Colormap": ("jet", (self.v_min, self.v_max), "linear"),
+            "Bounds": self.bounds
+        }
+        if roi is not None:
+            c["options"]["ROI"] = roi
+        if max_range is not None:
+            c["options"]["Range (km)"] = max_range
+        return c
 
-        # compute the grid
-        self.bounds = [[lat_min, lon_min], [lat_max, lon_max]]
-        lon_range = np.linspace(self.bounds[0][1], self.bounds[1][1], ncols + 1)
-        lat_range = np.linspace(self.bounds[0][0], self.bounds[1][0], nrows + 1)
-        lon_matrix = np.tile(lon_range, (ncols + 1, 1))
-        lat_matrix = np.tile(lat_range, (nrows + 1, 1)).T
-        lat_matrix = np.flip(lat_matrix, 0)
-        self.grid = np.dstack((lon_matrix, lat_matrix))
+    def estimate_memory(self, config, f=None):
+        """Memory of all the scans and the grid of the full range, see
+        Task2D.estimate_memory
+        """
+        res = float(config["options"].get("resolution") or 1.0)
+        with open_file(self.file_path, f) as f:
+            scans = self.get_scans(f, config["options"]["qty"])
+            raw = max([d.size * (d.dtype.itemsize + 8)
+                       for m, d in scans] + [0])
+            r = max([m["nbins"] * m["rscale"] for m, d in scans] + [0])
+        max_range = config["options"].get("max_range") or None
+        if max_range is not None:
+            r = min(r, float(max_range))
+        cells = (2 * np.ceil(r / res)) ** 2
+
+        # one scan at a time, values and heights of all the scans,
+        # geometry of each scan and rendering of the image
+        return int(raw + cells * (len(scans) * (4 * 2 + 8 * 3 + 1) + 16) +
+                   self.estimate_render(2 * cells))
 
-    def create_temp(self, temp_path):
+    @staticmethod
+    def get_scans(f, qty):
+        """List the scans of a polar volume that contain a quantity
+        :param f: opened h5py file
+        :param qty: name of the quantity
+        :return: list of attributes and dataset of each scan, by elevation
         """
-        Create temp file that is the raster image.
+        scans = []
+        for k in [s for s in f.keys() if "dataset" in s]:
+            for d in [s for s in f[k].keys() if "data" in s]:
+                what = [g["what"] for g in [f[k][d], f[k], f] if "what" in g]
+                if Grid2D.read_attr(what[:1], "quantity") != qty:
+                    continue
+                where = [f[k]["where"]]
+                m = {
+                    "elangle": float(Grid2D.read_attr(where, "elangle")),
+                    "nrays": int(Grid2D.read_attr(where, "nrays")),
+                    "nbins": int(Grid2D.read_attr(where, "nbins")),
+                    "rscale": float(Grid2D.read_attr(where, "rscale")) / 1000,
+                    "gain": float(Grid2D.read_attr(what, "gain", 1)),
+                    "offset": float(Grid2D.read_attr(what, "offset", 0)),
+                    "nodata": Grid2D.read_attr(what, "nodata"),
+                    "undetect": Grid2D.read_attr(what, "undetect"),
+                }
+                scans.append((m, f[k][d]["data"]))
+                break
+        scans.sort(key=lambda s: s[0]["elangle"])
+        return scans
+
+    def process(self, config, f=None):
+        """
+        Read every scan of the quantity and compute the product on a regular
+        grid. Config of VolProd2D should include qty and product, and
+        optionally altitude, interp, resolution, roi and max_range.
+        :param config:
+        :param f: opened h5py file of file_path, opened here if None
         :return:
         """
-        temp_img = temp_path + "/" + self.dt + ".png"
-        fig, ax = plt.subplots()
-        x_range = [self.bounds[0][1], self.bounds[1][1]]
-        y_range = [self.bounds[0][0], self.bounds[1][0]]
-        plt.xlim(x_range)
-        plt.ylim(y_range)
-        norm = colors.LogNorm(vmin=self.v_min, vmax=self.v_max)
-        plt.pcolormesh(self.grid[..., 0], self.grid[..., 1], self.data,
-                       cmap="jet", norm=norm,
-                       snap=True)
-        ax.axis("off")
-        plt.savefig(temp_img, transparent=True, bbox_inches="tight",
-                    pad_inches=0, dpi=300)
-        plt.close()
+        o = config["options"]
+        product = o.get("product") or "max"
+        altitude = float(o.get("altitude") or 2.0)
+        interp = o.get("interp") or "linear"
+        res = float(o.get("resolution") or 1.0)
+        roi = parse_roi(o.get("roi"))
+        max_range = o.get("max_range") or None
+        with open_file(self.file_path, f) as f:
+            with self.stats.measure("read"):
+                lon = float(self.read_attr([f["where"]], "lon"))
+                lat = float(self.read_attr([f["where"]], "lat"))
+                height = float(self.read_attr([f["where"]], "height", 0))
+                self.dt = self.read_time(f)
+                scans = self.get_scans(f, o["qty"])
+            if not scans:
+                raise ValueError("No scan with quantity " + str(o["qty"]))
+            site = (lon, lat, height / 1000)
+
+            # Regular grid around the radar, cropped to the region of interest
+            with self.stats.measure("compute"):
+                r = max([m["nbins"] * m["rscale"] for m, d in scans])
+                if max_range is not None:
+                    r = min(r, float(max_range))
+                n = int(np.ceil(r / res))
+                d_lat = res / (self.earth_radius * np.pi / 180)
+                d_lon = d_lat / np.cos(np.radians(lat))
+                bounds = ((lat - n * d_lat, lon - n * d_lon),
+                          (lat + n * d_lat, lon + n * d_lon))
+                rows, cols, self.bounds = self.get_crop(bounds, 2 * n, 2 * n,
+                                                        roi)
+                grid = (bounds[1][0] - rows.start * d_lat,
+                        bounds[0][1] + cols.start * d_lon, d_lat, d_lon,
+                        rows.stop - rows.start, cols.stop - cols.start)
+
+            # Values and beam heights of every scan at every cell
+            shape = grid[4:]
+            values = np.full((len(scans),) + shape, np.nan, np.float32)
+            heights = np.full((len(scans),) + shape, np.nan, np.float32)
+            for k in range(len(scans)):
+                m, dset = scans[k]
+                with self.stats.measure("read"):
+                    raw = dset[()]
+                    self.stats.add_io("read", read=dset.id.get_storage_size())
+                with self.stats.measure("compute"):
+                    ray, bin, valid, h = self.get_geometry(
+                        m["nrays"], m["nbins"], m["rscale"], m["elangle"],
+                        site, grid)
+                    v = raw[ray, bin]
+                    for x in [m["nodata"], m["undetect"]]:
+                        if x is not None:
+                            valid = valid & (v != float(x))
+                    values[k][valid] = v[valid] * m["gain"] + m["offset"]
+                    heights[k] = h
+
+        with self.stats.measure("compute"):
+            if product == "cappi":
+                data = self.get_cappi(values, heights, altitude, interp)
+            else:
+                data = np.fmax.reduce(values, axis=0)
+            self.data = np.ma.masked_invalid(data, copy=False)
+            self.v_min, self.v_max = self.guess_range(self.data)
+
+    def get_cappi(self, values, heights, altitude, interp):
+        """Interpolate the values of the scans at a constant altitude
+        :param values: values of the scans by elevation, NaN if missing
+        :param heights: beam heights of the scans in km, NaN if out of range
+        :param altitude: in km
+        :param interp: "linear" between the scans below and above, or
+        "nearest" scan in height
+        :return: values at the altitude, NaN if missing
+        """
+        idx = np.indices(values.shape[1:])
+        below = np.where(heights <= altitude, heights, -np.inf)
+        above = np.where(heights > altitude, heights, np.inf)
+        i_b = np.argmax(below, axis=0)
+        i_a = np.argmin(above, axis=0)
+        h_b = below[i_b, idx[0], idx[1]]
+        h_a = above[i_a, idx[0], idx[1]]
+        v_b = values[i_b, idx[0], idx[1]]
+        v_a = values[i_a, idx[0], idx[1]]
+
+        # nearest scan, only close to the altitude if not on both sides
+        near_b = altitude - h_b <= h_a - altitude
+        result = np.where(near_b, v_b, v_a)
+        both = np.isfinite(h_b) & np.isfinite(h_a)
+        gap = np.where(near_b, altitude - h_b, h_a - altitude)
+        result[~both & (gap > self.cappi_tolerance)] = np.nan
+
+        if interp == "linear":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                w = (altitude - h_b) / (h_a - h_b)
+                linear = v_b + w * (v_a - v_b)
+            result = np.where(both, linear, result)
+        return result
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def get_geometry(nrays, nbins, rscale, elangle, site, grid):
+        """Compute the gate of a scan at the center of every grid cell.
+
+        Distance and bearing from the radar follow the great circle, height
+        and slant range follow the 4/3 earth radius model. Arrays are cached
+        for scans of the same geometry and set read-only.
+        :param nrays:
+        :param nbins:
+        :param rscale: in km
+        :param elangle: in degrees
+        :param site: (lon, lat, height in km) of the radar
+        :param grid: (lat of the north edge, lon of the west edge, d_lat,
+        d_lon, nrows, ncols)
+        :return: ray and bin index, valid mask and beam height in km
+        """
+        lon0, lat0, h0 = site
+        lat_max, lon_min, d_lat, d_lon, nrows, ncols = grid
+        lat = np.radians(lat_max - (np.arange(nrows) + 0.5) * d_lat)[:, None]
+        lon = np.radians(lon_min + (np.arange(ncols) + 0.5) * d_lon)[None, :]
+        phi0 = np.radians(lat0)
+        d_lambda = lon - np.radians(lon0)
+
+        # central angle and azimuth from the radar
+        a = np.sin((lat - phi0) / 2) ** 2 + \
+            np.cos(phi0) * np.cos(lat) * np.sin(d_lambda / 2) ** 2
+        angle = 2 * np.arcsin(np.sqrt(a))
+        az = np.degrees(np.arctan2(
+            np.sin(d_lambda) * np.cos(lat),
+            np.cos(phi0) * np.sin(lat) -
+            np.sin(phi0) * np.cos(lat) * np.cos(d_lambda))) % 360
+
+        # slant range and height on the effective earth
+        re = 4.0 / 3.0 * VolProd2D.earth_radius
+        phi = angle * VolProd2D.earth_radius / re
+        theta = np.radians(elangle)
+        c = np.cos(theta + phi)
+        valid = c > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = np.where(valid, re * np.sin(phi) / c, np.inf)
+            h = re * (np.cos(theta) / c - 1) + h0
+
+        ray = (az / (360.0 / nrays)).astype(np.intp) % nrays
+        bin = np.where(valid, r / rscale, 0).astype(np.intp)
+        valid &= bin < nbins
+        bin[~valid] = 0
+        h = np.where(valid, h, np.nan).astype(np.float32)
+        for x in [ray, bin, valid, h]:
+            x.flags.writeable = False
+        return ray, bin, valid, h
 
 
 # Local Test
+
+
 if __name__ == '__main__':
     # Class test: Task
     fp = "/Users/ep/Workspace/meteo_vis/sample_data/" \
@@ -509,16 +1597,3 @@ if __name__ == '__main__':
     e = Task(fp, config)
     e.process(config)
     e.create_temp()
-
-    # Class test: Control
-    c = Control("/Users/ep/Workspace/meteo_vis/sample_data/ppi/NL/HRW")
-    config = {
-        'name': 'DEFAULT_NAME',
-        'desc': 'DEFAULT_DESC',
-        'task': 'Radar polar volume (2D)',
-        'options': {
-            'scan': 'dataset15',
-            'qty': 'data1',
-        }
-    }
-    c.submit(config)
@@ -3,11 +3,23 @@
 
 import os
 import shutil
+import io
+import struct
+import time
+import zlib
 
 import ipywidgets as widgets
 from IPython.display import display
+from PIL import Image
+from dateutil import parser
 
-from .task import Task, Control, TEMP_SET_PATH
+from .util import TEMP_SET_PATH
+from .task import Task
+from .control import Control
+from .stats import Stats
+from .storage import Storage
+from .series import Series
+from .cube import Cube
 
 
 def make(data_path):
@@ -27,6 +39,288 @@ def list():
     g.show()
 
 
+def batch(jobs, processes=None, memory_budget=None, pipeline=False,
+          backend=None):
+    """Make temporary sets for a list of jobs without GUI
+    :param jobs: list of dicts with "source", "task" and "options", and
+    optionally "name", "desc" and "precision"
+    :param processes: number of worker processes shared by all the jobs
+    :param memory_budget: memory budget of all the workers in MB
+    :param pipeline: overlap reading and writing files with the processing
+    :param backend: "process" (default), "thread", "dask" or the address of
+    a dask scheduler, see Executor
+    :return: list of paths of the created temporary sets
+    """
+    return Control.batch(jobs, processes=processes,
+                         memory_budget=memory_budget, pipeline=pipeline,
+                         backend=backend)
+
+
+def resume(id, memory_budget=None, pipeline=False, backend=None):
+    """Resume making an incomplete temporary set, see Control.resume for
+    resuming by the path of the temp set
+    :param id: id of the temp set as listed by list()
+    :param memory_budget: memory budget of all the workers in MB
+    :param pipeline: overlap reading and writing files with the processing
+    :param backend: backend running the workers, see batch
+    :return:
+    """
+    t = Temp(id)
+    c = Control(t.profile["source"], memory_budget=memory_budget,
+                pipeline=pipeline, backend=backend)
+    return c.resume(t.temp_path)
+
+
+def export(id, path, start=None, end=None, stride=1, interval=150, loop=0):
+    """Export frames of a temporary set as one animated image
+    :param id:
+    :param path: output file, ".webp" for animated WebP, otherwise APNG
+    :param start: first time of the frames, e.g. "2016-10-03 14:00"
+    :param end: last time of the frames
+    :param stride: export every n-th frame
+    :param interval: display time of a frame in milliseconds
+    :param loop: number of loops, 0 for infinite
+    :return: path of the animated image
+    """
+    return Temp(id).export(path, start=start, end=end, stride=stride,
+                           interval=interval, loop=loop)
+
+
+def derive(id, op, window=12, name=None, processes=None):
+    """Make a temporary set from the frames of another one by an operator
+    over a window sliding in time
+    :param id:
+    :param op: "sum" (accumulation), "mean", "max", "min" or "diff" (change
+    from the previous frame)
+    :param window: number of frames in the window, e.g. 12 for an hour of
+    5-minute frames
+    :param name: name of the new temporary set
+    :param processes: number of worker processes
+    :return: path of the new temporary set
+    """
+    return Control.derive(Temp(id).temp_path, op, window=window, name=name,
+                          processes=processes)
+
+
+def compare(id_a, id_b, op="diff", resolution=1.0, tolerance=150, name=None,
+            processes=None):
+    """Make a temporary set of the difference or ratio of two temporary sets
+    over their overlap
+    :param id_a:
+    :param id_b:
+    :param op: "diff" (a - b) or "ratio" (a / b)
+    :param resolution: cell size of the common grid in km
+    :param tolerance: largest time difference of matched frames in seconds
+    :param name: name of the new temporary set
+    :param processes: number of worker processes
+    :return: path of the new temporary set, or of an earlier comparison of
+    the same sets
+    """
+    return Control.compare(Temp(id_a).temp_path, Temp(id_b).temp_path, op=op,
+                           resolution=resolution, tolerance=tolerance,
+                           name=name, processes=processes)
+
+
+def series(id, lat, lon):
+    """Extract the values of a temporary set at a point over time
+    :param id:
+    :param lat:
+    :param lon:
+    :return: list of times, array of values with NaN outside the data
+    """
+    return Temp(id).get_series().point(lat, lon)
+
+
+def transect(id, start, end, n=100):
+    """Extract the values of a temporary set along a line over time
+    :param id:
+    :param start: (lat, lon) of the start of the line
+    :param end: (lat, lon) of the end of the line
+    :param n: number of points along the line
+    :return: list of times, distances in km from the start, array of values
+    of shape (times, points)
+    """
+    return Temp(id).get_series().transect(start, end, n=n)
+
+
+def export_data(id, path, group=24, processes=None):
+    """Export the frame data of a temporary set as a data cube
+    :param id:
+    :param path: Zarr store, or NetCDF file ending with ".nc", frames later
+    than the last time of an existing cube are appended
+    :param group: number of frames per chunk
+    :param processes: number of worker processes
+    :return: number of frames written
+    """
+    t = Temp(id)
+    Storage.touch(t.temp_path)
+    return Cube(t.temp_path).write(path, group=group, processes=processes)
+
+
+def quota(mb):
+    """Set the quota of all the temporary sets, the least recently accessed
+    sets are evicted once it is exceeded
+    :param mb: quota in MB, None for no quota
+    :return: paths of the evicted temporary sets
+    """
+    Storage.set_quota(mb)
+    return Storage.evict()
+
+
+def pin(id, pinned=True):
+    """Exempt a temporary set from eviction
+    :param id:
+    :param pinned:
+    :return:
+    """
+    Storage.pin(Temp(id).temp_path, pinned)
+
+
+def usage():
+    """Get the disk usage of the temporary sets
+    :return: list of dicts with the path, bytes of images, frames and
+    caches, last access and pin of each set, least recently accessed first
+    """
+    usages = Storage.get_usages()
+    q = Storage.get_quota()
+    print("[STEP] " + str(len(usages)) + " temp set(s) of " +
+          "%.1f MB" % (sum(u["bytes"] for u in usages) / 1024 ** 2) +
+          (", quota %.0f MB" % q if q is not None else ", no quota"))
+    return usages
+
+
+def write_animation(f, frames, fmt="apng", interval=150, loop=0):
+    """Encode image files as one animated image
+    :param f: binary file object to write to
+    :param frames: list of paths of the images, all of the same size
+    :param fmt: "apng" or "webp"
+    :param interval: display time of a frame in milliseconds
+    :param loop: number of loops, 0 for infinite
+    :return:
+    """
+    if not frames:
+        raise ValueError("No frames to animate")
+    if fmt == "webp":
+        write_webp(f, frames, interval, loop)
+    else:
+        write_apng(f, frames, interval, loop)
+
+
+def write_webp(f, frames, interval=150, loop=0):
+    """Write image files as an animated WebP frame by frame
+
+    Only one frame is held in memory. The bitstreams of WebP files are
+    copied as they are, other images are encoded as lossless WebP first.
+    The size of the RIFF container is written at the end, so f must be
+    seekable.
+    :param f: binary file object to write to
+    :param frames: list of paths of the images, all of the same size
+    :param interval: display time of a frame in milliseconds
+    :param loop: number of loops, 0 for infinite
+    :return:
+    """
+    def chunk(kind, data):
+        pad = b"\x00" if len(data) % 2 else b""
+        return kind + struct.pack("<I", len(data)) + data + pad
+
+    def read_chunks(content):
+        i = 12  # RIFF header
+        while i < len(content):
+            n = struct.unpack("<I", content[i + 4:i + 8])[0]
+            yield content[i:i + 4], content[i + 8:i + 8 + n]
+            i += 8 + n + n % 2
+
+    def uint24(v):
+        return struct.pack("<I", v)[:3]
+
+    start = f.tell()
+    f.write(b"RIFF\x00\x00\x00\x00WEBP")
+    size = None
+    for k in range(len(frames)):
+        with open(frames[k], "rb") as fi:
+            content = fi.read()
+        im = Image.open(io.BytesIO(content))
+        if im.format != "WEBP":
+            b = io.BytesIO()
+            im.convert("RGBA").save(b, "WEBP", lossless=True, quality=100)
+            content = b.getvalue()
+        if size is None:
+            size = im.size
+            # alpha and animation flags, canvas, transparent background
+            f.write(chunk(b"VP8X", b"\x12\x00\x00\x00" +
+                          uint24(size[0] - 1) + uint24(size[1] - 1)))
+            f.write(chunk(b"ANIM", b"\x00" * 4 + struct.pack("<H", loop)))
+        elif im.size != size:
+            raise ValueError("Frame size differs: " + frames[k])
+        data = b"".join([chunk(kind, d) for kind, d in read_chunks(content)
+                         if kind in [b"ALPH", b"VP8 ", b"VP8L"]])
+        # at the origin, replacing the previous frame instead of blending
+        f.write(chunk(b"ANMF", uint24(0) + uint24(0) + uint24(size[0] - 1) +
+                      uint24(size[1] - 1) + uint24(int(interval)) +
+                      b"\x02" + data))
+    end = f.tell()
+    f.seek(start + 4)
+    f.write(struct.pack("<I", end - start - 8))
+    f.seek(end)
+
+
+def write_apng(f, frames, interval=150, loop=0):
+    """Write image files as an animated png frame by frame
+
+    Only one frame is held in memory. The compressed data of RGBA png files
+    are copied as they are, other images are converted to RGBA first.
+    :param f: binary file object to write to
+    :param frames: list of paths of the images, all of the same size
+    :param interval: display time of a frame in milliseconds
+    :param loop: number of loops, 0 for infinite
+    :return:
+    """
+    def chunk(kind, data):
+        f.write(struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    def read_chunks(content):
+        i = 8  # png signature
+        while i < len(content):
+            n = struct.unpack(">I", content[i:i + 4])[0]
+            yield content[i + 4:i + 8], content[i + 8:i + 8 + n]
+            i += n + 12
+
+    f.write(b"\x89PNG\r\n\x1a\n")
+    header = None
+    seq = 0
+    for k in range(len(frames)):
+        with open(frames[k], "rb") as fi:
+            content = fi.read()
+        chunks = [c for c in read_chunks(content)]
+        if not (content.startswith(b"\x89PNG") and
+                chunks[0][1][8:13] == b"\x08\x06\x00\x00\x00"):
+            # not a plain 8-bit RGBA png
+            b = io.BytesIO()
+            Image.open(io.BytesIO(content)).convert("RGBA").save(b, "PNG")
+            chunks = [c for c in read_chunks(b.getvalue())]
+        ihdr = chunks[0][1]
+        if header is None:
+            header = ihdr
+            chunk(b"IHDR", ihdr)
+            chunk(b"acTL", struct.pack(">II", len(frames), loop))
+        elif ihdr[:8] != header[:8]:
+            raise ValueError("Frame size differs: " + frames[k])
+        w, h = struct.unpack(">II", ihdr[:8])
+        chunk(b"fcTL", struct.pack(">IIIIIHHBB", seq, w, h, 0, 0,
+                                   int(interval), 1000, 0, 0))
+        seq += 1
+        for kind, data in chunks:
+            if kind != b"IDAT":
+                continue
+            if k == 0:
+                chunk(b"IDAT", data)
+            else:
+                chunk(b"fdAT", struct.pack(">I", seq) + data)
+                seq += 1
+    chunk(b"IEND", b"")
+
+
 class Temp(object):
     """Class definition of a temporary set.
 
@@ -36,6 +330,7 @@ class Temp(object):
     def __init__(self, id):
         self.id = id
         self.is_chosen = False
+        self.series = None  # time series of the frames, made when needed
 
         # get temp path
         t_list = self.get_temp_list()
@@ -53,6 +348,19 @@ class Temp(object):
         p_str = "<b>ID</b>: " + str(self.id) + "<br>"
         p_str += "<b>Name</b>: " + self.profile["task"]["name"] + "<br>"
         p_str += "<b>Task</b>: " + self.profile["task"]["task"] + "<br>"
+        if self.profile.get("status", "complete") != "complete":
+            p_str += "<b style='color: #D84141'>Status</b>: " + \
+                     self.profile["status"] + "<br>"
+        if "size" in self.profile:
+            size = self.profile["size"]
+            p_str += "<b>Size</b>: " + str(size["images"]) + " images, " + \
+                     "%.1f MB" % (size["image_bytes"] / 1024 ** 2) + "<br>"
+        u = Storage.get_usage(self.temp_path)
+        p_str += "<b>Disk</b>: " + "%.1f MB" % (u["bytes"] / 1024 ** 2) + \
+                 (" (images evicted)" if u["evicted"] else "") + \
+                 ", accessed " + time.strftime("%Y-%m-%d %H:%M",
+                                               time.localtime(u["time"])) + \
+                 "<br>"
         desc = self.profile["task"]["desc"]
         if len(desc) > 50:
             desc = desc[:50] + "..."
@@ -67,7 +375,7 @@ class Temp(object):
             value=p_str,
         )
 
-        # example image
+        # example image, missing if no file has been completed yet
         img_path = self.temp_path + "/temp"
         for r, d, fs in os.walk(img_path):
             for f in fs:
@@ -75,7 +383,9 @@ class Temp(object):
                 break
             break
         img = widgets.Image(
-            value=open(img_path, "rb").read(),
+            value=open(img_path, "rb").read() if os.path.isfile(img_path)
+            else b"",
+            format=os.path.splitext(img_path)[1][1:] or "png",
             width="80%",
         )
 
@@ -90,7 +400,71 @@ class Temp(object):
         )
         remove.observe(remove_choose, names="value")
 
-        return widgets.VBox([desc, img, remove])
+        # pinned temp sets are not evicted
+        def pin_change(change):
+            Storage.pin(self.temp_path, change["new"])
+
+        pin = widgets.ToggleButton(
+            value=u["pinned"],
+            description="Pin",
+            icon="thumb-tack"
+        )
+        pin.observe(pin_change, names="value")
+
+        return widgets.VBox([desc, img, widgets.HBox([remove, pin])])
+
+    def get_frames(self, start=None, end=None, stride=1):
+        """Return the image files of the temporary set in time order
+        :param start: first time of the frames
+        :param end: last time of the frames
+        :param stride: every n-th frame
+        :return:
+        """
+        img_path = self.temp_path + "/temp"
+        # temporary files of write_atomic and the frames directory are left
+        frames = sorted([f for f in os.listdir(img_path)
+                         if f.endswith(".png") or f.endswith(".webp")])
+        if start is not None:
+            start = parser.parse(str(start))
+            frames = [f for f in frames
+                      if parser.parse(f.split(".")[0]) >= start]
+        if end is not None:
+            end = parser.parse(str(end))
+            frames = [f for f in frames
+                      if parser.parse(f.split(".")[0]) <= end]
+        return [img_path + "/" + f for f in frames[::stride]]
+
+    def export(self, path, start=None, end=None, stride=1, interval=150,
+               loop=0):
+        """Export frames as one animated image, see export
+        :return: path of the animated image
+        """
+        self.access()
+        frames = self.get_frames(start, end, stride)
+        fmt = "webp" if path.lower().endswith(".webp") else "apng"
+        tmp = path + ".part"
+        with open(tmp, "wb") as f:
+            write_animation(f, frames, fmt=fmt, interval=interval, loop=loop)
+        os.replace(tmp, path)
+        print("[STEP] Exported " + str(len(frames)) + " frames to " + path)
+        return path
+
+    def get_series(self):
+        """Return the time series of the stored frames of this set
+        :return:
+        """
+        if self.series is None:
+            Storage.touch(self.temp_path)
+            self.series = Series(self.temp_path)
+        return self.series
+
+    def access(self):
+        """Record an access to this temporary set, its images are rendered
+        again if they were evicted
+        :return:
+        """
+        Control.restore(self.temp_path)
+        Storage.touch(self.temp_path)
 
     def remove(self):
         """Remove this temporary set.
@@ -98,6 +472,14 @@ class Temp(object):
         """
         shutil.rmtree(self.temp_path)
 
+    @staticmethod
+    def get_id(t_dir):
+        """Get the ID of a temp set by its path
+        :param t_dir:
+        :return:
+        """
+        return Temp.get_temp_list().index(t_dir)
+
     @staticmethod
     def get_temp_list():
         """Get the path list of existing temp sets
@@ -118,6 +500,7 @@ class Make_GUI(object):
     def __init__(self, data_path):
         self.data_path = data_path
         self.control = Control(data_path)
+        self.job = None  # background job of the submitted task
         self.config = {
             "name": "DEFAULT_NAME",
             "desc": "DEFAULT_DESC",
@@ -147,13 +530,53 @@ class Make_GUI(object):
             value=None
         )
         self.options = widgets.VBox()
+        precision = widgets.Checkbox(
+            value=False,
+            description="Float32 processing"
+        )
+        encoding = widgets.Dropdown(
+            options=[("RGBA PNG", "png"), ("Palette PNG", "palette"),
+                     ("Lossless WebP", "webp")],
+            description="Encoding"
+        )
+        compression = widgets.IntSlider(
+            value=6,
+            min=0,
+            max=9,
+            description="Compression"
+        )
+        pipeline = widgets.Checkbox(
+            value=False,
+            description="Pipelined I/O"
+        )
+        stats = widgets.Checkbox(
+            value=False,
+            description="Show statistics"
+        )
+        estimate = widgets.Button(
+            description="Estimate",
+            icon="clock-o",
+        )
         submit = widgets.Button(
             description="Submit Task",
             icon="check",
         )
+        cancel = widgets.Button(
+            description="Cancel",
+            icon="stop",
+            disabled=True
+        )
+        progress = widgets.IntProgress(
+            value=0,
+            min=0,
+            max=1,
+            description="Progress"
+        )
         output = widgets.Output()
         self.container = widgets.VBox([
-            title, name, desc, task, self.options, submit, output
+            title, name, desc, task, self.options, precision, encoding,
+            compression, pipeline, stats,
+            widgets.HBox([estimate, submit, cancel]), progress, output
         ])
 
         # Change event of task
@@ -170,13 +593,77 @@ class Make_GUI(object):
 
         task.observe(task_change, names="value")
 
-        # Click event of submit
+        # Click event of submit, the task runs in the background
         def submit_click(b):
             output.clear_output()
-            with output:
-                self.control.submit(self.config)
-
+            if self.config["task"] is None:
+                with output:
+                    print("[ERROR] Please choose your task")
+                return
+            estimate.disabled = True
+            submit.disabled = True
+            cancel.disabled = False
+            progress.value = 0
+            self.job = self.control.submit_async(self.config)
+            self.job.observe_log(output.append_stdout)
+            self.job.observe(progress_change)
+            self.job.add_done_callback(job_done)
+
+        # Click event of estimate, a few files are made in the background
+        def estimate_click(b):
+            output.clear_output()
+            if self.config["task"] is None:
+                with output:
+                    print("[ERROR] Please choose your task")
+                return
+            estimate.disabled = True
+            submit.disabled = True
+            cancel.disabled = False
+            progress.value = 0
+            self.job = self.control.estimate_async(self.config)
+            self.job.observe_log(output.append_stdout)
+            self.job.observe(progress_change)
+            self.job.add_done_callback(estimate_done)
+
+        def progress_change(done, total):
+            progress.max = max(total, 1)
+            progress.value = done
+
+        # called from the thread of the job, so the output is appended to
+        # the widget instead of captured
+        def job_done(job):
+            estimate.disabled = False
+            submit.disabled = False
+            cancel.disabled = True
+            try:
+                result = job.result()
+            except Exception as e:
+                output.append_stdout("[ERROR] " + repr(e) + "\n")
+                return
+            if result is not None and stats.value:
+                output.append_display_data(
+                    widgets.HTML(value=Stats.to_html(result)))
+
+        def estimate_done(job):
+            estimate.disabled = False
+            submit.disabled = False
+            cancel.disabled = True
+            try:
+                result = job.result()
+            except Exception as e:
+                output.append_stdout("[ERROR] " + repr(e) + "\n")
+                return
+            if result is not None:
+                output.append_display_data(
+                    widgets.HTML(value=Stats.estimate_to_html(result)))
+
+        def cancel_click(b):
+            if self.job is not None:
+                self.job.cancel()
+
+        estimate.on_click(estimate_click)
         submit.on_click(submit_click)
+        cancel.on_click(cancel_click)
 
         # Other events
         def config_change(change):
@@ -192,6 +679,24 @@ class Make_GUI(object):
         desc.observe(config_change, names="value")
         task.observe(config_change, names="value")
 
+        def precision_change(change):
+            self.config["precision"] = "float32" if change["new"] \
+                else "float64"
+
+        precision.observe(precision_change, names="value")
+
+        def encoding_change(change):
+            self.config["encoding"] = encoding.value
+            self.config["compression"] = compression.value
+
+        encoding.observe(encoding_change, names="value")
+        compression.observe(encoding_change, names="value")
+
+        def pipeline_change(change):
+            self.control.pipeline = change["new"]
+
+        pipeline.observe(pipeline_change, names="value")
+
     def show(self):
         """Present the GUI.
         :return:
@@ -228,6 +733,16 @@ class Make_GUI(object):
                     options=o["options"],
                     description=o["description"]
                 )
+            elif o["type"] == "text":
+                w = widgets.Text(
+                    placeholder=o.get("placeholder", ""),
+                    description=o["description"]
+                )
+            elif o["type"] == "float":
+                w = widgets.FloatText(
+                    value=o.get("value", 0),
+                    description=o["description"]
+                )
             self.options.children += (w,)
             self.config["options"][k] = w.value
             w.observe(value_change, names="value")
@@ -245,6 +760,9 @@ class List_GUI(object):
             value="<b style='font-size: medium'>List of Temporary Set</b>"
         )
 
+        # disk usage of all the temp sets
+        self.usage = widgets.HTML()
+
         # container of temp sets
         self.temps = widgets.GridBox(
             layout=widgets.Layout(
@@ -264,7 +782,7 @@ class List_GUI(object):
 
         # container of the whole UI
         self.container = widgets.VBox([
-            title, self.temps, remove
+            title, self.usage, self.temps, remove
         ])
 
     def update_temps(self):
@@ -272,6 +790,11 @@ class List_GUI(object):
         :return:
         """
         self.temps.children = []
+        usages = Storage.get_usages()
+        q = Storage.get_quota()
+        self.usage.value = "%d temp sets, %.1f MB" % (
+            len(usages), sum(u["bytes"] for u in usages) / 1024 ** 2) + \
+            (" of %.0f MB quota" % q if q is not None else "")
 
         # initialize temp list
         self.t_list = Temp.get_temp_list()
@@ -0,0 +1,55 @@
+"""Paths and files of the temp sets
+
+Temp sets are directories under TEMP_SET_PATH. Their profiles, checkpoints
+and statistics are python literals, written by write_file and read back by
+read_file.
+"""
+
+import os
+import threading
+
+import numpy as np  # names of numpy scalars in the literals, see read_file
+
+TEMP_SET_PATH = "./temp_sets"
+
+
+def write_atomic(fp, content):
+    """Write bytes to a file through a temporary file, readers never see a
+    partly written file
+    :param fp:
+    :param content:
+    :return:
+    """
+    tmp = fp + "." + str(os.getpid()) + "." + str(threading.get_ident())
+    with open(tmp, "wb") as f:
+        f.write(content)
+    os.replace(tmp, fp)
+
+
+def frames_path(temp_path):
+    """Return the directory of stored frame data next to the temp files
+    :param temp_path:
+    :return:
+    """
+    return os.path.join(os.path.dirname(temp_path), "frames")
+
+
+def read_file(fp):
+    """Read a python literal written by write_file, None if not exists
+    :param fp:
+    :return:
+    """
+    if not os.path.exists(fp):
+        return None
+    with open(fp, "r") as f:
+        return eval(f.read())
+
+
+def write_file(fp, content):
+    """Write a python literal read by read_file
+    :param fp:
+    :param content:
+    :return:
+    """
+    with open(fp, "w") as f:
+        print(content, file=f)
@@ -5,20 +5,27 @@ import ipyleaflet as ill
 import ipywidgets as widgets
 from base64 import b64encode
 import os
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
+from matplotlib.figure import Figure
 from dateutil import parser
 from PIL import Image
 import numpy as np
 
-from .temp import Temp
+from .temp import Temp, write_animation, compare
 from .task import Task
+from .series import Series
+from .contours import Contours
 
 
 class View(object):
     def __init__(self, *args, height=400, col=1, zoom=7, link=False,
-                 grid=False, avg=False):
+                 grid=False, avg=False, anim=False, series=False, op=None,
+                 contours=None):
         self.maps = []
         self.layers = []
         self.cont = None
@@ -29,12 +36,26 @@ class View(object):
         self.link = link  # only for multiple views, if maps are linked
         self.multi = grid  # single or multiple views
         self.static = avg  # only for unit views, if map is static average
+        self.anim = anim  # only for unit views, if map is animated image
+        self.series = series  # plot the values at a clicked point over time
+        self.contours = contours  # levels of isolines instead of images
+
+        if op is not None:
+            # difference or ratio of two temp sets, made once
+            if len(args) != 2 or not all(isinstance(i, int) for i in args):
+                print("[ERROR] Operation needs the IDs of two temp sets.")
+                return
+            t_dir = compare(args[0], args[1], op=op)
+            if t_dir is None:
+                return
+            args = (Temp.get_id(t_dir),)
 
         if len(args) == 1:
             self.unit_view(args[0])  # unit
         else:
-            v_list = [View(i, height=height, avg=avg, zoom=zoom) for i in
-                      args]
+            v_list = [View(i, height=height, avg=avg, zoom=zoom, anim=anim,
+                           series=series and grid, contours=contours)
+                      for i in args]
             if not grid:
                 self.single_view(v_list)  # single
             elif grid:
@@ -48,6 +69,7 @@ class View(object):
         if isinstance(arg, int):
             # init basemap
             t = Temp(arg)
+            t.access()
             b = t.profile["task"]["options"]["Bounds"]
             center = [
                 (b[0][0] + b[1][0]) * 0.5,
@@ -58,7 +80,8 @@ class View(object):
 
             # init layer
             p = t.profile
-            self.layers.append(self.Layer(p, self.static))
+            self.layers.append(self.Layer(p, self.static, self.anim,
+                                          self.contours, self.zoom))
 
             # init content
             self.cont = self.Content(self.col)
@@ -74,6 +97,9 @@ class View(object):
 
             # add basemap to content
             self.cont.add_content(self.maps[0])
+
+            if self.series:
+                self.maps[0].enable_series()
         elif isinstance(arg, View):
             # wrap the input view instance
             self.maps = arg.maps
@@ -86,7 +112,9 @@ class View(object):
             self.link = arg.link
             self.multi = arg.multi
             self.static = arg.static
-
+            self.anim = arg.anim
+            self.series = arg.series
+            self.contours = arg.contours
 
     def single_view(self, v_list):
         # init maps
@@ -115,6 +143,9 @@ class View(object):
         # add map to content
         self.cont.add_content(self.maps[0])
 
+        if self.series:
+            self.maps[0].enable_series()
+
         # add control to views
         self.ctrl.add_control(v_list)
 
@@ -168,7 +199,25 @@ class View(object):
         for m in self.maps:
             m.get().observe(change_center, names="center")
 
+    def load(self, threads=8):
+        """Load the layers, views are only loaded on display
+
+        The temp sets are read and their images encoded in parallel, the
+        widgets are only updated by the calling thread.
+        :param threads: number of threads reading the temp sets
+        :return:
+        """
+        layers = [l for l in self.layers if not l.loaded]
+        if len(layers) > 1:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                contents = list(pool.map(lambda l: l.read(), layers))
+        else:
+            contents = [l.read() for l in layers]
+        for l, c in zip(layers, contents):
+            l.apply(c)
+
     def show(self):
+        self.load()
         result = widgets.VBox(
             children=[self.cont.get(), self.ctrl.get()]
         )
@@ -190,10 +239,52 @@ class View(object):
                 layout=widgets.Layout(height=height)
             )
             self.legend_list = []
+            self.layers = []
+            self.output = None  # plot of the time series at a clicked point
 
         def get(self):
             return self.map
 
+        def enable_series(self):
+            """Plot the values of all the layers at a clicked point over time
+            :return:
+            """
+            if self.output is not None:
+                return
+            self.output = widgets.Output(
+                layout=widgets.Layout(width="400px")
+            )
+            self.map.add_control(ill.WidgetControl(
+                widget=self.output,
+                position="bottomleft"
+            ))
+
+            def on_interaction(**kwargs):
+                if kwargs.get("type") != "click":
+                    return
+                lat, lon = kwargs["coordinates"]
+                self.plot_series(lat, lon)
+
+            self.map.on_interaction(on_interaction)
+
+        def plot_series(self, lat, lon):
+            """Plot the values of the layers at a point over time
+            :param lat:
+            :param lon:
+            :return:
+            """
+            fig, ax = plt.subplots(figsize=(5, 2.5))
+            for l in self.layers:
+                times, values = l.get_series().point(lat, lon)
+                ax.plot(times, values, label=l.p["task"]["name"])
+            ax.set_title("%.4f, %.4f" % (lat, lon), fontsize=9)
+            ax.legend(fontsize=8)
+            fig.autofmt_xdate()
+            self.output.clear_output(wait=True)
+            with self.output:
+                display(fig)
+            plt.close(fig)
+
         def set_zoom(self, z):
             self.map.zoom = z
 
@@ -205,6 +296,9 @@ class View(object):
 
             # add layer to map
             self.map.add_layer(layer)
+            self.layers.append(l)
+            if l.contours is not None:
+                self.map.observe(lambda c: l.set_zoom(c.new), names="zoom")
 
             # add legend to map if necessary
             if "Colormap" in profile["task"]["options"]:
@@ -220,98 +314,181 @@ class View(object):
     class Layer(object):
         """class definition of layer
 
-        A layer corresponds to a temp set
+        A layer corresponds to a temp set. The overlay and the legend widgets
+        are created empty, images are only read once the layer is loaded,
+        see View.load. Reading does not touch the widgets, so layers can be
+        read in other threads. With contour levels, the layer shows the
+        isolines of the frames as GeoJSON instead of the images.
         """
+        legends = {}  # legend images by colormap, shared by all layers
+        lock = threading.Lock()
 
-        def __init__(self, p, static):
+        def __init__(self, p, static, anim=False, contours=None, zoom=7):
             self.p = p
             self.temp_path = p["temp_path"]
             self.file_list = []
-            for f in os.listdir(self.temp_path):
-                fp = os.path.join(self.temp_path, f)
-                if os.path.isfile(fp) and not f.startswith("."):
-                    self.file_list.append(f)
-            self.file_list.sort()
             self.layer = None
             self.legend = None
-            self.static = static
+            self.contours = None  # isolines of the frames, see Contours
+            self.zoom = zoom
+            self.frame = 0
+            if contours is not None:
+                self.contours = Contours(os.path.dirname(self.temp_path),
+                                         levels=contours)
+                static = anim = False  # lines are played frame by frame
+            self.static = static or anim  # no player for a single image
+            self.anim = anim
+            self.loaded = False
+            self.series = None  # values of the frames, read on first click
 
             # different branches by task
             task = p["task"]["task"]
             task_list = Task.tasks
-            if task == task_list[0] or task == task_list[1]:
-                if static:
-                    self.layer = self.raster_static()
+            if task in task_list[:4]:
+                if self.contours is not None:
+                    self.layer = ill.GeoJSON(
+                        data={"type": "FeatureCollection", "features": []})
+                else:
+                    self.layer = ill.ImageOverlay(
+                        url="",
+                        bounds=p["task"]["options"]["Bounds"]
+                    )
+                self.legend = widgets.Image(
+                    value=b"",
+                    format="png",
+                    layout=widgets.Layout(height="25px", width="250px")
+                )
+
+        def load(self):
+            """Read the layer and show it
+            :return:
+            """
+            if not self.loaded:
+                self.apply(self.read())
+
+        def read(self):
+            """Read the file list, the image and the legend of the layer
+            :return: dict of the values of the widgets, see apply
+            """
+            self.file_list = sorted([
+                f for f in os.listdir(self.temp_path)
+                if os.path.isfile(os.path.join(self.temp_path, f)) and
+                not f.startswith(".")
+            ])
+            content = {}
+            if self.layer is not None:
+                if self.contours is not None:
+                    dt = self.file_list[0].split(".")[0]
+                    content["data"] = self.contours.get(dt, self.zoom)
+                elif self.anim:
+                    content["url"] = self.raster_animated()
+                elif self.static:
+                    content["url"] = self.raster_static()
                 else:
-                    self.layer = self.raster_dynamic()
-                self.legend = self.color_map()
+                    content["url"] = self.raster_dynamic()
+                content["legend"] = self.color_map(
+                    self.p["task"]["options"]["Colormap"])
+            return content
+
+        def apply(self, content):
+            """Show what is read by read in the widgets of the layer
+            :param content:
+            :return:
+            """
+            if self.layer is not None:
+                if "data" in content:
+                    self.layer.data = content["data"]
+                else:
+                    self.layer.url = content["url"]
+                self.legend.value = content["legend"]
+            self.loaded = True
+
+        def show_frame(self, i):
+            """Show the i-th frame of the layer
+            :param i:
+            :return:
+            """
+            self.frame = i
+            if self.contours is not None:
+                dt = self.file_list[i].split(".")[0]
+                self.layer.data = self.contours.get(dt, self.zoom)
+            else:
+                self.layer.url = self.read_image(
+                    os.path.join(self.temp_path, self.file_list[i]))
+
+        def set_zoom(self, zoom):
+            """Trace the isolines of the current frame again for a zoom level
+            :param zoom:
+            :return:
+            """
+            if int(round(zoom)) != int(round(self.zoom)):
+                self.zoom = zoom
+                self.show_frame(self.frame)
 
         def raster_static(self):
             """Single image or ghost view of multiple images
             :return:
             """
             temp_path = self.p["temp_path"]
-            bounds = self.p["task"]["options"]["Bounds"]
-            layer = ill.ImageOverlay(
-                url="",
-                bounds=bounds
-            )
 
             # create average image
             ims = []
             for f in self.file_list:
                 fp = os.path.join(temp_path, f)
-                ims.append(Image.open(fp, mode="r"))
+                ims.append(Image.open(fp, mode="r").convert("RGBA"))
             ims = np.array([np.array(im) for im in ims])
             imave = np.average(ims, axis=0)
             result = Image.fromarray(imave.astype("uint8"))
-            target_path = os.path.join(temp_path, "ghost.png")
-            result.save(target_path, "PNG")
-            layer.url = self.read_image(target_path)
-            os.remove(target_path)
-            return layer
+            b = io.BytesIO()
+            result.save(b, "PNG")
+            return "data:image/png;base64," + b64encode(
+                b.getvalue()).decode("ascii")
 
         def raster_dynamic(self):
             """Animation of images, initialize layer with the first image in temp
             :return:
             """
             temp_path = self.p["temp_path"]
-            bounds = self.p["task"]["options"]["Bounds"]
-            layer = ill.ImageOverlay(
-                url="",
-                bounds=bounds
-            )
-
             first_img = os.path.join(temp_path, self.file_list[0])
-            layer.url = self.read_image(first_img)
-
-            return layer
+            return self.read_image(first_img)
 
-        def color_map(self):
+        def raster_animated(self):
+            """Animation of images as one animated png, played by the browser
+            :return:
+            """
             temp_path = self.p["temp_path"]
-            cmap = self.p["task"]["options"]["Colormap"]
-            img = os.path.join(temp_path, "legend.png")
-            (v_min, v_max) = cmap[1]
-            type = cmap[2]
-            if type == "linear":
-                norm = mpl.colors.Normalize(vmin=v_min, vmax=v_max)
-            else:
-                norm = mpl.colors.LogNorm(vmin=v_min, vmax=v_max)
-            fig, ax = plt.subplots(figsize=(5, 0.2))
-            fig.colorbar(mpl.cm.ScalarMappable(norm=norm, cmap=cmap[0]),
-                         cax=ax, orientation="horizontal")
-            plt.savefig(img, bbox_inches="tight", pad_inches=0.02)
-            plt.close()
-
-            # build legend widget
-            legend = widgets.Image(
-                value=open(img, "rb").read(),
-                format="png",
-                layout=widgets.Layout(height="25px", width="250px")
-            )
-            os.remove(img)
+            b = io.BytesIO()
+            write_animation(b, [os.path.join(temp_path, f)
+                                for f in self.file_list])
+            return "data:image/apng;base64," + b64encode(
+                b.getvalue()).decode("ascii")
 
-            return legend
+        @staticmethod
+        def color_map(cmap):
+            """Render the legend of a colormap, once per colormap
+            :param cmap: tuple of colormap name, value range and norm type
+            :return: png bytes
+            """
+            with View.Layer.lock:
+                if cmap in View.Layer.legends:
+                    return View.Layer.legends[cmap]
+
+                (v_min, v_max) = cmap[1]
+                type = cmap[2]
+                if type == "linear":
+                    norm = mpl.colors.Normalize(vmin=v_min, vmax=v_max)
+                else:
+                    norm = mpl.colors.LogNorm(vmin=v_min, vmax=v_max)
+                # without pyplot, which is not safe to use from threads
+                fig = Figure(figsize=(5, 0.2))
+                ax = fig.add_subplot()
+                fig.colorbar(mpl.cm.ScalarMappable(norm=norm, cmap=cmap[0]),
+                             cax=ax, orientation="horizontal")
+                b = io.BytesIO()
+                fig.savefig(b, format="png", bbox_inches="tight",
+                            pad_inches=0.02)
+                View.Layer.legends[cmap] = b.getvalue()
+                return View.Layer.legends[cmap]
 
         @staticmethod
         def read_image(img_path):
@@ -320,11 +497,20 @@ class View(object):
             :param img_path:
             :return:
             """
+            ext = os.path.splitext(img_path)[1][1:].lower()
             with open(img_path, "rb") as img_file:
-                result = "data:image/png;base64," + b64encode(
+                result = "data:image/" + ext + ";base64," + b64encode(
                     img_file.read()).decode("ascii")
             return result
 
+        def get_series(self):
+            """Return the time series of the stored frames of the layer
+            :return:
+            """
+            if self.series is None:
+                self.series = Series(os.path.dirname(self.temp_path))
+            return self.series
+
         def get(self):
             return self.layer, self.legend, self.p
 
@@ -365,14 +551,24 @@ class View(object):
             self.widgets = {
                 "player": None
             }
+            self.arg = None
 
         def add_control(self, arg):
-            # add player widget
-            self.widgets["player"] = self.Player(arg)
+            # player widget is built on first display, see build
+            self.arg = arg
+
+        def build(self):
+            """Build the player once the layers are loaded
+            :return:
+            """
+            if self.widgets["player"] is not None:
+                return
+            self.widgets["player"] = self.Player(self.arg)
             if self.widgets["player"].get() is not None:
                 self.container.children += (self.widgets["player"].get(),)
 
         def get(self):
+            self.build()
             return self.container
 
         class Player(object):
@@ -398,9 +594,7 @@ class View(object):
                     return
 
                 # compute timeline
-                layer, legend, profile = self.arg.get()
-                temp_path = self.arg.temp_path
-                file_list = self.arg.file_list
+                self.arg.load()
                 timeline = [t.split(".")[0] for t in self.arg.file_list]
                 timeline = [parser.parse(t) for t in timeline]
                 self.timeline = timeline
@@ -428,8 +622,7 @@ class View(object):
                 def on_slider_change(change):
                     i = self.timeline.index(change.new)
                     self.player.value = i  # regarding change on player
-                    img = os.path.join(temp_path, file_list[i])
-                    layer.url = View.Layer.read_image(img)
+                    self.arg.show_frame(i)
 
                 self.slider.observe(on_slider_change, names="value")
 
@@ -437,8 +630,7 @@ class View(object):
                 def on_player_change(change):
                     t = self.timeline[change.new]
                     self.slider.value = t  # regarding change on slider
-                    img = os.path.join(temp_path, file_list[change.new])
-                    layer.url = View.Layer.read_image(img)
+                    self.arg.show_frame(change.new)
 
                 self.player.observe(on_player_change, names="value")
 
@@ -449,7 +641,7 @@ class View(object):
                 # no player for static view
                 static = True
                 for a in self.arg:
-                    if not a.static:
+                    if not a.static and not a.anim:
                         static = False
                 if static:
                     return
@@ -457,6 +649,7 @@ class View(object):
                 # compute timeline
                 timeline = []
                 for v in self.arg:
+                    v.ctrl.build()
                     p = v.ctrl.widgets["player"]
                     if p.timeline is not None:
                         timeline = timeline + p.timeline
@@ -0,0 +1,93 @@
+"""Synthetic ODIM composites in a scratch working directory
+
+TEMP_SET_PATH is relative, so every test runs in its own directory.
+"""
+
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+COMPOSITE = {"name": "test", "desc": "",
+             "task": "Radar composite or image (2D)",
+             "options": {"dset": "dataset1", "qty": "data1"}}
+
+
+def write_composite(fp, minute, data, where=None):
+    """Write a composite on a longitude and latitude grid over 2-8 E and
+    49-54 N, rows from the north
+    :param fp:
+    :param minute: minute after 14:00 of the product
+    :param data: uint8 array, 0 is undetect and 255 nodata
+    :param where: attributes replacing those of the grid, e.g. of another
+    projection
+    :return:
+    """
+    tp = ("14%02d00" % minute).encode()
+    with h5py.File(fp, "w") as f:
+        f.create_group("what").attrs.update({
+            "object": b"COMP", "date": b"20161003", "time": tp})
+        f.create_group("where").attrs.update({
+            "projdef": b"+proj=longlat +ellps=WGS84",
+            "xsize": data.shape[1], "ysize": data.shape[0],
+            "LL_lon": 2.0, "LL_lat": 49.0, "UL_lon": 2.0, "UL_lat": 54.0,
+            "UR_lon": 8.0, "UR_lat": 54.0, "LR_lon": 8.0, "LR_lat": 49.0})
+        f["where"].attrs.update(where or {})
+        d = f.create_group("dataset1")
+        d.create_group("what").attrs.update({
+            "product": b"PCAPPI", "startdate": b"20161003",
+            "starttime": tp})
+        g = d.create_group("data1")
+        g.create_group("what").attrs.update({
+            "quantity": b"DBZH", "gain": 0.5, "offset": -32.0,
+            "nodata": 255.0, "undetect": 0.0})
+        g.create_dataset("data", data=data, compression="gzip")
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("temp_sets")
+    return tmp_path
+
+
+@pytest.fixture
+def composites(workdir):
+    """Directory of four composites five minutes apart
+    :param workdir:
+    :return:
+    """
+    src = workdir / "src"
+    src.mkdir()
+    rng = np.random.default_rng(1)
+    for i in range(4):
+        data = rng.integers(0, 256, (60, 80)).astype(np.uint8)
+        write_composite(str(src / ("comp_%d.h5" % i)), i * 5, data)
+    return str(src)
+
+
+def write_volume(fp, minute, scans):
+    """Write a polar volume of a radar at 5 E and 52 N, 50 m high
+    :param fp:
+    :param minute: minute after 14:00 of the volume
+    :param scans: list of elevation angle and uint8 array of rays and bins
+    of 500 m, 0 is undetect and 255 nodata
+    :return:
+    """
+    tp = ("14%02d00" % minute).encode()
+    with h5py.File(fp, "w") as f:
+        f.create_group("what").attrs.update({
+            "object": b"PVOL", "date": b"20161003", "time": tp})
+        f.create_group("where").attrs.update({
+            "lon": 5.0, "lat": 52.0, "height": 50.0})
+        for k, (elangle, data) in enumerate(scans):
+            d = f.create_group("dataset%d" % (k + 1))
+            d.create_group("where").attrs.update({
+                "elangle": elangle, "nrays": data.shape[0],
+                "nbins": data.shape[1], "rscale": 500.0})
+            g = d.create_group("data1")
+            g.create_group("what").attrs.update({
+                "quantity": b"DBZH", "gain": 0.5, "offset": -32.0,
+                "nodata": 255.0, "undetect": 0.0})
+            g.create_dataset("data", data=data, compression="gzip")
@@ -0,0 +1,41 @@
+import copy
+import sys
+import threading
+
+from conftest import COMPOSITE
+from ipymeteovis.control import Control
+from ipymeteovis.executor import BackgroundJob
+
+
+def test_job_log_and_stdout_restored(composites):
+    stdout = sys.stdout
+    job = Control(composites, backend="thread").submit_async(
+        copy.deepcopy(COMPOSITE))
+    stats = job.result(timeout=60)
+    assert job.done() and len(stats["files"]) == 4
+    assert sys.stdout is stdout
+    log = []
+    job.observe_log(log.append)
+    assert "Task completed!" in "".join(log)
+    assert job.progress == (4, 4)
+
+
+def test_only_the_job_thread_is_captured(capsys):
+    started = threading.Event()
+    release = threading.Event()
+
+    def target(cancel, progress):
+        print("from the job")
+        started.set()
+        release.wait(10)
+        return cancel.is_set()
+
+    job = BackgroundJob(target)
+    started.wait(10)
+    print("from the notebook")
+    job.cancel()
+    release.set()
+    assert job.result(timeout=10) is True
+    out = capsys.readouterr().out
+    assert "from the notebook" in out and "from the job" not in out
+    assert job.log == ["from the job", "\n"]
@@ -0,0 +1,59 @@
+import os
+
+import h5py
+
+from conftest import COMPOSITE
+from ipymeteovis.__main__ import main
+from ipymeteovis.control import Control
+from ipymeteovis.util import read_file
+
+JOB = {"task": COMPOSITE["task"], "options": COMPOSITE["options"]}
+
+
+def count_opens(monkeypatch):
+    opens = []
+    h5_file = h5py.File
+
+    def counted(name, *args, **kwargs):
+        opens.append(name)
+        return h5_file(name, *args, **kwargs)
+
+    monkeypatch.setattr(h5py, "File", counted)
+    return opens
+
+
+def test_batch_makes_a_set_per_job(composites):
+    jobs = [dict(JOB, source=composites, name="a"),
+            dict(JOB, source=composites, task="No such task"),
+            dict(JOB, source=composites, name="b", encoding="palette")]
+    t_dirs = Control.batch(jobs, processes=2, backend="thread")
+    assert len(t_dirs) == 2  # the unknown task is skipped
+    for t_dir, name in zip(t_dirs, ["a", "b"]):
+        profile = read_file(t_dir + "/profile.txt")
+        assert profile["status"] == "complete"
+        assert profile["config"]["name"] == name
+        assert len(Control.read_checkpoint(t_dir)) == 4
+    assert read_file(t_dirs[1] + "/profile.txt")["config"]["encoding"] == \
+        "palette"
+
+
+def test_batch_reads_shared_files_once(composites, monkeypatch):
+    opens = count_opens(monkeypatch)
+    Control.batch([dict(JOB, source=composites)], backend="thread")
+    single = len(opens)
+    assert single >= 4
+    del opens[:]
+    # other options, so the second set is not served from the cache
+    other = dict(JOB, source=composites, options=dict(
+        JOB["options"], roi="50, 3, 53, 7"))
+    Control.batch([dict(JOB, source=composites), other], backend="thread")
+    assert len(opens) == single
+
+
+def test_command_line(composites, tmp_path, capsys):
+    jobs = tmp_path / "jobs.txt"
+    jobs.write_text(repr([dict(JOB, source=composites)]))
+    assert main([str(jobs), "--processes", "2", "--backend", "thread"]) == 0
+    t_dir = capsys.readouterr().out.strip().splitlines()[-1]
+    assert os.path.isdir(t_dir)
+    assert read_file(t_dir + "/profile.txt")["status"] == "complete"
@@ -0,0 +1,72 @@
+import copy
+import os
+import threading
+import time
+
+import numpy as np
+
+from conftest import COMPOSITE
+from ipymeteovis.control import Control
+from ipymeteovis.executor import parallel
+from ipymeteovis.util import frames_path, read_file
+
+running = {"now": 0, "max": 0, "weight": 0, "over": False}
+lock = threading.Lock()
+
+
+def weighted_job(w):
+    with lock:
+        running["now"] += 1
+        running["weight"] += w
+        running["max"] = max(running["max"], running["now"])
+        # only a job alone may go over the budget of 60
+        running["over"] |= running["now"] > 1 and running["weight"] > 60
+    time.sleep(0.02)
+    with lock:
+        running["now"] -= 1
+        running["weight"] -= w
+    return w
+
+
+def test_admission_stays_within_budget():
+    weights = [40, 30, 30, 80, 10, 20, 50]
+    r = parallel(weighted_job, weights, processes=4, weights=weights,
+                 budget=60, backend="thread")
+    assert r == weights
+    assert not running["over"]
+    assert running["max"] >= 2
+    for w in weights:
+        running.update(now=0, weight=0, max=0)
+        parallel(weighted_job, [w] * 3, processes=4, weights=[w] * 3,
+                 budget=60, backend="thread")
+        assert running["max"] == min(max(60 // w, 1), 3)
+        assert not running["over"]
+
+
+def load_frames(t_dir):
+    fp = frames_path(read_file(t_dir + "/profile.txt")["temp_path"])
+    frames = {}
+    for f in sorted(os.listdir(fp)):
+        if f.endswith(".npz"):
+            with np.load(fp + "/" + f) as z:
+                frames[f] = z["data"]
+    return frames
+
+
+def test_float32_matches_float64(composites):
+    c = Control(composites, memory_budget=1000, backend="thread")
+    t_dirs = []
+    for precision in ["float64", "float32"]:
+        config = copy.deepcopy(COMPOSITE)
+        config["precision"] = precision
+        t_dirs.append(c.create_set(config))
+        c.run(t_dirs[-1], c.file_list)
+    f64, f32 = [load_frames(t) for t in t_dirs]
+    assert sorted(f64) == sorted(f32) and len(f64) == 4
+    for k in f64:
+        assert f32[k].dtype == np.float32
+        np.testing.assert_array_equal(np.isnan(f64[k]), np.isnan(f32[k]))
+        np.testing.assert_allclose(f32[k], f64[k], rtol=1e-6)
+    o64, o32 = [read_file(t + "/profile.txt")["task"]["options"]
+                for t in t_dirs]
+    assert o64["Colormap"] == o32["Colormap"]
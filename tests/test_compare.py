@@ -0,0 +1,72 @@
+import copy
+import os
+
+import numpy as np
+
+from conftest import COMPOSITE, write_composite
+from ipymeteovis.control import Control
+from ipymeteovis.util import frames_path, read_file
+
+
+def make_sets(workdir, shift):
+    """Two temp sets of the same grid, the raw values of the second one
+    shifted by shift, i.e. its values by shift / 2
+    """
+    rng = np.random.default_rng(4)
+    data = rng.integers(1, 240, (3, 60, 80)).astype(np.uint8)
+    data[:, :5] = 0  # undetect
+    t_dirs = []
+    for name, s in [("a", 0), ("b", shift)]:
+        src = workdir / name
+        src.mkdir()
+        for i in range(3):
+            d = np.where(data[i] > 0, data[i] + s, 0).astype(np.uint8)
+            write_composite(str(src / ("comp_%d.h5" % i)), i * 5, d)
+        c = Control(str(src), backend="thread")
+        config = copy.deepcopy(COMPOSITE)
+        config["name"] = name
+        t_dir = c.create_set(config)
+        c.run(t_dir, c.file_list)
+        t_dirs.append(t_dir)
+    return t_dirs
+
+
+def frames(t_dir):
+    fp = frames_path(read_file(t_dir + "/profile.txt")["temp_path"])
+    result = []
+    for f in sorted(os.listdir(fp)):
+        if f.endswith(".npz"):
+            with np.load(fp + "/" + f) as z:
+                result.append(z["data"])
+    return result
+
+
+def test_difference_and_ratio(workdir):
+    a, b = make_sets(workdir, 10)
+    d = Control.compare(a, b, op="diff", processes=2)
+    diff = frames(d)
+    assert len(diff) == 3
+    for f in diff:
+        valid = np.isfinite(f)
+        assert valid.mean() > 0.5
+        np.testing.assert_allclose(f[valid], -5.0, atol=1e-4)
+    profile = read_file(d + "/profile.txt")
+    assert profile["task"]["name"] == "a - b"
+    v_min, v_max = profile["task"]["options"]["Colormap"][1]
+    assert v_min == -v_max  # centered at zero
+
+    r = Control.compare(a, a, op="ratio", processes=2)
+    for f in frames(r):
+        valid = np.isfinite(f)
+        # cells of 0 dBZ give no ratio
+        assert valid.mean() > 0.5
+        np.testing.assert_allclose(f[valid], 1.0, rtol=1e-6)
+
+
+def test_comparison_is_reused(workdir, capsys):
+    a, b = make_sets(workdir, 10)
+    d = Control.compare(a, b, processes=2)
+    assert Control.compare(a, b, processes=2) == d
+    assert "Comparison exists" in capsys.readouterr().out
+    assert Control.compare(a, b, op="ratio", processes=2) != d
+    assert Control.compare(a, b, op="sum") is None
@@ -0,0 +1,113 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+
+from conftest import COMPOSITE, write_composite
+from ipymeteovis.contours import Contours
+from ipymeteovis.control import Control
+from ipymeteovis.util import TEMP_SET_PATH, write_file
+
+NRAYS, NBINS = 36, 10
+
+
+def polar_grid():
+    """Corners of a polar grid around 5 E and 52 N with the first ray
+    repeated after the last one, as PolarVol2D.get_grid
+    """
+    az = np.radians(np.arange(NRAYS + 1) * 360.0 / NRAYS)
+    r = np.arange(NBINS + 1) * 0.05
+    lon = 5 + np.sin(az)[:, None] * r
+    lat = 52 + np.cos(az)[:, None] * r
+    return np.stack([lon, lat, np.zeros_like(lon)], axis=-1)
+
+
+def write_frames(t_dir, frames):
+    """Write frames of a polar grid and the profile of their temp set
+    :param t_dir:
+    :param frames: dict of data and wraps by time
+    :return:
+    """
+    os.makedirs(t_dir + "/frames")
+    write_file(t_dir + "/profile.txt", {"task": {"options": {}}})
+    grid = polar_grid()
+    np.save(t_dir + "/frames/grid_polar.npy", grid)
+    bounds = [[grid[..., 1].min(), grid[..., 0].min()],
+              [grid[..., 1].max(), grid[..., 0].max()]]
+    for dt, (data, wraps) in frames.items():
+        np.savez(t_dir + "/frames/" + dt + ".npz", data=data, grid="polar",
+                 bounds=np.array(bounds), wraps=wraps)
+
+
+def ring():
+    data = np.zeros((NRAYS, NBINS), np.float32)
+    data[:, 4:6] = 50
+    return data
+
+
+def lines(result):
+    return [np.array(l) for l in result["features"][0]["geometry"][
+        "coordinates"]]
+
+
+def test_full_scan_closes_the_seam(workdir):
+    t_dir = str(workdir / "polar")
+    write_frames(t_dir, {"full": (ring(), True), "cropped": (ring(), False)})
+    c = Contours(t_dir, levels=[40])
+
+    # two closed rings around the radar
+    full = lines(c.get("full", 12))
+    assert len(full) == 2
+    for l in full:
+        np.testing.assert_allclose(l[0], l[-1])
+        assert np.ptp(l[:, 1]) > 0.1
+
+    # the same rays without the seam, the lines stop at the last ray
+    cropped = lines(c.get("cropped", 12))
+    assert cropped
+    for l in cropped:
+        assert np.hypot(*(l[0] - l[-1])) > 0.01
+
+
+def test_centers_match_the_data(tmp_path):
+    geometry = ("polar", (NRAYS, NBINS), ((51.5, 4.5), (52.5, 5.5)))
+    np.save(str(tmp_path / "grid_polar.npy"), polar_grid())
+    x, y = Contours.get_centers(str(tmp_path), geometry)
+    assert x.shape == y.shape == (NRAYS, NBINS)
+    x, y = Contours.get_centers(str(tmp_path), geometry, True)
+    assert x.shape == (NRAYS + 1, NBINS)
+    np.testing.assert_array_equal(x[-1], x[0])
+
+
+def test_projected_isolines_are_cached(workdir):
+    pyproj = pytest.importorskip("pyproj")
+    projdef = "+proj=laea +lat_0=52 +lon_0=5 +ellps=WGS84"
+    proj = pyproj.Proj(projdef)
+    where = {"projdef": projdef.encode()}
+    for k, (x, y) in {"UL": (-300e3, 250e3), "UR": (300e3, 250e3),
+                      "LL": (-300e3, -250e3), "LR": (300e3, -250e3)}.items():
+        where[k + "_lon"], where[k + "_lat"] = proj(x, y, inverse=True)
+    src = workdir / "src"
+    src.mkdir()
+    data = np.full((50, 60), 104, np.uint8)  # 20 dBZ
+    data[40:, 20:30] = 200  # 68 dBZ along the southern edge
+    write_composite(str(src / "comp.h5"), 0, data, where)
+    Control(str(src), backend="thread").submit(copy.deepcopy(COMPOSITE))
+    t_id, = [d for d in os.listdir(TEMP_SET_PATH) if d.isdigit()]
+    t_dir = TEMP_SET_PATH + "/" + t_id
+    c = Contours(t_dir, levels=[40])
+    dt, = [os.path.splitext(f)[0] for f in os.listdir(c.path)
+           if f.endswith(".npz")]
+
+    result = c.get(dt, 8)
+    l, = lines(result)
+    # the line stays around the cells with data, nothing joins the
+    # southern edge to the northern one
+    xs, ys = proj(l[:, 0], l[:, 1])
+    assert ys.max() < 250e3 - 39 * 10e3
+    assert -110e3 <= xs.min() and xs.max() <= 10e3
+    cached = os.listdir(c.path + "/contours")
+    assert len(cached) == 1
+    assert c.get(dt, 8.2) == result
+    assert os.listdir(c.path + "/contours") == cached
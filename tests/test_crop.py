@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from ipymeteovis.task import Grid2D, PolarVol2D
+
+BOUNDS = ((49.0, 2.0), (54.0, 8.0))  # 0.1 degree cells of 50 x 60
+
+
+def test_grid_crop_without_roi_is_full():
+    rows, cols, bounds = Grid2D.get_crop(BOUNDS, 50, 60, None)
+    assert (rows, cols) == (slice(0, 50), slice(0, 60))
+    assert bounds == [[49.0, 2.0], [54.0, 8.0]]
+
+
+def test_grid_crop_across_north_edge():
+    roi = ((53.55, 3.05), (56.0, 3.95))
+    rows, cols, bounds = Grid2D.get_crop(BOUNDS, 50, 60, roi)
+    # rows run from the north, the box is cut at the edge of the data
+    assert (rows.start, rows.stop) == (0, 5)
+    assert (cols.start, cols.stop) == (10, 20)
+    np.testing.assert_allclose(bounds, [[53.5, 3.0], [54.0, 4.0]])
+
+
+def test_grid_crop_is_aligned_to_cells():
+    roi = ((50.03, 2.51), (50.47, 2.99))
+    rows, cols, bounds = Grid2D.get_crop(BOUNDS, 50, 60, roi)
+    assert (rows.start, rows.stop) == (35, 40)
+    assert (cols.start, cols.stop) == (5, 10)
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    assert lat_min <= roi[0][0] and lat_max >= roi[1][0]
+    assert lon_min <= roi[0][1] and lon_max >= roi[1][1]
+
+
+def test_grid_crop_outside_raises():
+    with pytest.raises(ValueError):
+        Grid2D.get_crop(BOUNDS, 50, 60, ((55.0, 2.0), (56.0, 3.0)))
+
+
+def test_polar_crop_across_north_reads_two_hyperslabs():
+    pytest.importorskip("osgeo")  # georeferencing of wradlib needs GDAL
+    site = (5.0, 52.0, 50.0)
+    roi = ((52.2, 4.97), (52.6, 5.03))  # a narrow box north of the radar
+    rays, bins, grid, bounds = PolarVol2D.get_crop(360, 100, 1000.0, 0.5,
+                                                   site, roi, None)
+    # rays on both sides of north, the ones west of it first
+    assert len(rays) == 2
+    assert rays[0].stop == 360 and rays[1].start == 0
+    assert rays[0].start > 300 and rays[1].stop < 60
+    n = sum(r.stop - r.start for r in rays)
+    assert grid.shape[:2] == (n + 1, bins.stop - bins.start + 1)
+    assert 20 <= bins.start < bins.stop <= 70
+    # neighbouring rows of the grid are neighbouring rays
+    assert np.all(np.abs(np.diff(grid[:, -1, 0])) < 0.05)
+    assert bounds[0][0] >= roi[0][0] and bounds[1][0] <= roi[1][0]
@@ -0,0 +1,93 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+
+from conftest import COMPOSITE, write_composite
+from ipymeteovis.control import Control
+from ipymeteovis.cube import Cube
+from ipymeteovis.series import Series
+from ipymeteovis.temp import Temp
+
+xr = pytest.importorskip("xarray")
+
+
+def open_cube(path):
+    if path.endswith(".nc"):
+        return xr.open_dataset(path, engine="h5netcdf")
+    return xr.open_zarr(path, consolidated=False)
+
+
+def frames(t):
+    series = Series(t.temp_path)
+    return [Series.read_frame(series.path + "/" + f)[0]
+            for f in series.frames]
+
+
+@pytest.mark.parametrize("name", ["cube.zarr", "cube.nc"])
+def test_round_trip_and_append(composites, workdir, name):
+    if name.endswith(".zarr"):
+        pytest.importorskip("zarr")
+    Control(composites, backend="thread").submit(copy.deepcopy(COMPOSITE))
+    t = Temp(0)
+    path = str(workdir / name)
+
+    # a temp set that grows: two frames first, then all four
+    c = Cube(t.temp_path)
+    c.frames, c.times = c.frames[:2], c.times[:2]
+    assert c.write(path, group=3, processes=1) == 2
+    c = Cube(t.temp_path)
+    assert c.write(path, group=3, processes=1) == 2
+    assert c.write(path, group=3, processes=1) == 0
+
+    expected = frames(t)
+    with open_cube(path) as ds:
+        assert ds["data"].dims == ("time", "y", "x")
+        np.testing.assert_array_equal(ds["data"].values, np.stack(expected))
+        minutes = (ds["time"].values - ds["time"].values[0]) / \
+            np.timedelta64(1, "m")
+        assert minutes.tolist() == [0, 5, 10, 15]
+        # cell centers of the composite over 2-8 E and 49-54 N
+        assert ds["lat"].dims == ("y",) and ds["lon"].dims == ("x",)
+        assert ds["lat"].values[0] == pytest.approx(54 - 5 / 60 / 2)
+        assert ds["lon"].values[-1] == pytest.approx(8 - 6 / 80 / 2)
+
+
+def test_projected_coords_match_the_cells(workdir):
+    pyproj = pytest.importorskip("pyproj")
+    projdef = "+proj=laea +lat_0=52 +lon_0=5 +ellps=WGS84"
+    proj = pyproj.Proj(projdef)
+    x0, y0 = -300e3, 250e3  # upper left, cells of 10 km
+    where = {"projdef": projdef.encode()}
+    for k, (x, y) in {"UL": (x0, y0), "UR": (-x0, y0), "LL": (x0, -y0),
+                      "LR": (-x0, -y0)}.items():
+        where[k + "_lon"], where[k + "_lat"] = proj(x, y, inverse=True)
+    src = workdir / "src"
+    src.mkdir()
+    write_composite(str(src / "comp.h5"), 0,
+                    np.full((50, 60), 104, np.uint8), where)
+    Control(str(src), backend="thread").submit(copy.deepcopy(COMPOSITE))
+    path = str(workdir / "cube.nc")
+    assert Cube(Temp(0).temp_path).write(path) == 1
+
+    with open_cube(path) as ds:
+        # one center per cell, no extra row
+        assert ds["lat"].dims == ("y", "x")
+        assert ds["lat"].shape == ds["lon"].shape == (50, 60)
+        for r, c in [(0, 0), (20, 30), (49, 59)]:
+            lon, lat = proj(x0 + (c + 0.5) * 10e3, y0 - (r + 0.5) * 10e3,
+                            inverse=True)
+            assert ds["lon"].values[r, c] == pytest.approx(lon, abs=1e-3)
+            assert ds["lat"].values[r, c] == pytest.approx(lat, abs=1e-3)
+
+
+def test_frames_of_another_shape_are_refused(composites, workdir):
+    Control(composites, backend="thread").submit(copy.deepcopy(COMPOSITE))
+    path = str(workdir / "cube.nc")
+    c = Cube(Temp(0).temp_path)
+    c.write(path)
+    c.geometry = (c.geometry[0], (10, 10), c.geometry[2])
+    with pytest.raises(ValueError):
+        c.write(path)
+    assert os.path.exists(path)
@@ -0,0 +1,70 @@
+import copy
+import io
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image, features
+
+from conftest import COMPOSITE
+from test_pipeline import read_outputs
+from ipymeteovis.control import Control
+from ipymeteovis.task import Task2D
+from ipymeteovis.util import TEMP_SET_PATH
+
+ENCODINGS = ["png", "palette"] + (["webp"] if features.check("webp") else [])
+
+
+def colormapped(colors=200):
+    rng = np.random.default_rng(3)
+    lut = rng.integers(0, 256, (colors, 4)).astype(np.uint8)
+    lut[0] = 0  # transparent
+    return lut[rng.integers(0, colors, (50, 70))]
+
+
+def decode(content):
+    return np.array(Image.open(io.BytesIO(content)).convert("RGBA"))
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_encoding_is_lossless(encoding):
+    pixels = colormapped()
+    ext, content = Task2D.encode_image(Image.fromarray(pixels, "RGBA"),
+                                       encoding, level=9)
+    assert ext == (".webp" if encoding == "webp" else ".png")
+    np.testing.assert_array_equal(decode(content), pixels)
+
+
+def test_palette_is_smaller_than_rgba():
+    im = Image.fromarray(colormapped(), "RGBA")
+    assert len(Task2D.encode_image(im, "palette")[1]) < \
+        len(Task2D.encode_image(im, "png")[1])
+
+
+def test_palette_of_many_colours_is_quantized():
+    pixels = colormapped(1000)
+    p, alpha = Task2D.to_palette(Image.fromarray(pixels, "RGBA"))
+    assert p.mode == "P" and alpha is None
+    assert len(p.getcolors(256)) <= 256
+
+
+def test_unknown_encoding_raises():
+    with pytest.raises(ValueError):
+        Task2D.encode_image(Image.new("RGBA", (2, 2)), "gif")
+
+
+def test_encodings_of_a_temp_set_match(composites):
+    images = []
+    for encoding in ENCODINGS:
+        shutil.rmtree(TEMP_SET_PATH + "/.cache", ignore_errors=True)
+        config = copy.deepcopy(COMPOSITE)
+        config["encoding"] = encoding
+        c = Control(composites, backend="thread")
+        t_dir = c.create_set(config)
+        c.run(t_dir, c.file_list)
+        images.append(read_outputs(t_dir)[0])
+    names = [sorted(k.split(".")[0] for k in i) for i in images]
+    assert all(n == names[0] for n in names) and len(names[0]) == 4
+    for other in images[1:]:
+        for a, b in zip(sorted(images[0].items()), sorted(other.items())):
+            np.testing.assert_array_equal(a[1], b[1])
@@ -0,0 +1,59 @@
+import copy
+import os
+
+import pytest
+
+from conftest import COMPOSITE
+from ipymeteovis.control import Control
+from ipymeteovis.util import TEMP_SET_PATH
+
+
+def disk_usage(t_dir):
+    return sum(os.path.getsize(os.path.join(r, f))
+               for r, ds, fs in os.walk(t_dir) for f in fs
+               if r != t_dir and f != "stack.npy")
+
+
+def test_estimate_leaves_no_temp_set(composites):
+    c = Control(composites, backend="thread")
+    e = c.estimate(copy.deepcopy(COMPOSITE), samples=2, processes=2)
+    assert (e["files"], e["cached"], e["samples"]) == (4, 0, 2)
+    assert e["workers"] == 2
+    assert e["wall"] > 0 and e["bytes"] > 0
+    assert {"read", "compute", "save"} <= set(e["stages"])
+    assert os.listdir(TEMP_SET_PATH) == []
+
+    # the output of the samples stands for the output of the set
+    c.submit(copy.deepcopy(COMPOSITE))
+    t_id, = [d for d in os.listdir(TEMP_SET_PATH) if d.isdigit()]
+    size = disk_usage(TEMP_SET_PATH + "/" + t_id)
+    assert e["bytes"] == pytest.approx(size, rel=0.2)
+
+    # files in the cache cost nothing
+    e = c.estimate(copy.deepcopy(COMPOSITE), samples=2, processes=2)
+    assert (e["cached"], e["samples"], e["wall"]) == (4, 0, 0)
+
+
+def test_dataset_range_is_rendered(composites):
+    config = copy.deepcopy(COMPOSITE)
+    config["options"]["range"] = "dataset"
+    e = Control(composites, backend="thread").estimate(config, samples=3,
+                                                        processes=2)
+    assert e["samples"] == 3
+    assert "render" in e["stages"]
+
+
+def test_workers_fit_into_the_memory_budget(composites, monkeypatch):
+    work_item = Control.work_item
+
+    def heavy(item):
+        rs = work_item(item)
+        for r in rs:
+            r["stats"]["peak"] = 100.0  # MB of every file
+        return rs
+
+    monkeypatch.setattr(Control, "work_item", staticmethod(heavy))
+    c = Control(composites, memory_budget=250, backend="thread")
+    e = c.estimate(copy.deepcopy(COMPOSITE), samples=2, processes=4)
+    assert e["workers"] == 2
+    assert e["memory"] == 200
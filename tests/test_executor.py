@@ -0,0 +1,48 @@
+import math
+import threading
+import time
+
+import pytest
+
+from ipymeteovis.executor import Executor, parallel
+
+BACKENDS = ["process", "thread", "dask"]
+
+
+def skip_missing(backend):
+    if backend == "dask":
+        pytest.importorskip("distributed")
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backends_give_the_same_results(backend):
+    skip_missing(backend)
+    seen = []
+    # math.sqrt is picklable by reference on every backend
+    r = parallel(math.sqrt, [0, 1, 4, 9, 16], callback=seen.append,
+                 processes=2, backend=backend)
+    assert r == [0, 1, 2, 3, 4]
+    assert sorted(seen) == r
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_errors_of_jobs_are_raised(backend):
+    skip_missing(backend)
+    with pytest.raises(ValueError):
+        parallel(math.sqrt, [4, -1, 9], processes=2, backend=backend)
+
+
+@pytest.mark.parametrize("backend", ["process", "thread"])
+def test_cancel_stops_dispatching(backend):
+    cancel = threading.Event()
+    start = time.perf_counter()
+    r = parallel(time.sleep, [0] + [2] * 4, callback=lambda r: cancel.set(),
+                 processes=1, cancel=cancel, backend=backend)
+    assert r == [None]
+    # the process pool is terminated, a running thread finishes its job
+    assert time.perf_counter() - start < 3
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        Executor.create("bogus")
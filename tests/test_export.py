@@ -0,0 +1,49 @@
+import copy
+
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence, features
+
+from conftest import COMPOSITE
+from ipymeteovis.control import Control
+from ipymeteovis.temp import Temp
+
+
+@pytest.fixture(params=["png", "palette", "webp"])
+def temp(composites, request):
+    if request.param == "webp" and not features.check("webp"):
+        pytest.skip("Pillow without WebP")
+    config = copy.deepcopy(COMPOSITE)
+    config["encoding"] = request.param  # frames copied or converted
+    Control(composites, backend="thread").submit(config)
+    return Temp(0)
+
+
+def pixels(path):
+    return np.array(Image.open(path).convert("RGBA"))
+
+
+def test_get_frames_skips_other_files(temp):
+    frames = temp.get_frames()
+    assert len(frames) == 4
+    # a file being written by write_atomic
+    with open(frames[0] + ".123.456", "wb") as f:
+        f.write(b"partial")
+    assert temp.get_frames() == frames
+    assert temp.get_frames(stride=2) == frames[::2]
+    assert temp.get_frames(start="2016-10-03 14:05",
+                           end="2016-10-03 14:10") == frames[1:3]
+
+
+@pytest.mark.parametrize("ext", [".png", ".webp"])
+def test_export_round_trip(temp, tmp_path, ext):
+    if ext == ".webp" and not features.check("webp"):
+        pytest.skip("Pillow without WebP")
+    frames = temp.get_frames()
+    path = temp.export(str(tmp_path / ("anim" + ext)), interval=200, loop=3)
+    im = Image.open(path)
+    assert im.n_frames == 4 and im.info["loop"] == 3
+    for k, frame in enumerate(ImageSequence.Iterator(im)):
+        np.testing.assert_array_equal(np.array(frame.convert("RGBA")),
+                                      pixels(frames[k]))
+        assert frame.info["duration"] == 200  # known once loaded
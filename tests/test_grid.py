@@ -0,0 +1,105 @@
+import copy
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import COMPOSITE, write_composite
+from ipymeteovis.control import Control
+from ipymeteovis.series import Series
+from ipymeteovis.task import CompImage2D, ScanIntg2D, Task, Task2D
+from ipymeteovis.temp import Temp
+
+HOT = (10, 20)  # row and column of the only cell with data
+VALUE = 200 * 0.5 - 32
+
+
+def make_set(src, where=None):
+    data = np.zeros((50, 60), np.uint8)
+    data[HOT] = 200
+    write_composite(str(src / "comp.h5"), 0, data, where)
+    c = Control(str(src), backend="thread")
+    c.submit(copy.deepcopy(COMPOSITE))
+    return Temp(0)
+
+
+def mercator(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def opaque_points(t):
+    """Latitude and longitude of the centers of the opaque pixels"""
+    im = np.array(Image.open(t.get_frames()[0]).convert("RGBA"))
+    (lat_min, lon_min), (lat_max, lon_max) = \
+        t.profile["task"]["options"]["Bounds"]
+    h, w = im.shape[:2]
+    rows, cols = np.nonzero(im[..., 3])
+    y0, y1 = mercator(lat_min), mercator(lat_max)
+    ys = y1 - (rows + 0.5) * (y1 - y0) / h
+    lats = np.degrees(2 * np.arctan(np.exp(ys)) - np.pi / 2)
+    lons = lon_min + (cols + 0.5) * (lon_max - lon_min) / w
+    return lats, lons
+
+
+def test_shared_options_and_defaults():
+    keys = [o["key"] for o in Task2D.get_options(None)]
+    assert keys == ["range", "roi"]
+    t = Task(file_path=None, task=COMPOSITE["task"])
+    assert isinstance(t, CompImage2D)
+    assert (t.v_min, t.v_max) == (0, 350)
+    assert (ScanIntg2D(None).v_min, ScanIntg2D(None).v_max) == (1, 10000)
+
+
+def test_composite_options(workdir):
+    write_composite(str(workdir / "c.h5"), 0, np.zeros((5, 6), np.uint8))
+    o = CompImage2D(str(workdir / "c.h5")).get_options()
+    assert [i["key"] for i in o] == ["dset", "qty", "range", "roi"]
+    assert o[1]["options"] == [("DBZH", "data1")]
+
+
+def test_latlong_grid_placement(workdir):
+    src = workdir / "src"
+    src.mkdir()
+    t = make_set(src)
+    lat = 54 - (HOT[0] + 0.5) * 5 / 50
+    lon = 2 + (HOT[1] + 0.5) * 6 / 60
+    times, values = Series(t.temp_path).point(lat, lon)
+    assert values[0] == VALUE
+    assert np.isnan(Series(t.temp_path).point(lat + 0.1, lon)[1][0])
+
+    lats, lons = opaque_points(t)
+    assert len(lats) > 0
+    assert np.all(np.abs(lats - lat) <= 0.05 + 1e-9)
+    assert np.all(np.abs(lons - lon) <= 0.05 + 1e-9)
+
+
+def test_projected_grid_placement(workdir):
+    pyproj = pytest.importorskip("pyproj")
+    projdef = "+proj=laea +lat_0=52 +lon_0=5 +ellps=WGS84"
+    proj = pyproj.Proj(projdef)
+    x0, y0 = -300e3, 250e3  # upper left, cells of 10 km
+    corners = {"UL": (x0, y0), "UR": (-x0, y0), "LL": (x0, -y0),
+               "LR": (-x0, -y0)}
+    where = {"projdef": projdef.encode()}
+    for k, (x, y) in corners.items():
+        where[k + "_lon"], where[k + "_lat"] = proj(x, y, inverse=True)
+    src = workdir / "src"
+    src.mkdir()
+    t = make_set(src, where)
+
+    def center(r, c):
+        return proj(x0 + (c + 0.5) * 10e3, y0 - (r + 0.5) * 10e3,
+                    inverse=True)
+
+    lon, lat = center(*HOT)
+    series = Series(t.temp_path)
+    assert series.point(lat, lon)[1][0] == VALUE
+    for r, c in [(HOT[0] + 1, HOT[1]), (HOT[0], HOT[1] - 1)]:
+        lon_n, lat_n = center(r, c)
+        assert np.isnan(series.point(lat_n, lon_n)[1][0])
+
+    lats, lons = opaque_points(t)
+    assert len(lats) > 0
+    xs, ys = proj(lons, lats)
+    assert np.all(np.abs(xs - (x0 + (HOT[1] + 0.5) * 10e3)) < 5e3 + 1e3)
+    assert np.all(np.abs(ys - (y0 - (HOT[0] + 0.5) * 10e3)) < 5e3 + 1e3)
@@ -0,0 +1,48 @@
+import copy
+import os
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import COMPOSITE
+from ipymeteovis.control import Control
+from ipymeteovis.util import TEMP_SET_PATH, frames_path, read_file
+
+
+def read_outputs(t_dir):
+    temp_path = read_file(t_dir + "/profile.txt")["temp_path"]
+    images = {}
+    for f in sorted(os.listdir(temp_path)):
+        if os.path.isfile(temp_path + "/" + f):
+            images[f] = np.array(Image.open(temp_path + "/" + f)
+                                 .convert("RGBA"))
+    frames = {}
+    fp = frames_path(temp_path)
+    for f in sorted(os.listdir(fp)):
+        if f.endswith(".npz"):
+            with np.load(fp + "/" + f) as z:
+                frames[f] = z["data"]
+    return images, frames
+
+
+@pytest.mark.parametrize("encoding", ["png", "palette"])
+def test_pipeline_matches_workers(composites, encoding):
+    config = copy.deepcopy(COMPOSITE)
+    config["encoding"] = encoding
+    outputs = []
+    for pipeline in [False, True]:
+        shutil.rmtree(TEMP_SET_PATH + "/.cache", ignore_errors=True)
+        c = Control(composites, pipeline=pipeline, backend="thread")
+        t_dir = c.create_set(copy.deepcopy(config))
+        stats = c.run(t_dir, c.file_list)
+        assert stats["summary"]["compute"]["files"] == 4  # not cached
+        outputs.append(read_outputs(t_dir))
+    assert set(stats["pipeline"]) == {"read", "process", "write"}
+    (images, frames), (p_images, p_frames) = outputs
+    assert len(images) == 4 and sorted(images) == sorted(p_images)
+    for k in images:
+        np.testing.assert_array_equal(images[k], p_images[k])
+    for k in frames:
+        np.testing.assert_array_equal(frames[k], p_frames[k])
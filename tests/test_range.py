@@ -0,0 +1,47 @@
+import copy
+import os
+
+import numpy as np
+
+from conftest import COMPOSITE, write_composite
+from ipymeteovis.control import Control
+from ipymeteovis.task import Task
+from ipymeteovis.util import frames_path, read_file
+
+
+def test_dataset_range_from_merged_summaries(workdir):
+    src = workdir / "src"
+    src.mkdir()
+    rng = np.random.default_rng(2)
+    for i in range(4):
+        # every file has its own spread of values
+        data = rng.integers(1, 60 + 60 * i, (60, 80)).astype(np.uint8)
+        write_composite(str(src / ("comp_%d.h5" % i)), i * 5, data)
+    config = copy.deepcopy(COMPOSITE)
+    config["options"]["range"] = "dataset"
+    c = Control(str(src), backend="thread")
+    t_dir = c.create_set(config)
+    c.run(t_dir, c.file_list)
+
+    profile = read_file(t_dir + "/profile.txt")
+    fp = frames_path(profile["temp_path"])
+    frames = sorted(fp + "/" + f for f in os.listdir(fp)
+                    if f.endswith(".npz"))
+    assert len(frames) == 4
+    task = Task(file_path=None, task=config["task"])
+    summary = task.merge([task.read_summary(f) for f in frames])
+
+    # the merged summary is the summary of all the values at once
+    values = []
+    for f in frames:
+        with np.load(f) as z:
+            values.append(z["data"].ravel())
+    task.data = np.ma.masked_invalid(np.concatenate(values))
+    whole = task.summarize()
+    np.testing.assert_array_equal(summary["hist"], whole["hist"])
+    assert summary["count"] == whole["count"]
+    assert (summary["min"], summary["max"]) == (whole["min"], whole["max"])
+
+    v_range = profile["task"]["options"]["Colormap"][1]
+    np.testing.assert_allclose(v_range, task.get_range(summary))
+    assert whole["min"] <= v_range[0] < v_range[1] <= whole["max"]
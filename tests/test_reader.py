@@ -0,0 +1,56 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+
+from conftest import COMPOSITE
+from test_batch import count_opens
+from ipymeteovis.control import Control
+from ipymeteovis.series import Series
+from ipymeteovis.temp import Temp
+
+pytest.importorskip("xarray")
+pytest.importorskip("dask")
+
+
+def test_lazy_array_matches_the_frames(composites, monkeypatch):
+    c = Control(composites, backend="thread")
+    c.submit(copy.deepcopy(COMPOSITE))
+    series = Series(Temp(0).temp_path)
+    frames = [Series.read_frame(series.path + "/" + f)[0]
+              for f in series.frames]
+
+    a = c.open_data(COMPOSITE["task"], COMPOSITE["options"])
+    assert a.dims == ("time", "y", "x")
+    assert a.shape == (4, 60, 80)
+    assert a.name == "DBZH"
+    minutes = (a["time"].values - a["time"].values[0]) / \
+        np.timedelta64(1, "m")
+    assert minutes.tolist() == [0, 5, 10, 15]
+    assert a["lat"].values[0] == pytest.approx(54 - 5 / 60 / 2)
+    assert a["lon"].values[0] == pytest.approx(2 + 6 / 80 / 2)
+
+    # a selection by time reads only its file
+    opens = count_opens(monkeypatch)
+    v = a.isel(time=2).values
+    assert [os.path.basename(f) for f in opens] == ["comp_2.h5"]
+    np.testing.assert_array_equal(v, frames[2])
+    np.testing.assert_array_equal(a.values, np.stack(frames))
+
+
+def test_float32_decoding(composites):
+    c = Control(composites, backend="thread")
+    a = c.open_data(COMPOSITE["task"], COMPOSITE["options"])
+    b = c.open_data(COMPOSITE["task"], COMPOSITE["options"], "float32")
+    assert b.dtype == np.float32
+    np.testing.assert_array_equal(a.values, b.values)
+
+
+def test_unreadable_files_are_skipped(composites, capsys):
+    with open(os.path.join(composites, "comp_9.h5"), "wb") as f:
+        f.write(b"not hdf5")
+    c = Control(composites, backend="thread")
+    a = c.open_data(COMPOSITE["task"], COMPOSITE["options"])
+    assert a.shape[0] == 4
+    assert "[ERROR]" in capsys.readouterr().out
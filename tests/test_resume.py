@@ -0,0 +1,57 @@
+import copy
+import os
+import threading
+
+import numpy as np
+
+from conftest import COMPOSITE, write_composite
+from ipymeteovis.control import Control
+from ipymeteovis.util import TEMP_SET_PATH, read_file
+
+
+def only_set():
+    t_id, = [d for d in os.listdir(TEMP_SET_PATH) if d.isdigit()]
+    return TEMP_SET_PATH + "/" + t_id
+
+
+def test_failed_file_is_resolved_on_resume(composites):
+    bad = composites + "/comp_2.h5"
+    with open(bad, "wb") as f:
+        f.write(b"not a hdf5 file")
+    c = Control(composites, backend="thread")
+    c.submit(copy.deepcopy(COMPOSITE))
+    t_dir = only_set()
+    assert read_file(t_dir + "/profile.txt")["status"] == "incomplete"
+    errors = read_file(t_dir + "/errors.txt")
+    assert [e["file"] for e in errors] == [bad]
+    assert len(Control.read_checkpoint(t_dir)) == 3
+
+    write_composite(bad, 10, np.full((60, 80), 100, np.uint8))
+    c.resume(t_dir)
+    assert read_file(t_dir + "/profile.txt")["status"] == "complete"
+    errors = read_file(t_dir + "/errors.txt")
+    assert len(errors) == 1 and errors[0]["resolved"]
+    assert sorted(Control.read_checkpoint(t_dir)) == sorted(c.file_list)
+
+
+def test_cancelled_submit_resumes_the_rest(composites, monkeypatch):
+    monkeypatch.setattr("multiprocessing.cpu_count", lambda: 1)
+    cancel = threading.Event()
+
+    def progress(done, total):
+        if done:
+            cancel.set()
+
+    c = Control(composites, backend="thread")
+    c.submit(copy.deepcopy(COMPOSITE), cancel=cancel, progress=progress)
+    t_dir = only_set()
+    done = Control.read_checkpoint(t_dir)
+    assert 1 <= len(done) < 4
+    assert read_file(t_dir + "/profile.txt")["status"] == "incomplete"
+
+    processed = []
+    monkeypatch.setattr(Control, "run",
+                        lambda self, t_dir, file_list:
+                        processed.extend(file_list))
+    c.resume(t_dir)
+    assert sorted(processed + done) == sorted(c.file_list)
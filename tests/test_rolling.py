@@ -0,0 +1,72 @@
+import copy
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from conftest import COMPOSITE
+from ipymeteovis.control import Control
+from ipymeteovis.rolling import Rolling
+from ipymeteovis.util import frames_path, read_file
+
+
+def brute_force(op, frames):
+    """Value of an operator over a window of frames, computed directly"""
+    if op == "diff":
+        return frames[-1] - frames[0]
+    valid = np.isfinite(frames).any(axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN cells
+        f = {"sum": np.nansum, "mean": np.nanmean, "max": np.nanmax,
+             "min": np.nanmin}[op]
+        return np.where(valid, f(frames, axis=0), np.nan)
+
+
+@pytest.mark.parametrize("op", Rolling.ops)
+@pytest.mark.parametrize("window", [1, 3, 4])
+def test_rolling_matches_brute_force(op, window):
+    rng = np.random.default_rng(0)
+    frames = rng.normal(10, 5, (13, 6, 7))
+    frames[rng.random(frames.shape) < 0.3] = np.nan
+    frames[:, 0, 0] = np.nan  # a cell missing in all the frames
+
+    r = Rolling(op, window)
+    for t in range(len(frames)):
+        v = r.push(frames[t])
+        if t + 1 < r.window:
+            assert v is None
+            continue
+        expected = brute_force(op, frames[t + 1 - r.window:t + 1])
+        np.testing.assert_allclose(v, expected, rtol=1e-5, equal_nan=True)
+
+
+def test_rolling_rejects_unknown_operator():
+    with pytest.raises(ValueError):
+        Rolling("median", 3)
+
+
+def test_derive_temp_set(composites):
+    c = Control(composites, backend="thread")
+    t_dir = c.create_set(copy.deepcopy(COMPOSITE))
+    c.run(t_dir, c.file_list)
+    new_dir = Control.derive(t_dir, "max", window=2, processes=2)
+
+    def frames(d):
+        fp = frames_path(read_file(d + "/profile.txt")["temp_path"])
+        result = {}
+        for f in sorted(os.listdir(fp)):
+            if f.endswith(".npz"):
+                with np.load(fp + "/" + f) as z:
+                    result[f] = z["data"]
+        return result
+
+    source, derived = frames(t_dir), frames(new_dir)
+    names = sorted(source)
+    assert sorted(derived) == names[1:]
+    for k in range(1, len(names)):
+        np.testing.assert_allclose(derived[names[k]], brute_force(
+            "max", np.stack([source[names[k - 1]], source[names[k]]])))
+    profile = read_file(new_dir + "/profile.txt")
+    assert profile["status"] == "complete"
+    assert profile["task"]["options"]["Derived"] == "max of 2 frames"
@@ -0,0 +1,35 @@
+import copy
+import os
+
+from conftest import COMPOSITE
+from test_batch import count_opens
+from ipymeteovis.control import Control
+from ipymeteovis.util import TEMP_SET_PATH, read_file
+
+
+def test_selections_read_each_file_once(composites, monkeypatch):
+    opens = count_opens(monkeypatch)
+    c = Control(composites, backend="thread")
+    c.submit(copy.deepcopy(COMPOSITE))
+    single = len(opens)
+    assert single >= 4
+    del opens[:]
+
+    config = copy.deepcopy(COMPOSITE)
+    config["selections"] = [
+        dict(COMPOSITE["options"], roi="50, 3, 53, 7"),
+        dict(COMPOSITE["options"], roi="49.5, 2.5, 51, 4"),
+    ]
+    stats = c.submit(config)
+    assert len(stats) == 2
+    assert len(opens) == single
+
+    t_dirs = sorted(TEMP_SET_PATH + "/" + d
+                    for d in os.listdir(TEMP_SET_PATH) if d.isdigit())
+    bounds = []
+    for t_dir in t_dirs[1:]:
+        profile = read_file(t_dir + "/profile.txt")
+        assert profile["status"] == "complete"
+        assert len(Control.read_checkpoint(t_dir)) == 4
+        bounds.append(profile["task"]["options"]["Bounds"])
+    assert bounds[0] != bounds[1]
@@ -0,0 +1,46 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+
+from conftest import COMPOSITE
+from ipymeteovis.control import Control
+from ipymeteovis.stats import Stats
+from ipymeteovis.util import TEMP_SET_PATH, read_file
+
+
+def can_reset_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def test_stage_peak_is_not_the_process_peak():
+    if not can_reset_peak():
+        pytest.skip("the peak RSS cannot be reset on this system")
+    s = Stats("f")
+    with s.measure("heavy"):
+        a = np.ones(200 * 1024 ** 2 // 8)  # 200 MB, touched
+        del a
+    with s.measure("light"):
+        b = np.ones(1000)
+    assert s.stages["heavy"]["rss"] > 150
+    assert s.stages["light"]["rss"] < 50
+    assert s.to_dict()["peak"] >= s.stages["heavy"]["rss"]
+    assert b.sum() == 1000
+
+
+def test_submit_writes_stats(composites):
+    c = Control(composites, backend="thread")
+    c.submit(copy.deepcopy(COMPOSITE))
+    t_id, = [d for d in os.listdir(TEMP_SET_PATH) if d.isdigit()]
+    stats = read_file(TEMP_SET_PATH + "/" + t_id + "/stats.txt")
+    assert len(stats["files"]) == 4
+    assert all("peak" in r for r in stats["files"])
+    for stage in ["read", "compute", "save"]:
+        assert stats["summary"][stage]["files"] == 4
+    assert "Stage peak (MB)" in Stats.to_html(stats)
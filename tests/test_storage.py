@@ -0,0 +1,169 @@
+import copy
+import os
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from ipymeteovis.control import Control
+from ipymeteovis.storage import Storage, Cache
+from ipymeteovis.util import TEMP_SET_PATH, frames_path, read_file
+
+from conftest import COMPOSITE, write_composite
+
+
+def make(source, name, **options):
+    """Make a temp set of the composites, return its directory"""
+    config = copy.deepcopy(COMPOSITE)
+    config["name"] = name
+    config["options"].update(options)
+    before = os.listdir(TEMP_SET_PATH)
+    Control(source, backend="thread").submit(config)
+    t_dir, = [d for d in os.listdir(TEMP_SET_PATH)
+              if d not in before and not d.startswith(".")]
+    return TEMP_SET_PATH + "/" + t_dir
+
+
+def images(t_dir):
+    path = t_dir + "/temp"
+    return {f: np.array(Image.open(path + "/" + f)) for f in os.listdir(path)}
+
+
+def test_cache_hit_links_files(composites):
+    a = make(composites, "a")
+    b = make(composites, "b")
+    assert read_file(b + "/profile.txt")["config"]["name"] == "b"
+    for d in ["temp", "frames"]:
+        fa = sorted(f for f in os.listdir(a + "/" + d) if f != "stack.npy")
+        fb = sorted(f for f in os.listdir(b + "/" + d) if f != "stack.npy")
+        assert fa == fb and len(fa) == 4
+        for f in fb:
+            # the same file as the first set and the cache entry
+            assert os.path.samefile(a + "/" + d + "/" + f,
+                                    b + "/" + d + "/" + f)
+            assert os.stat(b + "/" + d + "/" + f).st_nlink == 3
+    assert len(os.listdir(TEMP_SET_PATH + "/.cache")) == 4
+
+
+def test_cache_miss_on_other_options(composites):
+    a = make(composites, "a")
+    b = make(composites, "b", range="dataset")
+    for f in os.listdir(b + "/temp"):
+        assert not os.path.samefile(a + "/temp/" + f, b + "/temp/" + f)
+    assert len(os.listdir(TEMP_SET_PATH + "/.cache")) == 8
+
+
+def test_prune_keeps_linked_entries(composites):
+    a = make(composites, "a")
+    b = make(composites, "b")
+    shutil.rmtree(b)
+    assert Cache.prune() == 0
+    assert len(os.listdir(TEMP_SET_PATH + "/.cache")) == 4
+
+    # entries of a set whose images are evicted only hold the images
+    Storage.clear(a)
+    assert Cache.prune() > 0
+    assert os.listdir(TEMP_SET_PATH + "/.cache") == []
+    assert len(os.listdir(frames_path(a + "/temp"))) == 4
+
+
+def entries():
+    path = TEMP_SET_PATH + "/.cache"
+    return {k: read_file(path + "/" + k + "/entry.txt")["files"]
+            for k in os.listdir(path)}
+
+
+def test_prune_by_the_files_of_an_entry(composites):
+    a = make(composites, "a")
+    b = make(composites, "b", range="dataset")
+    # images of a dataset-wide range are rendered afterwards, not cached
+    kinds = sorted(sorted(d for d, f in files)
+                   for files in entries().values())
+    assert kinds == [["frames"]] * 4 + [["frames", "temp"]] * 4
+
+    # the frames of b are still linked, the images of a are not
+    Storage.clear(a)
+    Storage.clear(b)
+    Cache.prune()
+    assert sorted(entries().values()) == sorted(
+        [[("frames", f)] for f in os.listdir(frames_path(b + "/temp"))
+         if f.endswith(".npz")])
+    shutil.rmtree(b)
+    Cache.prune()
+    assert entries() == {}
+
+
+def test_entries_hold_the_grid(workdir):
+    pyproj = pytest.importorskip("pyproj")
+    projdef = "+proj=laea +lat_0=52 +lon_0=5 +ellps=WGS84"
+    proj = pyproj.Proj(projdef)
+    where = {"projdef": projdef.encode()}
+    for k, (x, y) in {"UL": (-300e3, 250e3), "UR": (300e3, 250e3),
+                      "LL": (-300e3, -250e3), "LR": (300e3, -250e3)}.items():
+        where[k + "_lon"], where[k + "_lat"] = proj(x, y, inverse=True)
+    src = workdir / "src"
+    src.mkdir()
+    write_composite(str(src / "comp.h5"), 0,
+                    np.full((50, 60), 104, np.uint8), where)
+    make(str(src), "a")
+    b = make(str(src), "b")
+    files, = entries().values()
+    grid, = [f for d, f in files if f.startswith("grid_")]
+    assert os.path.samefile(TEMP_SET_PATH + "/.cache/" +
+                            list(entries())[0] + "/" + grid,
+                            frames_path(b + "/temp") + "/" + grid)
+
+
+def test_quota_evicts_images_then_sets(composites):
+    Storage.set_quota(10000)
+    a = make(composites, "a")
+    b = make(composites, "b", range="dataset")
+    assert Storage.read_access(a)["quota"]
+    Storage.pin(b)
+    Storage.touch(a)
+    total = Storage.get_total()
+    assert total > 0
+
+    # the images of a are enough to meet this quota
+    images_a = Storage.get_usage(a)["images"]
+    quota = (total - images_a / 2) / 1024 ** 2
+    assert Storage.evict(quota=quota) == [a]
+    assert os.listdir(a + "/temp") == []
+    assert len(os.listdir(frames_path(a + "/temp"))) == 4
+    assert Storage.read_access(a)["evicted"]
+    assert Storage.get_total() <= quota * 1024 ** 2
+
+    # the pinned set stays, a is removed as a whole
+    assert Storage.evict(quota=0) == [a]
+    assert not os.path.exists(a)
+    assert os.path.exists(b)
+
+
+def test_sets_made_without_quota_keep_their_frames(composites):
+    a = make(composites, "a")
+    assert not Storage.read_access(a)["quota"]
+    # a set of an older version, without frames
+    old = make(composites, "old", range="dataset")
+    shutil.rmtree(frames_path(old + "/temp"))
+    shutil.rmtree(TEMP_SET_PATH + "/.cache")
+    Storage.touch(a)
+
+    assert Storage.evict(quota=0) == [a]
+    assert os.listdir(a + "/temp") == []
+    assert len(os.listdir(frames_path(a + "/temp"))) == 4
+    assert len(os.listdir(old + "/temp")) == 4
+    assert Storage.evict(quota=0) == []
+
+
+def test_restore_renders_evicted_images(composites):
+    a = make(composites, "a")
+    before = images(a)
+    Storage.clear(a)
+    assert images(a) == {}
+    Control.restore(a, processes=2)
+    after = images(a)
+    assert sorted(after) == sorted(before)
+    for f in before:
+        np.testing.assert_array_equal(after[f], before[f])
+    assert not Storage.read_access(a)["evicted"]
@@ -0,0 +1,57 @@
+import copy
+import threading
+
+import pytest
+
+from conftest import COMPOSITE
+from ipymeteovis.control import Control
+
+pytest.importorskip("ipyleaflet")
+from ipymeteovis.view import View  # noqa: E402
+
+
+@pytest.fixture
+def sets(composites):
+    c = Control(composites, backend="thread")
+    for encoding in ["png", "webp"]:
+        config = copy.deepcopy(COMPOSITE)
+        config["encoding"] = encoding
+        c.submit(config)
+    return [0, 1]
+
+
+def test_layers_are_read_in_threads_and_shown_here(sets, monkeypatch):
+    reads, applies = [], []
+    read, apply = View.Layer.read, View.Layer.apply
+
+    def counted_read(self):
+        reads.append(threading.get_ident())
+        return read(self)
+
+    def counted_apply(self, content):
+        applies.append(threading.get_ident())
+        return apply(self, content)
+
+    monkeypatch.setattr(View.Layer, "read", counted_read)
+    monkeypatch.setattr(View.Layer, "apply", counted_apply)
+    v = View(*sets, grid=True)
+    assert not any(l.loaded for l in v.layers)
+    v.load()
+    assert len(reads) == 2 and len(applies) == 2
+    assert applies == [threading.get_ident()] * 2
+    for l in v.layers:
+        assert l.loaded and len(l.file_list) == 4
+        assert l.layer.url.startswith("data:image/")
+        assert bytes(l.legend.value).startswith(b"\x89PNG")
+    # one legend per colormap
+    assert v.layers[0].legend.value == v.layers[1].legend.value
+    v.load()
+    assert len(reads) == 2
+
+
+def test_animated_and_average_layers(sets):
+    for kwargs in [{"anim": True}, {"avg": True}]:
+        v = View(sets[0], **kwargs)
+        v.load()
+        assert v.layers[0].layer.url.startswith("data:image/")
+        assert len(v.layers[0].layer.url) > 1000
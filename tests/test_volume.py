@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from conftest import write_volume
+from ipymeteovis.task import Task, VolProd2D
+
+TASK = "Radar volume product (2D)"
+ELEVATIONS = [0.5, 1.5, 3.0]
+VALUES = [0.0, 10.0, 20.0]  # dBZ of each scan
+
+
+@pytest.fixture
+def volume(workdir):
+    scans = []
+    for el, v in zip(ELEVATIONS, VALUES):
+        data = np.full((360, 240), (v + 32) / 0.5, np.uint8)
+        data[:, 200:] = 0  # undetect beyond 100 km
+        scans.append((el, data))
+    fp = str(workdir / "pvol.h5")
+    write_volume(fp, 0, scans)
+    return fp
+
+
+def distances(task):
+    """Great circle distance in km of the cell centers from the radar"""
+    (lat_min, lon_min), (lat_max, lon_max) = task.bounds
+    nrows, ncols = task.data.shape
+    lat = np.radians(lat_max - (np.arange(nrows) + 0.5) *
+                     (lat_max - lat_min) / nrows)[:, None]
+    lon = np.radians(lon_min + (np.arange(ncols) + 0.5) *
+                     (lon_max - lon_min) / ncols)[None, :]
+    phi0, lambda0 = np.radians(52.0), np.radians(5.0)
+    a = np.sin((lat - phi0) / 2) ** 2 + np.cos(phi0) * np.cos(lat) * \
+        np.sin((lon - lambda0) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+def process(fp, monkeypatch=None, **options):
+    t = Task(file_path=fp, task=TASK)
+    captured = {}
+    if monkeypatch is not None:
+        get_cappi = VolProd2D.get_cappi
+
+        def capture(self, values, heights, altitude, interp):
+            captured.update(values=values, heights=heights)
+            return get_cappi(self, values, heights, altitude, interp)
+
+        monkeypatch.setattr(VolProd2D, "get_cappi", capture)
+    t.process({"task": TASK, "options": dict(qty="DBZH", **options)})
+    return t, captured
+
+
+def test_options(volume):
+    o = Task(file_path=volume, task=TASK).get_options()
+    assert [i["key"] for i in o] == ["qty", "product", "altitude", "interp",
+                                     "resolution", "range", "roi",
+                                     "max_range"]
+    assert o[0]["options"] == [("DBZH", "DBZH")]
+
+
+def test_column_max(volume):
+    t, _ = process(volume, product="max")
+    d = distances(t)
+    data = np.ma.filled(t.data, np.nan)
+    assert t.data.shape == (240, 240)  # 1 km cells over 120 km each side
+    # the highest scan has the highest values wherever it reaches
+    np.testing.assert_array_equal(data[d < 95], 20.0)
+    assert np.all(np.isnan(data[d > 101]))
+    assert set(np.unique(data[np.isfinite(data)])) <= set(VALUES)
+
+
+def test_gates_follow_the_beam(volume, monkeypatch):
+    wrl = pytest.importorskip("wradlib")
+    t, captured = process(volume, monkeypatch, product="cappi")
+    d = distances(t)
+    for k, el in enumerate(ELEVATIONS):
+        h = captured["heights"][k]
+        valid = np.isfinite(h)
+        assert valid[d < 115].all() and not valid[d > 121].any()
+        # slant range of the beam over the ground distance of the cells
+        r = np.linspace(0, 125e3, 2501)
+        s = wrl.georef.site_distance(r, el, wrl.georef.bin_altitude(
+            r, el, 50.0, re=6371000.0, ke=4 / 3), re=6371000.0, ke=4 / 3)
+        alt = wrl.georef.bin_altitude(r, el, 50.0, re=6371000.0, ke=4 / 3)
+        expected = np.interp(d[valid] * 1000, s, alt) / 1000
+        np.testing.assert_allclose(h[valid], expected, atol=0.01)
+
+
+@pytest.mark.parametrize("interp", ["linear", "nearest"])
+def test_cappi(volume, monkeypatch, interp):
+    t, captured = process(volume, monkeypatch, product="cappi",
+                          altitude=2.0, interp=interp)
+    data = np.ma.filled(t.data, np.nan)
+    h, v = captured["heights"], captured["values"]
+    idx = np.indices(data.shape)
+    k_b = np.argmax(np.where(h <= 2.0, h, -np.inf), axis=0)
+    k_a = np.argmin(np.where(h > 2.0, h, np.inf), axis=0)
+    h_b, h_a = h[k_b, idx[0], idx[1]], h[k_a, idx[0], idx[1]]
+    v_b, v_a = v[k_b, idx[0], idx[1]], v[k_a, idx[0], idx[1]]
+    # scans with data below and above the altitude
+    both = (h_b <= 2.0) & (h_a > 2.0) & np.isfinite(v_b) & np.isfinite(v_a)
+    assert both.sum() > 1000
+    w = ((2.0 - h_b) / (h_a - h_b))[both]
+    v_b, v_a = v_b[both], v_a[both]
+    if interp == "linear":
+        np.testing.assert_allclose(data[both], v_b + w * (v_a - v_b),
+                                   rtol=1e-5, atol=1e-4)
+        assert np.all((data[both] >= 0) & (data[both] <= 20))
+        assert len(np.unique(data[both])) > 100
+    else:
+        np.testing.assert_array_equal(data[both],
+                                      np.where(w <= 0.5, v_b, v_a))
+    # no scan within a km of the altitude
+    with np.errstate(invalid="ignore"):
+        near = np.nanmin(np.abs(np.where(np.isfinite(v), h, np.nan) - 2.0),
+                         axis=0)
+    assert np.all(np.isnan(data[~(near <= 1.0)]))
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from ipymeteovis.task import Task2D, WARP_SIZE
+
+
+def mercator(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def pixel_lats(bounds, height):
+    """Latitudes of the centers of the pixel rows of a Web Mercator image"""
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    y0, y1 = mercator(lat_min), mercator(lat_max)
+    ys = y1 - (np.arange(height) + 0.5) * (y1 - y0) / height
+    return np.degrees(2 * np.arctan(np.exp(ys)) - np.pi / 2)
+
+
+@pytest.mark.parametrize("bounds", [
+    ((49.0, 2.0), (54.0, 8.0)),
+    ((60.0, -20.0), (80.0, 40.0)),  # cells shrink a lot towards the pole
+    ((-10.0, 100.0), (10.0, 120.0)),  # across the equator
+    ((-80.0, 0.0), (-60.0, 10.0))
+])
+def test_regular_grid_rows_and_columns(bounds):
+    shape = (40, 30)
+    idx = Task2D.get_warp("", ("", shape, bounds))
+    assert not idx.flags.writeable
+    height, width = idx.shape
+    assert width == shape[1]
+    # every row and every column of cells gets pixels
+    rows, cols = np.divmod(idx, shape[1])
+    assert sorted(set(rows.ravel())) == list(range(shape[0]))
+    assert np.all(cols == np.arange(width))
+    # a pixel shows the cell of its center
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    expected = np.floor((lat_max - pixel_lats(bounds, height)) /
+                        (lat_max - lat_min) * shape[0])
+    np.testing.assert_array_equal(rows[:, 0], expected)
+    # rows are not much taller than needed
+    assert height < 2 * shape[0] * (mercator(lat_max) - mercator(lat_min)) / \
+        np.radians(lat_max - lat_min) * np.cos(np.radians(
+            min(max(0.0, lat_min), lat_max)))
+
+
+def test_irregular_grid(tmp_path):
+    bounds = ((50.0, 3.0), (52.0, 7.0))
+    # corners of a grid of 20 x 40 cells, skewed to the east northwards
+    lat = np.linspace(52.0, 50.0, 21)[:, None] * np.ones((1, 41))
+    lon = np.linspace(3.0, 6.0, 41)[None, :] + (lat - 50.0) / 2
+    np.save(str(tmp_path / "grid_skew.npy"), np.stack([lon, lat], axis=-1))
+    idx = Task2D.get_warp(str(tmp_path), ("skew", (20, 40), bounds))
+    height, width = idx.shape
+    assert width == WARP_SIZE
+    assert height == round(WARP_SIZE * (mercator(52) - mercator(50)) /
+                           np.radians(4))
+    lats = pixel_lats(bounds, height)
+    lons = 3 + (np.arange(width) + 0.5) * 4 / width
+    for r, c in [(10, 600), (height // 2, width // 2), (height - 5, 200)]:
+        cell = idx[r, c]
+        row = int((52 - lats[r]) / 0.1)
+        col = int((lons[c] - (lats[r] - 50) / 2 - 3) / 0.075)
+        # the skew is linear, pixels near cell borders may go either way
+        assert abs(cell // 40 - row) <= 1 and abs(cell % 40 - col) <= 1
+    # outside the skewed grid
+    assert idx[0, 0] == -1 and idx[-1, -1] == -1